@@ -1,3 +1,6 @@
+import numpy as np
+
+
 # value function for a given state (reserve,supply)
 def invariant(reserve, supply, kappa):
     return (supply**kappa)/reserve
@@ -51,13 +54,39 @@ class AugmentedBondingCurve:
         token_supply_initial (millions)
         kappa (the exponent part of the curve, default is 2)
         """
-        self.kappa = kappa
-        self.invariant = invariant(
+        self._kappa = kappa
+        self._invariant = invariant(
             reserve_initial, token_supply_initial, kappa)
+        self._update_constants()
 
     def __repr__(self):
         return "ABC Kappa: {}, Invariant: {}".format(self.kappa, self.invariant)
 
+    @property
+    def kappa(self):
+        return self._kappa
+
+    @kappa.setter
+    def kappa(self, kappa):
+        self._kappa = kappa
+        self._update_constants()
+
+    @property
+    def invariant(self):
+        return self._invariant
+
+    @invariant.setter
+    def invariant(self, invariant):
+        self._invariant = invariant
+        self._update_constants()
+
+    def _update_constants(self):
+        # The parts of spot_price() and supply() that only depend on kappa and
+        # the invariant, worked out once instead of on every query
+        self._supply_exponent = 1/self._kappa
+        self._price_exponent = (self._kappa-1)/self._kappa
+        self._invariant_root = self._invariant**(1/self._kappa)
+
     def deposit(self, dai_millions, current_reserve, current_token_supply):
         # Returns number of new tokens minted, and their realized price
         tokens, realized_price = mint(
@@ -70,8 +99,61 @@ class AugmentedBondingCurve:
             tokens_millions, current_reserve, current_token_supply, self.kappa, self.invariant)
         return dai_millions, realized_price
 
+    def deposit_batch(self, dai_millions, current_reserve, current_token_supply):
+        """
+        Settles an ordered array of deposits in one go. Since the token supply
+        is a function of the reserve alone, the reserve after every deposit is
+        just a cumulative sum, and each deposit mints the difference in supply
+        between consecutive reserves.
+
+        Returns the tokens minted and the realized price for every deposit,
+        and the final (reserve, token_supply) of the pool. A deposit of 0
+        mints nothing, at the spot price.
+        """
+        dai_millions = np.asarray(dai_millions, dtype=float)
+        reserves = current_reserve + np.cumsum(dai_millions)
+        supplies = self.get_token_supply(reserves)
+        previous_reserves = np.concatenate(([current_reserve], reserves[:-1]))
+        previous_supplies = np.concatenate(
+            ([current_token_supply], supplies[:-1]))
+
+        trades = dai_millions != 0
+        tokens = np.where(trades, supplies - previous_supplies, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            realized_prices = np.where(
+                trades, dai_millions/tokens, self.get_token_price(previous_reserves))
+        final_reserve = reserves[-1] if len(reserves) else current_reserve
+        final_supply = supplies[-1] if len(supplies) else current_token_supply
+        return tokens, realized_prices, final_reserve, final_supply
+
+    def burn_batch(self, tokens_millions, current_reserve, current_token_supply):
+        """
+        Settles an ordered array of burns in one go, the mirror image of
+        deposit_batch(): the supply after every burn is a cumulative sum, and
+        the reserve follows from the supply.
+
+        Returns the DAI returned (excluding exit tribute) and the realized
+        price for every burn, and the final (reserve, token_supply) of the pool.
+        A burn of 0 returns nothing, at the spot price.
+        """
+        tokens_millions = np.asarray(tokens_millions, dtype=float)
+        supplies = current_token_supply - np.cumsum(tokens_millions)
+        reserves = (supplies**self.kappa)/self.invariant
+        previous_reserves = np.concatenate(([current_reserve], reserves[:-1]))
+
+        trades = tokens_millions != 0
+        dai_millions = np.where(trades, previous_reserves - reserves, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            realized_prices = np.where(
+                trades, dai_millions/tokens_millions, self.get_token_price(previous_reserves))
+        final_reserve = reserves[-1] if len(reserves) else current_reserve
+        final_supply = supplies[-1] if len(supplies) else current_token_supply
+        return dai_millions, realized_prices, final_reserve, final_supply
+
     def get_token_price(self, current_reserve):
-        return spot_price(current_reserve, self.kappa, self.invariant)
+        # spot_price(), with the constants worked out in advance
+        return self._kappa*current_reserve**self._price_exponent/self._invariant_root
 
     def get_token_supply(self, current_reserve):
-        return supply(current_reserve, self.kappa, self.invariant)
+        # supply(), with the constants worked out in advance
+        return (self._invariant*current_reserve)**self._supply_exponent
@@ -1,5 +1,8 @@
 from abcurve import AugmentedBondingCurve, invariant, supply, spot_price, mint, withdraw
 import unittest
+import warnings
+
+import numpy as np
 
 
 class TestOriginalEquations(unittest.TestCase):
@@ -30,6 +33,21 @@ class TestAugmentedBondingCurve(unittest.TestCase):
 
         self.assertEqual(abc.get_token_price(2), 2.8284271247461903)
 
+    def test_cached_constants(self):
+        """
+        The constants worked out in advance give exactly the same results as
+        the equations, also after kappa or the invariant change.
+        """
+        abc = AugmentedBondingCurve(70000, 500000, kappa=2)
+        reserves = [1, 2.5, 70000, 123456.789]
+        for kappa, i in [(2, abc.invariant), (3, abc.invariant), (3, 0.7)]:
+            abc.kappa = kappa
+            abc.invariant = i
+            for r in reserves:
+                self.assertEqual(abc.get_token_price(r),
+                                 spot_price(r, kappa, i))
+                self.assertEqual(abc.get_token_supply(r), supply(r, kappa, i))
+
     def test_deposit(self):
         abc = AugmentedBondingCurve(1, 1, kappa=2)
         old_current_reserve = 1
@@ -48,3 +66,69 @@ class TestAugmentedBondingCurve(unittest.TestCase):
         dai_million_returned, realized_price = abc.burn(0.5, 1, 1)
         self.assertEqual(dai_million_returned, 0.75)
         self.assertEqual(realized_price, 1.5)
+
+    def test_deposit_batch(self):
+        """
+        Settling several deposits at once should give the same result as
+        depositing them one after the other.
+        """
+        abc = AugmentedBondingCurve(1, 1, kappa=2)
+        deposits = [4, 0.5, 2.25]
+
+        reserve, supply = 1, 1
+        expected_tokens, expected_prices = [], []
+        for d in deposits:
+            tokens, realized_price = abc.deposit(d, reserve, supply)
+            reserve += d
+            supply += tokens
+            expected_tokens.append(tokens)
+            expected_prices.append(realized_price)
+
+        tokens, realized_prices, final_reserve, final_supply = abc.deposit_batch(
+            deposits, 1, 1)
+        np.testing.assert_allclose(tokens, expected_tokens)
+        np.testing.assert_allclose(realized_prices, expected_prices)
+        self.assertAlmostEqual(final_reserve, reserve)
+        self.assertAlmostEqual(final_supply, supply)
+
+    def test_burn_batch(self):
+        abc = AugmentedBondingCurve(1, 1, kappa=2)
+        burns = [0.5, 0.1, 0.2]
+
+        reserve, supply = 1, 1
+        expected_dai, expected_prices = [], []
+        for b in burns:
+            dai, realized_price = abc.burn(b, reserve, supply)
+            reserve -= dai
+            supply -= b
+            expected_dai.append(dai)
+            expected_prices.append(realized_price)
+
+        dai, realized_prices, final_reserve, final_supply = abc.burn_batch(
+            burns, 1, 1)
+        np.testing.assert_allclose(dai, expected_dai)
+        np.testing.assert_allclose(realized_prices, expected_prices)
+        self.assertAlmostEqual(final_reserve, reserve)
+        self.assertAlmostEqual(final_supply, supply)
+
+    def test_zero_trades_in_a_batch(self):
+        abc = AugmentedBondingCurve(1, 1, kappa=2)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            tokens, realized_prices, _, _ = abc.deposit_batch([0, 4, 0], 1, 1)
+            dai, burn_prices, _, _ = abc.burn_batch([0, 0.5, 0], 1, 1)
+
+        self.assertEqual((tokens[0], tokens[2]), (0, 0))
+        self.assertEqual(realized_prices[0], abc.get_token_price(1))
+        self.assertEqual(realized_prices[2], abc.get_token_price(5))
+        self.assertEqual(tokens[1], abc.deposit_batch([4], 1, 1)[0][0])
+
+        self.assertEqual((dai[0], dai[2]), (0, 0))
+        self.assertEqual(burn_prices[0], abc.get_token_price(1))
+        self.assertEqual(burn_prices[2], abc.get_token_price(1 - dai[1]))
+
+    def test_empty_batch(self):
+        abc = AugmentedBondingCurve(1, 1, kappa=2)
+        tokens, _, final_reserve, final_supply = abc.deposit_batch([], 1, 1)
+        self.assertEqual(len(tokens), 0)
+        self.assertEqual((final_reserve, final_supply), (1, 1))
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Times the expensive parts of the simulation at growing numbers of
+Participants, and keeps track of how much memory they need at their peak:
+
+    python benchmark.py --save benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json
+
+Every case runs at each scale (the number of Participants, with a
+Proposal for every 1000 of them but at least 3), unless the scale is above
+the case's max_scale, which is there for cases whose output is quadratic in
+the number of Participants. With --compare, results that got slower or
+bigger than the baseline by more than --tolerance are reported as
+regressions, and the exit status is 1. benchmark_baseline.json holds the
+results of the last accepted run; results from a different machine (see its
+"machine") are only a rough guide.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple
+
+import numpy as np
+
+import simulation
+from entities import Proposal
+from executor import run_substep
+from hatch import Commons, create_token_batches
+from network_utils import (_add_node, add_proposal, bootstrap_network,
+                           calc_median_affinity, create_network,
+                           setup_conflict_edges,
+                           setup_influence_edges_bulk,
+                           setup_influence_edges_single, setup_support_edges)
+from policies import (ActiveProposals, CandidateProposals, GenerateNewFunding,
+                      GenerateNewParticipant, GenerateNewProposal)
+from supportmatrix import SupportMatrix
+from utils import RandomStream, set_rng
+
+default_scales = [10**2, 10**3, 10**4, 10**5]
+
+# About e^-4 of all pairs of Participants get an influence edge. Only those
+# are ever drawn (see network_utils.draw_influences()), but beyond this scale
+# there are too many of them to keep as networkx edges: 1.8 million at 10^4,
+# 180 million at 10^5. A new Participant only gets influence edges to and from
+# the others, so setup_influence_edges_single runs at every scale.
+influence_max_scale = 10**4
+
+# Differences below these are noise, not regressions
+min_time = 1e-3  # seconds
+min_peak_memory = 1e5  # bytes
+
+
+def n_proposals(scale: int) -> int:
+    return max(3, scale // 1000)
+
+
+def make_state(scale: int, influence: bool = None, event_driven=False) -> Dict:
+    """
+    A state like simulation.bootstrap_state() makes, with scale hatchers. The
+    influence edges are left out if influence is False, which by default it is
+    above influence_max_scale. The median affinity has been asked for once,
+    so that the affinities are sorted like they are after the first timestep.
+    With event_driven, the state has the variables that
+    simulation.event_driven_blocks need, and no Participant is due to arrive,
+    so that a timestep shows what skipping the arrival block saves.
+    """
+    if influence is None:
+        influence = scale <= influence_max_scale
+    params = simulation.default_params
+    rng = np.random.default_rng(scale)
+    contributions = (rng.random(scale) * 10e5).tolist()
+    token_batches, initial_token_supply = create_token_batches(
+        contributions, 0.1, 60)
+    commons = Commons(sum(contributions), initial_token_supply,
+                      exit_tribute=params["exit_tribute"], kappa=params["kappa"])
+
+    if influence:
+        network = bootstrap_network(token_batches, n_proposals(
+            scale), commons._funding_pool, commons._token_supply)
+    else:
+        network = setup_conflict_edges(make_network(scale, token_batches))
+    calc_median_affinity(network)
+
+    state = {
+        "network": network,
+        "commons": commons,
+        "funding_pool": commons._funding_pool,
+        "collateral_pool": commons._collateral_pool,
+        "token_supply": commons._token_supply,
+        "sentiment": 0.5,
+        "timestep": 1,
+        "substep": 0,
+    }
+    if event_driven:
+        state["participant_next_arrival"] = state["timestep"] + 1000
+        state["participant_arrival_rate"] = (1 + state["sentiment"])/10
+    return state
+
+
+def make_network(scale: int, token_batches=None, support_edges=True):
+    """
+    A network with scale Participants (holding token_batches, if given) and
+    their Proposals, with support edges unless support_edges is False, but no
+    other edges.
+    """
+    if token_batches is None:
+        token_batches, _ = create_token_batches([1000] * scale, 0.1, 60)
+    network = create_network(token_batches)
+    for _ in range(n_proposals(scale)):
+        if support_edges:
+            network, _ = add_proposal(network, Proposal(1000, 0))
+        else:
+            _add_node(network, len(network.nodes), Proposal(1000, 0))
+    return network
+
+
+def run_timestep(state: Dict, params: Dict, blocks: List[Dict] = None) -> Dict:
+    """
+    Runs one timestep of partial_state_update_blocks on the native executor.
+    """
+    blocks = blocks or simulation.partial_state_update_blocks
+    sL = [state]
+    for substep, block in enumerate(blocks, start=1):
+        state = run_substep(params, substep, sL, state, block)
+        sL.append(state)
+    return state
+
+
+class Case(NamedTuple):
+    name: str
+    # makes the arguments for run from the scale, outside of the timing
+    setup: Callable[[int], tuple]
+    run: Callable
+    max_scale: int = max(default_scales)
+
+
+def _policy_case(name, policy):
+    def setup(scale):
+        return simulation.default_params, 1, [], make_state(scale)
+    return Case(name, setup, policy)
+
+
+def _support_matrix(scale):
+    """
+    A SupportMatrix with scale Participants and their Proposals, whose
+    affinity_median is up to date, and the affinities of a Proposal to add.
+    """
+    rng = np.random.default_rng(scale)
+    support = SupportMatrix(row_capacity=scale)
+    for i in range(scale):
+        support.add_participant(i, [])
+    for j in range(n_proposals(scale)):
+        support.add_proposal(scale + j, rng.random(scale))
+    support.affinity_median.median()
+    return support, rng.random(scale)
+
+
+def _add_proposal(support, affinity):
+    support.add_proposal(support.n_rows + support.n_cols, affinity)
+
+
+def _deposits(scale):
+    commons = make_state(10)["commons"]
+    rng = np.random.default_rng(scale)
+    return commons, rng.exponential(100, size=scale)
+
+
+def _deposit_each(commons, dai):
+    for x in dai.tolist():
+        commons.deposit(x)
+
+
+def _burn_each(commons, dai):
+    for x in dai.tolist():
+        commons.burn(x)
+
+
+cases = [
+    Case("bootstrap_network",
+         lambda scale: (create_token_batches([1000] * scale, 0.1, 60)[0],
+                        n_proposals(scale), 3000, 4e6),
+         bootstrap_network, influence_max_scale),
+    Case("setup_support_edges",
+         lambda scale: (make_network(scale, support_edges=False),),
+         setup_support_edges),
+    Case("setup_influence_edges_bulk",
+         lambda scale: (make_network(scale),), setup_influence_edges_bulk,
+         influence_max_scale),
+    Case("setup_influence_edges_single",
+         lambda scale: (make_network(scale), 0), setup_influence_edges_single),
+    _policy_case("GenerateNewParticipant.p_randomly",
+                 GenerateNewParticipant.p_randomly),
+    _policy_case("GenerateNewProposal.p_randomly",
+                 GenerateNewProposal.p_randomly),
+    _policy_case("GenerateNewFunding.p_exit_tribute_of_average_speculator_position_size",
+                 GenerateNewFunding.p_exit_tribute_of_average_speculator_position_size),
+    _policy_case("ActiveProposals.p_influenced_by_grant_size",
+                 ActiveProposals.p_influenced_by_grant_size),
+    _policy_case("CandidateProposals.p_compute_conviction",
+                 CandidateProposals.p_compute_conviction),
+    Case("SupportMatrix.add_proposal", _support_matrix, _add_proposal),
+    Case("SupportMatrix.affinity_median", _support_matrix,
+         lambda support, affinity: (_add_proposal(support, affinity),
+                                    support.affinity_median.median())),
+    Case("Commons.deposit", _deposits, _deposit_each),
+    Case("Commons.burn", _deposits, _burn_each),
+    Case("Commons.deposit_batch", _deposits,
+         lambda commons, dai: commons.deposit_batch(dai)),
+    Case("Commons.burn_batch", _deposits,
+         lambda commons, dai: commons.burn_batch(dai)),
+    Case("Commons.quote_curve", _deposits,
+         lambda commons, dai: commons.quote_curve(dai)),
+    Case("timestep",
+         lambda scale: (make_state(scale), simulation.default_params),
+         run_timestep),
+    Case("timestep_event_driven",
+         lambda scale: (make_state(scale, event_driven=True), simulation.default_params,
+                        simulation.event_driven_blocks),
+         run_timestep),
+]
+
+
+def measure(case: Case, scale: int, repeat: int = 3) -> Dict[str, float]:
+    """
+    Returns the fastest of repeat timed runs of the case, and the peak memory
+    of one more run under tracemalloc, which is too slow to time at the same
+    time. Every run gets freshly set up arguments.
+    """
+    times = []
+    for _ in range(repeat):
+        args = case.setup(scale)
+        start = time.perf_counter()
+        case.run(*args)
+        times.append(time.perf_counter() - start)
+
+    args = case.setup(scale)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        case.run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time": min(times), "peak_memory": peak - baseline}
+
+
+def run_benchmarks(scales: List[int] = None, repeat: int = 3, only: List[str] = None, seed: int = 0, log=None) -> Dict:
+    """
+    Measures every case (or those whose names are in only) at every scale.
+    Returns the results keyed by "<case>@<scale>", plus a description of the
+    machine they were measured on.
+    """
+    scales = scales or default_scales
+    results = {}
+    for case in cases:
+        if only and case.name not in only:
+            continue
+        for scale in scales:
+            if scale > case.max_scale:
+                continue
+            set_rng(RandomStream(seed))
+            key = "{}@{}".format(case.name, scale)
+            results[key] = measure(case, scale, repeat)
+            if log:
+                log(format_result(key, results[key]))
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.25) -> List[str]:
+    """
+    Returns a description of every result that is more than tolerance (a
+    fraction) slower or bigger than the same result in the baseline, ignoring
+    results below min_time and min_peak_memory.
+    """
+    regressions = []
+    for key, result in results["results"].items():
+        before = baseline["results"].get(key)
+        if before is None:
+            continue
+        for metric, noise in [("time", min_time), ("peak_memory", min_peak_memory)]:
+            if result[metric] > max(before[metric] * (1 + tolerance), noise):
+                regressions.append("{} {}: {:.4g} -> {:.4g} ({:+.0%})".format(
+                    key, metric, before[metric], result[metric], result[metric]/before[metric] - 1))
+    return regressions
+
+
+def format_result(key: str, result: Dict) -> str:
+    return "{:<80} {:>10.4f}s {:>10.2f}MB".format(key, result["time"], result["peak_memory"] / 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Commons simulation.")
+    parser.add_argument("--scales", type=int, nargs="+", default=default_scales,
+                        help="numbers of Participants to run at")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", default=None,
+                        help="names of the cases to run")
+    parser.add_argument("--save", default=None,
+                        help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None,
+                        help="compare the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower or bigger counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, args.repeat, args.only, log=print)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
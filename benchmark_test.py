@@ -0,0 +1,69 @@
+import json
+import os
+import unittest
+
+import benchmark
+from network_utils import get_support_matrix
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_benchmarks(self):
+        results = benchmark.run_benchmarks(scales=[10, 2000], repeat=1, only=[
+            "setup_influence_edges_bulk", "Commons.deposit_batch", "timestep"])["results"]
+
+        self.assertEqual(set(results), {
+            "setup_influence_edges_bulk@10", "setup_influence_edges_bulk@2000",
+            "Commons.deposit_batch@10", "Commons.deposit_batch@2000",
+            "timestep@10", "timestep@2000"})
+        for result in results.values():
+            self.assertGreaterEqual(result["time"], 0)
+            self.assertGreaterEqual(result["peak_memory"], 0)
+
+    def test_run_timestep(self):
+        state = benchmark.make_state(20)
+        state = benchmark.run_timestep(
+            state, benchmark.simulation.default_params)
+        self.assertEqual(state["substep"], len(
+            benchmark.simulation.partial_state_update_blocks))
+        self.assertEqual(state["token_supply"],
+                         state["commons"]._token_supply)
+
+    def test_setup_support_edges_fills_the_matrix(self):
+        case, = [case for case in benchmark.cases
+                 if case.name == "setup_support_edges"]
+        network, = case.setup(2000)
+        support = get_support_matrix(network)
+        self.assertEqual(len(support), 0)
+
+        case.run(network)
+        self.assertEqual((support.n_rows, support.n_cols),
+                         (2000, benchmark.n_proposals(2000)))
+
+    def test_baseline_covers_every_case(self):
+        with open(os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")) as f:
+            baseline = json.load(f)
+        expected = {"{}@{}".format(case.name, scale)
+                    for case in benchmark.cases
+                    for scale in benchmark.default_scales if scale <= case.max_scale}
+        self.assertEqual(set(baseline["results"]), expected)
+        self.assertEqual(benchmark.compare(baseline, baseline), [])
+
+    def test_compare(self):
+        baseline = {"results": {
+            "a@10": {"time": 1.0, "peak_memory": 1e6},
+            "b@10": {"time": 1.0, "peak_memory": 1e6},
+            "c@10": {"time": 1e-5, "peak_memory": 10},
+        }}
+        results = {"results": {
+            "a@10": {"time": 1.2, "peak_memory": 1e6},
+            "b@10": {"time": 1.0, "peak_memory": 2e6},
+            "c@10": {"time": 1e-4, "peak_memory": 100},
+            "d@10": {"time": 5.0, "peak_memory": 1e9},
+        }}
+        regressions = benchmark.compare(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("b@10 peak_memory"))
+
+
+if __name__ == '__main__':
+    unittest.main()
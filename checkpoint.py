@@ -0,0 +1,411 @@
+"""
+Saves the whole state of a simulation to a single .npz file, and loads it
+again, so that a run can be paused and resumed from where it was, drawing the
+same random numbers it would have drawn had it never stopped.
+
+Everything that is a lot of numbers (the Participants, the Proposals, their
+TokenBatches, the edges and the SupportMatrix) is stored column by column,
+and the rest (scalar state variables, the Commons, the RandomStream) as JSON
+in the "meta" entry. The file is not compressed, so that load_checkpoint()
+can memory-map the columns instead of reading them.
+"""
+import json
+import zipfile
+from typing import Dict
+
+import numpy as np
+
+from entities import (Participant, Proposal, ProposalStatus,
+                      advance_proposal_ids, next_proposal_id)
+from hatch import Commons, TokenBatch, TokenBatchLedger, TokenBatchLedgerRow
+from metrics import MetricsRecorder, default_metrics
+from network_utils import (CommonsNetwork, NetworkIndex, get_index,
+                           get_support_matrix)
+from supportmatrix import RunningMedian
+from utils import RandomStream, get_rng, set_rng
+
+FORMAT_VERSION = 3
+
+# How a Participant holds its TokenBatches
+NO_BATCH, TOKEN_BATCH, LEDGER_ROW = 0, 1, 2
+HOLDINGS = ("holdings_vesting", "holdings_nonvesting")
+TOKEN_BATCH_COLUMNS = TokenBatch.__slots__
+LEDGER_COLUMNS = ("value", "spent", "creation_day",
+                  "hatch_tokens", "cliff_days", "halflife_days")
+PROPOSAL_COLUMNS = tuple(
+    name for name in Proposal.__slots__ if name != "_observer")
+
+
+def save_checkpoint(path: str, state: Dict, rng: RandomStream = None):
+    """
+    Writes state (the network, the Commons, the MetricsRecorder and any scalar
+    state variables) and rng (by default, the current RandomStream) to path.
+    """
+    arrays = {}
+    meta = {
+        "version": FORMAT_VERSION,
+        "scalars": {},
+        "rng": (rng or get_rng()).get_state(),
+        "next_proposal_id": next_proposal_id(),
+    }
+    for name, value in state.items():
+        if isinstance(value, CommonsNetwork):
+            meta.setdefault("networks", []).append(name)
+            _save_network(arrays, meta, name, value)
+        elif isinstance(value, Commons):
+            meta.setdefault("commons", {})[name] = _save_commons(value)
+        elif isinstance(value, MetricsRecorder):
+            meta.setdefault("recorders", {})[name] = _save_recorder(
+                arrays, name, value)
+        elif isinstance(value, (bool, int, float, str)) or value is None:
+            meta["scalars"][name] = value
+        elif isinstance(value, np.generic):
+            meta["scalars"][name] = value.item()
+        # anything else (e.g. a Checkpointer) is left behind
+
+    arrays["meta"] = np.array(json.dumps(meta))
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def load_checkpoint(path: str, restore_rng: bool = True) -> Dict:
+    """
+    Reads a state written by save_checkpoint(). With restore_rng, the saved
+    RandomStream becomes the current one (see utils.set_rng()), so that the
+    simulation draws the numbers it would have drawn had it never stopped.
+    """
+    arrays = _load_npz(path)
+    meta = json.loads(str(arrays["meta"]))
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError("{} is a version {} checkpoint, expected version {}".format(
+            path, meta["version"], FORMAT_VERSION))
+
+    state = dict(meta["scalars"])
+    for name in meta.get("networks", []):
+        state[name] = _load_network(arrays, meta, name)
+    for name, commons in meta.get("commons", {}).items():
+        state[name] = _load_commons(commons)
+    for name, recorder in meta.get("recorders", {}).items():
+        state[name] = _load_recorder(arrays, name, recorder)
+
+    advance_proposal_ids(meta["next_proposal_id"])
+    if restore_rng:
+        set_rng(RandomStream.from_state(meta["rng"]))
+    return state
+
+
+class Checkpointer:
+    """
+    Saves a checkpoint at the end of each of the given timesteps, to path
+    formatted with the timestep, e.g. "run-{timestep}.npz".
+
+    attach() adds a block at the end of partial_state_update_blocks whose only
+    state update function is su_save, for the "checkpoints" state variable,
+    which should hold the Checkpointer itself in the initial state. Like the
+    MetricsRecorder, it isn't copied along with the state.
+    """
+
+    def __init__(self, path: str, timesteps):
+        self.path = path
+        self.timesteps = set(timesteps)
+        self.saved = []
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, self.path)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def su_save(self, params, step, sL, s, _input):
+        if s.get("timestep") in self.timesteps:
+            path = self.path.format(timestep=s["timestep"])
+            save_checkpoint(path, s)
+            self.saved.append(path)
+        return "checkpoints", self
+
+    def attach(self, partial_state_update_blocks):
+        return partial_state_update_blocks + [{
+            "policies": {},
+            "variables": {"checkpoints": self.su_save},
+        }]
+
+
+def _save_network(arrays: Dict, meta: Dict, name: str, network: CommonsNetwork):
+    index = get_index(network)
+    participants = list(index.participants.items())
+    proposals = list(index.proposals.items())
+
+    arrays[name + ".node_ids"] = np.array(list(network.nodes), dtype=int)
+    arrays[name + ".participant_ids"] = np.array(
+        [i for i, _ in participants], dtype=int)
+    arrays[name + ".participant_name"] = np.array(
+        [p.name for _, p in participants], dtype=str)
+    arrays[name + ".participant_sentiment"] = np.array(
+        [p.sentiment for _, p in participants], dtype=float)
+
+    ledgers = {id(getattr(p, holdings).ledger): getattr(p, holdings).ledger
+               for _, p in participants for holdings in HOLDINGS
+               if isinstance(getattr(p, holdings), TokenBatchLedgerRow)}
+    if len(ledgers) > 1:
+        raise ValueError(
+            "Can only save Participants whose TokenBatches are rows of a single TokenBatchLedger")
+    network_meta = {"in_place": network.in_place,
+                    "candidate_funds_requested": index.candidate_funds_requested}
+    if ledgers:
+        ledger, = ledgers.values()
+        for column in LEDGER_COLUMNS:
+            arrays[name + ".ledger." + column] = getattr(ledger, column)
+        network_meta["ledger_current_day"] = ledger.current_day
+
+    for holdings in HOLDINGS:
+        batches = [getattr(p, holdings) for _, p in participants]
+        prefix = "{}.{}.".format(name, holdings)
+        arrays[prefix + "kind"] = np.array([
+            LEDGER_ROW if isinstance(b, TokenBatchLedgerRow) else
+            NO_BATCH if b is None else TOKEN_BATCH for b in batches], dtype=np.int8)
+        arrays[prefix + "ledger_row"] = np.array(
+            [b.row if isinstance(b, TokenBatchLedgerRow) else -1 for b in batches], dtype=int)
+        for column in TOKEN_BATCH_COLUMNS:
+            arrays[prefix + column] = np.array([
+                getattr(b, column) if b is not None and not isinstance(b, TokenBatchLedgerRow) else 0
+                for b in batches])
+
+    arrays[name + ".proposal_ids"] = np.array(
+        [j for j, _ in proposals], dtype=int)
+    for column in PROPOSAL_COLUMNS:
+        values = [getattr(p, column) for _, p in proposals]
+        if column == "_status":
+            values = [status.value for status in values]
+        arrays[name + ".proposal." + column] = np.array(values)
+    # The order in which Proposals reached their status matters to whoever
+    # iterates over them
+    for status in ProposalStatus:
+        arrays["{}.status.{}".format(name, status.name)] = np.array(
+            list(index.proposals_by_status[status]), dtype=int)
+
+    edge_types = {}
+    for edge_type, edges in _edges_by_type(network, index).items():
+        attrs = [network.edges[edge] for edge in edges]
+        attributes = sorted({key for attr in attrs for key in attr} - {"type"})
+        edge_types[edge_type] = attributes
+        prefix = "{}.edges.{}.".format(name, edge_type)
+        arrays[prefix + "u"] = np.array([u for u, _ in edges], dtype=int)
+        arrays[prefix + "v"] = np.array([v for _, v in edges], dtype=int)
+        for attribute in attributes:
+            # Edges without the attribute get a NaN, and a False in the
+            # "has." column if there are any
+            arrays[prefix + attribute] = np.array(
+                [attr.get(attribute, np.nan) for attr in attrs], dtype=float)
+            has = np.array([attribute in attr for attr in attrs], dtype=bool)
+            if not has.all():
+                arrays[prefix + "has." + attribute] = has
+    network_meta["edge_types"] = edge_types
+
+    support = get_support_matrix(network)
+    arrays[name + ".support.row_nodes"] = support.row_nodes
+    arrays[name + ".support.col_nodes"] = support.col_nodes
+    for column in support.columns:
+        arrays[name + ".support." + column] = getattr(support, column)
+    arrays[name + ".support.affinity_median"] = support.affinity_median.sorted_values
+
+    meta.setdefault("network_meta", {})[name] = network_meta
+
+
+def _edges_by_type(network: CommonsNetwork, index: NetworkIndex) -> Dict[str, list]:
+    """
+    The edges the index knows about, in its order, followed by any networkx
+    edges that were added to the network behind its back.
+    """
+    edges_by_type = {edge_type: list(edges)
+                     for edge_type, edges in index.edges_by_type.items()}
+    for u, neighbours in network.adj.items():
+        for v, attr in neighbours.items():
+            edge_type = attr.get("type")
+            if edge_type is None:
+                raise ValueError(
+                    "Can only save edges with a type, not ({}, {})".format(u, v))
+            if (u, v) not in index.edges_by_type.get(edge_type, ()):
+                edges_by_type.setdefault(edge_type, []).append((u, v))
+    return edges_by_type
+
+
+def _load_network(arrays: Dict, meta: Dict, name: str) -> CommonsNetwork:
+    network_meta = meta["network_meta"][name]
+    network = CommonsNetwork()
+    network.in_place = network_meta["in_place"]
+    index = network.graph["index"] = NetworkIndex()
+
+    ledger = None
+    if name + ".ledger.value" in arrays:
+        ledger = TokenBatchLedger.__new__(TokenBatchLedger)
+        for column in LEDGER_COLUMNS:
+            setattr(ledger, column, np.array(
+                arrays[name + ".ledger." + column]))
+        ledger.current_day = network_meta["ledger_current_day"]
+
+    items = {}
+    participant_ids = arrays[name + ".participant_ids"].tolist()
+    holdings = {}
+    for kind in HOLDINGS:
+        prefix = "{}.{}.".format(name, kind)
+        columns = {column: arrays[prefix + column].tolist()
+                   for column in TOKEN_BATCH_COLUMNS}
+        batches = []
+        for k, (batch_kind, row) in enumerate(zip(arrays[prefix + "kind"].tolist(), arrays[prefix + "ledger_row"].tolist())):
+            if batch_kind == NO_BATCH:
+                batches.append(None)
+            elif batch_kind == LEDGER_ROW:
+                batches.append(TokenBatchLedgerRow(ledger, row))
+            else:
+                batch = TokenBatch.__new__(TokenBatch)
+                for column, values in columns.items():
+                    setattr(batch, column, values[k])
+                batch.hatch_tokens = bool(batch.hatch_tokens)
+                batches.append(batch)
+        holdings[kind] = batches
+
+    for k, (i, participant_name, sentiment) in enumerate(zip(
+            participant_ids, arrays[name + ".participant_name"].tolist(),
+            arrays[name + ".participant_sentiment"].tolist())):
+        participant = Participant.__new__(Participant)
+        participant._sentiments = None
+        participant.name = participant_name
+        participant.sentiment = sentiment
+        for kind in HOLDINGS:
+            setattr(participant, kind, holdings[kind][k])
+        items[i] = participant
+
+    proposal_columns = {column: arrays[name + ".proposal." + column].tolist()
+                        for column in PROPOSAL_COLUMNS}
+    for k, j in enumerate(arrays[name + ".proposal_ids"].tolist()):
+        proposal = Proposal.__new__(Proposal)
+        proposal._observer = None
+        for column, values in proposal_columns.items():
+            setattr(proposal, column, values[k])
+        proposal._status = ProposalStatus(proposal._status)
+        items[j] = proposal
+
+    for idx in arrays[name + ".node_ids"].tolist():
+        network.add_node(idx, item=items[idx])
+        index.add_node(idx, items[idx])
+    for status in ProposalStatus:
+        index.proposals_by_status[status] = {
+            j: items[j] for j in arrays["{}.status.{}".format(name, status.name)].tolist()}
+    index.candidate_funds_requested = network_meta["candidate_funds_requested"]
+
+    for edge_type, attributes in network_meta["edge_types"].items():
+        prefix = "{}.edges.{}.".format(name, edge_type)
+        columns = [arrays[prefix + attribute].tolist()
+                   for attribute in attributes]
+        edges = [(u, v, dict(zip(attributes, values), type=edge_type)) for u, v, *values in zip(
+            arrays[prefix + "u"].tolist(), arrays[prefix + "v"].tolist(), *columns)]
+        for attribute in attributes:
+            if prefix + "has." + attribute in arrays:
+                for (_, _, attr), has in zip(edges, arrays[prefix + "has." + attribute].tolist()):
+                    if not has:
+                        del attr[attribute]
+        network.add_edges_from(edges)
+        for u, v, attr in edges:
+            index.add_edge(u, v, attr)
+
+    network.graph["support"] = _load_support(arrays, name)
+    return network
+
+
+def _load_support(arrays: Dict, name: str):
+    """
+    The SupportMatrix columns, and the sorted affinities its affinity_median
+    is kept in, are memory-mapped copy on write if the file allows it, at
+    exactly their size: adding a Participant or Proposal makes the
+    SupportMatrix copy them into memory.
+    """
+    support = get_support_matrix(CommonsNetwork())
+    row_nodes = arrays[name + ".support.row_nodes"]
+    col_nodes = arrays[name + ".support.col_nodes"]
+    support.n_rows, support.n_cols = len(row_nodes), len(col_nodes)
+    support._row_nodes = np.array(row_nodes)
+    support._col_nodes = np.array(col_nodes)
+    support.row_of = {i: row for row, i in enumerate(row_nodes.tolist())}
+    support.col_of = {j: col for col, j in enumerate(col_nodes.tolist())}
+    for column in support.columns:
+        setattr(support, "_" + column, arrays[name + ".support." + column])
+    support.affinity_median = RunningMedian.from_sorted(
+        arrays[name + ".support.affinity_median"])
+    return support
+
+
+def _save_commons(commons: Commons) -> Dict:
+    def numbers(obj):
+        return {key: value for key, value in vars(obj).items()
+                if isinstance(value, (bool, int, float))}
+    return {"commons": numbers(commons), "bonding_curve": numbers(commons.bonding_curve)}
+
+
+def _load_commons(saved: Dict) -> Commons:
+    # Every number that the Commons and its curve are made of is saved, so the
+    # ones they are constructed with are overwritten anyway
+    attributes = saved["commons"]
+    commons = Commons(1, 1)
+    for key, value in attributes.items():
+        setattr(commons, key, value)
+    for key, value in saved["bonding_curve"].items():
+        setattr(commons.bonding_curve, key, value)
+    return commons
+
+
+def _save_recorder(arrays: Dict, name: str, recorder: MetricsRecorder) -> Dict:
+    arrays[name + ".timestep"] = recorder.timestep
+    for metric, column in recorder.columns.items():
+        arrays["{}.{}".format(name, metric)] = column
+    return {"metrics": list(recorder.columns), "n_rows": recorder.n_rows}
+
+
+def _load_recorder(arrays: Dict, name: str, saved: Dict) -> MetricsRecorder:
+    unknown = set(saved["metrics"]) - set(default_metrics)
+    if unknown:
+        raise ValueError(
+            "Can't restore a MetricsRecorder with metrics {} that aren't in default_metrics".format(sorted(unknown)))
+    recorder = MetricsRecorder(0, {metric: default_metrics[metric]
+                                   for metric in saved["metrics"]})
+    recorder.timestep = np.array(arrays[name + ".timestep"])
+    recorder.columns = {metric: np.array(arrays["{}.{}".format(name, metric)])
+                        for metric in saved["metrics"]}
+    recorder.n_rows = saved["n_rows"]
+    return recorder
+
+
+def _load_npz(path: str) -> Dict[str, np.ndarray]:
+    """
+    Like np.load() for an .npz file, except that arrays stored without
+    compression are memory-mapped (copy on write) rather than read.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # The member's data starts after its local file header, which is
+            # 30 bytes plus the file name and extra field.
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            if dtype.hasobject or not shape or 0 in shape:
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                arrays[name] = np.lib.format.read_array(f)
+            else:
+                arrays[name] = np.memmap(f, dtype=dtype, mode="c", offset=f.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+    return arrays
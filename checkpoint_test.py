@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import simulation
+from checkpoint import Checkpointer, load_checkpoint, save_checkpoint
+from hatch import TokenBatchLedger, TokenBatchLedgerRow, create_token_batches
+from network_utils import get_index, get_support_matrix
+from utils import RandomStream, get_rng, set_rng
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.previous_rng = set_rng(RandomStream(2))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "state.npz")
+
+    def tearDown(self):
+        set_rng(self.previous_rng)
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        state = simulation.bootstrap_state(simulation.default_params)
+        state["timestep"] = 7
+        save_checkpoint(self.path, state)
+        expected = [get_rng().random() for _ in range(10)]
+
+        loaded = load_checkpoint(self.path)
+        self.assertEqual([get_rng().random() for _ in range(10)], expected)
+        self.assertEqual(loaded["timestep"], 7)
+
+        network, restored = state["network"], loaded["network"]
+        self.assertEqual(list(restored.nodes), list(network.nodes))
+        self.assertEqual(list(restored.edges(data=True)),
+                         list(network.edges(data=True)))
+        for i in network.nodes:
+            self.assertEqual(repr(restored.nodes[i]["item"]),
+                             repr(network.nodes[i]["item"]))
+        self.assertEqual(get_index(restored).candidate_funds_requested,
+                         get_index(network).candidate_funds_requested)
+        np.testing.assert_array_equal(get_support_matrix(restored).affinity,
+                                      get_support_matrix(network).affinity)
+        self.assertEqual(get_support_matrix(restored).affinity_median.median(),
+                         get_support_matrix(network).affinity_median.median())
+        self.assertEqual(vars(loaded["commons"]).keys() - {"bonding_curve"},
+                         vars(state["commons"]).keys() - {"bonding_curve"})
+        self.assertEqual(loaded["commons"]._funding_pool,
+                         state["commons"]._funding_pool)
+
+    def test_every_edge_and_attribute(self):
+        """
+        Edges of the same type with different attributes, and edges the
+        NetworkIndex doesn't know about, must all be saved.
+        """
+        state = simulation.bootstrap_state(simulation.default_params)
+        network = state["network"]
+        (u, v), *_ = get_index(network).edges_by_type["conflict"]
+        network.edges[u, v]["note"] = 3.0
+        j = max(network.nodes)  # a Proposal, which has no edges to Participants
+        network.add_edge(j, 0, type="behind_the_index", weight=2.0)
+        save_checkpoint(self.path, state)
+
+        restored = load_checkpoint(self.path)["network"]
+        self.assertEqual(sorted(restored.edges(data=True)),
+                         sorted(network.edges(data=True)))
+        self.assertEqual(restored.edges[j, 0], {"type": "behind_the_index", "weight": 2.0})
+
+        network.add_edge(j, 1)
+        with self.assertRaises(ValueError):
+            save_checkpoint(self.path, state)
+
+    def test_ledger_and_memory_mapping(self):
+        batches, _ = create_token_batches(
+            list(np.linspace(100, 1000, 20)), 0.1, 60, ledger=True)
+        self.assertIsInstance(batches[0], TokenBatchLedgerRow)
+        state = simulation.bootstrap_state(simulation.default_params)
+        state["network"] = simulation.bootstrap_network(batches, 3, 3000, 4e6)
+        save_checkpoint(self.path, state)
+
+        network = load_checkpoint(self.path)["network"]
+        participants = get_index(network).participants.values()
+        ledgers = {id(p.holdings_vesting.ledger) for p in participants}
+        self.assertEqual(len(ledgers), 1)
+        ledger = next(iter(participants)).holdings_vesting.ledger
+        self.assertIsInstance(ledger, TokenBatchLedger)
+        np.testing.assert_array_equal(ledger.value, batches[0].ledger.value)
+
+        # copy on write: changing it doesn't change the file
+        affinity = get_support_matrix(network)._affinity
+        self.assertIsInstance(affinity, np.memmap)
+        self.assertIsInstance(
+            get_support_matrix(network).affinity_median.sorted_values, np.memmap)
+        affinity[:] = -1
+        np.testing.assert_array_equal(
+            get_support_matrix(load_checkpoint(self.path)["network"]).affinity,
+            get_support_matrix(state["network"]).affinity)
+
+    def test_resume_is_bit_exact(self):
+        checkpointer = Checkpointer(os.path.join(
+            self.tmp.name, "run-{timestep}.npz"), [10])
+        set_rng(RandomStream(5))
+        full = simulation.run_simulation(
+            timesteps=20, engine="native", checkpointer=checkpointer)
+        self.assertEqual(checkpointer.saved, [
+                         os.path.join(self.tmp.name, "run-10.npz")])
+
+        resumed = simulation.run_simulation(
+            timesteps=20, engine="native", resume_from=checkpointer.saved[0])
+        self.assertTrue(full.equals(resumed))
+
+        with self.assertRaises(ValueError):
+            simulation.run_simulation(
+                timesteps=20, engine="cadcad", resume_from=checkpointer.saved[0])
+        with self.assertRaises(ValueError):
+            simulation.run_simulation(
+                timesteps=20, engine="native", resume_from=checkpointer.saved[0],
+                event_driven=True)
+
+    def test_resume_event_driven(self):
+        checkpointer = Checkpointer(os.path.join(
+            self.tmp.name, "run-{timestep}.npz"), [10])
+        set_rng(RandomStream(5))
+        full = simulation.run_simulation(
+            timesteps=20, engine="native", checkpointer=checkpointer,
+            event_driven=True)
+
+        resumed = simulation.run_simulation(
+            timesteps=20, engine="native", resume_from=checkpointer.saved[0],
+            event_driven=True)
+        self.assertTrue(full.equals(resumed))
+
+        with self.assertRaises(ValueError):
+            simulation.run_simulation(
+                timesteps=20, engine="native", resume_from=checkpointer.saved[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,15 +3,105 @@ import numpy as np
 
 def trigger_threshold(funds_requested, funding_pool, token_supply, max_proposal_request=0.2):
     """
-    funds_requested: funds requested by the proposal
+    funds_requested: funds requested by the proposal, or an array of them
     funding_pool: the current size of the funding pool
     token_supply: current token_supply
     max_proposal_request: maximum fraction of the funding pool that a proposal can ever request
+
+    Proposals requesting max_proposal_request or more of the funding pool can
+    never pass, and get a threshold of np.inf.
     """
     rho = 0.5 * max_proposal_request**2
 
+    if np.ndim(funds_requested):
+        fraction = np.asarray(funds_requested)/funding_pool
+        with np.errstate(divide="ignore"):
+            return np.where(fraction < max_proposal_request,
+                            rho*token_supply/(max_proposal_request-fraction)**2, np.inf)
+
     fraction = funds_requested/funding_pool
     if fraction < max_proposal_request:
         return rho*token_supply/(max_proposal_request-fraction)**2
     else:
         return np.inf
+
+
+class TriggerThresholdCache:
+    """
+    Memoizes trigger_threshold(), and can be called just like it.
+
+    Within a timestep the funding pool and token supply usually stay the same,
+    but thresholds are asked for again and again (Proposal.update_threshold(),
+    Proposal.has_enough_conviction(), the conviction engine). Only the results
+    for the latest (funding_pool, token_supply, max_proposal_request) are kept,
+    so the cache empties itself as soon as any of them changes. Evaluating an
+    array of funds_requested also remembers the threshold of every single one
+    of them, as well as the whole array of thresholds, which is handed out
+    read only when the same array is asked for again.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.thresholds = {}
+        self.arrays = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, funds_requested, funding_pool, token_supply, max_proposal_request=0.2):
+        key = (funding_pool, token_supply, max_proposal_request)
+        if key != self.key:
+            self.key = key
+            self.thresholds = {}
+            self.arrays = {}
+
+        if np.ndim(funds_requested):
+            funds_requested = np.asarray(funds_requested, dtype=float)
+            array_key = (funds_requested.shape, funds_requested.tobytes())
+            thresholds = self.arrays.get(array_key)
+            if thresholds is not None:
+                self.hits += 1
+                return thresholds
+            thresholds = trigger_threshold(
+                funds_requested, funding_pool, token_supply, max_proposal_request)
+            self.misses += 1
+            self.thresholds.update(
+                zip(funds_requested.ravel().tolist(), thresholds.ravel().tolist()))
+            thresholds.flags.writeable = False
+            self.arrays[array_key] = thresholds
+            return thresholds
+
+        threshold = self.thresholds.get(funds_requested)
+        if threshold is None:
+            self.misses += 1
+            threshold = self.thresholds[funds_requested] = trigger_threshold(
+                funds_requested, funding_pool, token_supply, max_proposal_request)
+        else:
+            self.hits += 1
+        return threshold
+
+
+cached_trigger_threshold = TriggerThresholdCache()
+
+
+def accumulate_conviction(conviction, tokens, alpha):
+    """
+    conviction: conviction of each support edge at the previous timestep
+    tokens: tokens staked on each support edge at this timestep
+    alpha: how much of the previous conviction carries over to this timestep
+
+    Works on single support edges as well as on whole arrays of them.
+    """
+    return alpha*conviction + tokens
+
+
+def passing_proposals(conviction, funds_requested, funding_pool, token_supply, max_proposal_request=0.2):
+    """
+    conviction: array of the total conviction of each candidate proposal
+    funds_requested: array of the funds requested by each candidate proposal
+
+    Returns a boolean array saying which proposals have enough conviction to
+    pass, i.e. the array version of conviction >= trigger_threshold().
+    """
+    threshold = cached_trigger_threshold(
+        np.asarray(funds_requested, dtype=float), funding_pool, token_supply, max_proposal_request)
+    return np.asarray(conviction) >= threshold
@@ -1,8 +1,72 @@
 import unittest
-from convictionvoting import trigger_threshold
+
+import numpy as np
+
+from convictionvoting import (TriggerThresholdCache, accumulate_conviction,
+                             passing_proposals, trigger_threshold)
 
 
 class ConvictionThresholdTest(unittest.TestCase):
     def test_small_proposal_should_have_low_threshold(self):
         threshold = trigger_threshold(10, 1000, 10000000)
         print(threshold)
+
+    def test_passing_proposals_agrees_with_trigger_threshold(self):
+        funds_requested = np.array([10, 100, 199, 200, 500])
+        threshold = np.array([trigger_threshold(f, 1000, 1e6)
+                              for f in funds_requested])
+        # Proposals asking for 20% or more of the funding pool never pass
+        conviction = np.minimum(threshold, 1e30)
+
+        np.testing.assert_array_equal(passing_proposals(
+            conviction, funds_requested, 1000, 1e6), [True, True, True, False, False])
+        np.testing.assert_array_equal(passing_proposals(
+            conviction * 0.99, funds_requested, 1000, 1e6), [False]*5)
+
+    def test_accumulate_conviction(self):
+        conviction = accumulate_conviction(
+            np.array([[10., 0.]]), np.array([[1., 2.]]), 0.5)
+        np.testing.assert_array_equal(conviction, [[6., 2.]])
+
+    def test_trigger_threshold_arrays(self):
+        funds_requested = [10, 100, 199, 200, 500]
+        thresholds = trigger_threshold(funds_requested, 1000, 1e6)
+        self.assertIsInstance(thresholds, np.ndarray)
+        self.assertEqual(thresholds.tolist(), [trigger_threshold(
+            f, 1000, 1e6) for f in funds_requested])
+        self.assertEqual(thresholds[3], np.inf)
+        self.assertEqual(thresholds[4], np.inf)
+
+
+class TriggerThresholdCacheTest(unittest.TestCase):
+    def test_repeats_are_cached(self):
+        cache = TriggerThresholdCache()
+        self.assertEqual(cache(10, 1000, 1e6), trigger_threshold(10, 1000, 1e6))
+        cache(10, 1000, 1e6)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_array_fills_the_cache(self):
+        cache = TriggerThresholdCache()
+        thresholds = cache(np.array([10, 100, 300]), 1000, 1e6)
+        self.assertEqual(cache(100, 1000, 1e6), thresholds[1])
+        self.assertEqual(cache(300, 1000, 1e6), np.inf)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_repeated_arrays_are_cached(self):
+        cache = TriggerThresholdCache()
+        thresholds = cache(np.array([10, 100, 300]), 1000, 1e6)
+        self.assertIs(cache([10.0, 100.0, 300.0], 1000, 1e6), thresholds)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        np.testing.assert_array_equal(cache(np.array([10, 100]), 1000, 1e6),
+                                      thresholds[:2])
+        self.assertEqual(cache.misses, 2)
+        cache(np.array([10, 100, 300]), 2000, 1e6)
+        self.assertEqual(cache.misses, 3)
+
+    def test_cache_is_emptied_when_the_step_changes(self):
+        cache = TriggerThresholdCache()
+        cache(10, 1000, 1e6)
+        self.assertEqual(cache(10, 2000, 1e6), trigger_threshold(10, 2000, 1e6))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(cache.thresholds), 1)
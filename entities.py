@@ -1,5 +1,4 @@
-import random
-import uuid
+import itertools
 from enum import Enum
 from inspect import getmembers
 from os.path import abspath
@@ -9,9 +8,9 @@ from typing import List, Tuple
 import numpy as np
 
 import config
-from convictionvoting import trigger_threshold
+from convictionvoting import cached_trigger_threshold
 from hatch import TokenBatch
-from utils import probability
+from utils import RandomStream, get_rng, probability
 
 
 """
@@ -28,7 +27,7 @@ def api(obj):
 def attrs(obj):
     disallowed_properties = {
         name for name, value in getmembers(type(obj))
-        if isinstance(value, (property, FunctionType))}
+        if isinstance(value, FunctionType) or (isinstance(value, property) and value.fset is None)}
     return {
         name: getattr(obj, name) for name in api(obj)
         if name not in disallowed_properties and hasattr(obj, name)}
@@ -41,25 +40,79 @@ ProposalStatus = Enum("ProposalStatus", "CANDIDATE ACTIVE COMPLETED FAILED")
 # failed: did not get to active status or failed after funding
 
 
+# Proposal ids only need to be unique within a simulation, so a counter does
+# instead of uuid.uuid4(). The attribute is still called uuid. Whoever brings
+# Proposals into a process from elsewhere (a checkpoint, a pickled state) has
+# to advance_proposal_ids() past theirs.
+_proposal_ids = itertools.count()
+
+
+def next_proposal_id() -> int:
+    """
+    The id the next Proposal will get, without using it up.
+    """
+    global _proposal_ids
+    next_id = next(_proposal_ids)
+    _proposal_ids = itertools.count(next_id)
+    return next_id
+
+
+def advance_proposal_ids(next_id: int):
+    """
+    Makes sure that no Proposal made from now on gets an id below next_id.
+    """
+    global _proposal_ids
+    _proposal_ids = itertools.count(max(next_id, next_proposal_id()))
+
+
 class Proposal:
+    __slots__ = ("uuid", "conviction", "_observer", "_status",
+                 "age", "_funds_requested", "trigger")
+
     def __init__(self, funds_requested: int, trigger: float):
-        self.uuid = uuid.uuid4()
+        self.uuid = next(_proposal_ids)
         self.conviction = 0
-        self.status = ProposalStatus.CANDIDATE
+        # set by whoever wants to know about changes of status or
+        # funds_requested, e.g. a NetworkIndex. Called with the Proposal and
+        # its status and funds_requested from before the change.
+        self._observer = None
+        self._status = ProposalStatus.CANDIDATE
         self.age = 0
-        self.funds_requested = funds_requested
+        self._funds_requested = funds_requested
         self.trigger = trigger
 
     def __repr__(self):
         return "<{} {}>".format(self.__class__.__name__, attrs(self))
 
+    @property
+    def status(self) -> ProposalStatus:
+        return self._status
+
+    @status.setter
+    def status(self, status: ProposalStatus):
+        old_status = self._status
+        self._status = status
+        if self._observer and old_status != status:
+            self._observer(self, old_status, self._funds_requested)
+
+    @property
+    def funds_requested(self) -> float:
+        return self._funds_requested
+
+    @funds_requested.setter
+    def funds_requested(self, funds_requested: float):
+        old_funds_requested = self._funds_requested
+        self._funds_requested = funds_requested
+        if self._observer and old_funds_requested != funds_requested:
+            self._observer(self, self._status, old_funds_requested)
+
     def update_age(self):
         self.age += 1
         return self.age
 
     def update_threshold(self, funding_pool: float, token_supply: float):
         if self.status == ProposalStatus.CANDIDATE:
-            self.trigger = trigger_threshold(
+            self.trigger = cached_trigger_threshold(
                 self.funds_requested, funding_pool, token_supply)
         else:
             self.trigger = np.nan
@@ -67,12 +120,13 @@ class Proposal:
 
     def has_enough_conviction(self, funding_pool: float, token_supply: float):
         """
-        It's just a conviction < threshold check, but we recalculate the
+        It's just a conviction < threshold check, but we look up the
         trigger_threshold so that the programmer doesn't have to remember to run
-        update_threshold before running this method.
+        update_threshold before running this method. The lookup is memoized, so
+        this is cheap while the funding_pool and token_supply don't change.
         """
         if self.status == ProposalStatus.CANDIDATE:
-            threshold = trigger_threshold(
+            threshold = cached_trigger_threshold(
                 self.funds_requested, funding_pool, token_supply)
             if self.conviction < threshold:
                 return False
@@ -82,16 +136,67 @@ class Proposal:
                 "Proposal {} is not a Candidate Proposal and so asking it if it will pass is inappropriate".format(str(self.uuid))))
 
 
+def vote_cutoff(max_affinity):
+    """
+    A Participant votes for the Candidate Proposals whose affinity is above
+    0.75 * their highest affinity to any Candidate Proposal, but never for
+    ones with an affinity of 0.5 or less. Works on arrays too.
+    """
+    return np.maximum(0.75 * max_affinity, 0.5)
+
+
 class Participant:
+    __slots__ = ("name", "_sentiment", "_sentiments",
+                 "_holdings_vesting", "_holdings_nonvesting")
+
     def __init__(self, holdings_vesting: TokenBatch = None, holdings_nonvesting: TokenBatch = None):
         self.name = "Somebody"
-        self.sentiment = np.random.rand()
+        # set by a NetworkIndex that keeps the sentiment of every Participant
+        # in one array, to (the index, this Participant's position in it). The
+        # index also wants to know when the holdings are replaced.
+        self._sentiments = None
+        self.sentiment = get_rng().random()
         self.holdings_vesting = holdings_vesting
         self.holdings_nonvesting = holdings_nonvesting
 
     def __repr__(self):
         return "<{} {}>".format(self.__class__.__name__, attrs(self))
 
+    @property
+    def sentiment(self) -> float:
+        if self._sentiments is None:
+            return self._sentiment
+        index, position = self._sentiments
+        return index.sentiment[position].item()
+
+    @sentiment.setter
+    def sentiment(self, sentiment: float):
+        if self._sentiments is None:
+            self._sentiment = sentiment
+        else:
+            index, position = self._sentiments
+            index.sentiment[position] = sentiment
+
+    @property
+    def holdings_vesting(self) -> TokenBatch:
+        return self._holdings_vesting
+
+    @holdings_vesting.setter
+    def holdings_vesting(self, holdings: TokenBatch):
+        self._holdings_vesting = holdings
+        if self._sentiments is not None:
+            self._sentiments[0].holdings_changed()
+
+    @property
+    def holdings_nonvesting(self) -> TokenBatch:
+        return self._holdings_nonvesting
+
+    @holdings_nonvesting.setter
+    def holdings_nonvesting(self, holdings: TokenBatch):
+        self._holdings_nonvesting = holdings
+        if self._sentiments is not None:
+            self._sentiments[0].holdings_changed()
+
     def buy(self) -> float:
         """
         If the Participant decides to buy more tokens, returns the number of
@@ -104,7 +209,7 @@ class Participant:
         engagement_rate = 0.3 * self.sentiment
         force = self.sentiment - config.sentiment_sensitivity
         if probability(engagement_rate) and force > 0:
-            delta_holdings = np.random.rand() * force
+            delta_holdings = get_rng().random() * force
             return delta_holdings
         return 0
 
@@ -121,7 +226,7 @@ class Participant:
         engagement_rate = 0.3 * self.sentiment
         force = self.sentiment - config.sentiment_sensitivity
         if probability(engagement_rate) and force < 0:
-            delta_holdings = np.random.rand() * force
+            delta_holdings = get_rng().random() * force
             return delta_holdings
         return 0
 
@@ -180,16 +285,12 @@ class Participant:
             # these Proposals
             #
             # A Zargham work of art.
-            for candidate in candidate_proposals:
-                affinity = candidate_proposals[candidate]
-                # Hardcoded 0.75 instead of a configurable sentiment_sensitivity
-                # because modifying sentiment_sensitivity without changing the
-                # hardcoded cutoff value of 0.5 may cause unintended behaviour.
-                # Also, 0.75 is a reasonable number in this case.
-                cutoff = 0.75 * np.max(list(candidate_proposals.values()))
-                if cutoff < .5:
-                    cutoff = .5
-
+            # Hardcoded 0.75 instead of a configurable sentiment_sensitivity
+            # because modifying sentiment_sensitivity without changing the
+            # hardcoded cutoff value of 0.5 may cause unintended behaviour.
+            # Also, 0.75 is a reasonable number in this case.
+            cutoff = vote_cutoff(max(candidate_proposals.values(), default=0))
+            for candidate, affinity in candidate_proposals.items():
                 if affinity > cutoff:
                     new_voted_proposals[candidate] = affinity
 
@@ -218,3 +319,61 @@ class Participant:
                 affinity/affinity_total)
 
         return tokens_per_supported_proposal
+
+
+"""
+Population level versions of the Participant's decisions, which decide for
+every Participant at once, given an array of their sentiments (and for votes, a
+matrix of their affinities with one row per Participant and one column per
+Candidate Proposal, like SupportMatrix.affinity), and return arrays.
+"""
+
+
+def population_buy(sentiment: np.ndarray, rng: RandomStream = None) -> np.ndarray:
+    """
+    Participant.buy() for every Participant.
+    """
+    generator = (rng or get_rng()).generator
+    engagement_rate = 0.3 * sentiment
+    force = sentiment - config.sentiment_sensitivity
+    engaged = generator.random(len(sentiment)) < engagement_rate
+    amount = generator.random(len(sentiment)) * force
+    return np.where(engaged & (force > 0), amount, 0)
+
+
+def population_sell(sentiment: np.ndarray, rng: RandomStream = None) -> np.ndarray:
+    """
+    Participant.sell() for every Participant.
+    """
+    generator = (rng or get_rng()).generator
+    engagement_rate = 0.3 * sentiment
+    force = sentiment - config.sentiment_sensitivity
+    engaged = generator.random(len(sentiment)) < engagement_rate
+    amount = generator.random(len(sentiment)) * force
+    return np.where(engaged & (force < 0), amount, 0)
+
+
+def population_create_proposal(n_participants: int, total_funds_requested, median_affinity, funding_pool, rng: RandomStream = None) -> np.ndarray:
+    """
+    Participant.create_proposal() for n_participants Participants.
+    """
+    percent_of_funding_pool_being_requested = total_funds_requested/funding_pool
+    proposal_rate = median_affinity / \
+        (1 + percent_of_funding_pool_being_requested)
+    if proposal_rate > 1.0:
+        raise Exception("Rate has a maximum value of 1.0")
+    return (rng or get_rng()).generator.random(n_participants) < proposal_rate
+
+
+def population_vote_on_candidate_proposals(sentiment: np.ndarray, affinity: np.ndarray, rng: RandomStream = None) -> np.ndarray:
+    """
+    Participant.vote_on_candidate_proposals() for every Participant. Returns a
+    boolean matrix shaped like affinity, True where a Participant votes for a
+    Candidate Proposal.
+    """
+    generator = (rng or get_rng()).generator
+    engaged = generator.random(len(sentiment)) < 0.3 * sentiment
+    if affinity.shape[1] == 0:
+        return np.zeros(affinity.shape, dtype=bool)
+    cutoff = vote_cutoff(affinity.max(axis=1))
+    return engaged[:, None] & (affinity > cutoff[:, None])
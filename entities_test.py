@@ -1,9 +1,13 @@
 import unittest
 import uuid
+
+import numpy as np
 from unittest.mock import MagicMock, patch
 
 import utils
-from entities import Participant, Proposal, ProposalStatus
+from entities import (Participant, Proposal, ProposalStatus, population_buy,
+                      population_create_proposal,
+                      population_vote_on_candidate_proposals, population_sell)
 from hatch import TokenBatch
 
 
@@ -17,6 +21,14 @@ class TestProposal(unittest.TestCase):
         p.conviction = 2666666.7
         self.assertTrue(p.has_enough_conviction(10000, 3e6))
 
+    def test_ids_and_slots(self):
+        a, b = Proposal(500, 0.0), Proposal(500, 0.0)
+        self.assertIsInstance(a.uuid, int)
+        self.assertNotEqual(a.uuid, b.uuid)
+        with self.assertRaises(AttributeError):
+            a.unknown_attribute = 1
+        self.assertIn("'funds_requested': 500", repr(a))
+
 
 class TestParticipant(unittest.TestCase):
     def setUp(self):
@@ -157,5 +169,59 @@ class TestParticipant(unittest.TestCase):
             ans[uuid.UUID(int=268821512376988039567204465930241984322)], 187.5)
 
 
+class TestPopulation(unittest.TestCase):
+    def always(self):
+        """
+        A RandomStream whose uniform draws are all 0, so every coin flip with
+        a positive rate comes up True.
+        """
+        rng = MagicMock()
+        rng.generator.random.side_effect = lambda n: np.zeros(n)
+        return rng
+
+    def test_buy_and_sell(self):
+        sentiment = np.array([0, 0.1, 0.5, 1.0])
+        np.testing.assert_array_equal(
+            population_buy(sentiment, self.always()), 0)
+        np.testing.assert_array_equal(
+            population_sell(sentiment, self.always()), 0)
+
+        rng = MagicMock()
+        rng.generator.random.side_effect = [
+            np.zeros(4), np.full(4, 0.5), np.zeros(4), np.full(4, 0.5)]
+        force = sentiment - 0.75
+        np.testing.assert_array_equal(population_buy(sentiment, rng), [
+                                      0, 0, 0, 0.5 * force[3]])
+        np.testing.assert_array_equal(population_sell(sentiment, rng), [
+                                      0, 0.5 * force[1], 0.5 * force[2], 0])
+
+    def test_create_proposal(self):
+        self.assertTrue(population_create_proposal(
+            3, 10000, 0.5, 100000, self.always()).all())
+        with self.assertRaises(Exception):
+            population_create_proposal(3, 0, 2, 100000)
+
+    def test_vote_matches_participant(self):
+        """
+        Every row should get the same votes as
+        Participant.vote_on_candidate_proposals(), including the 0.5 floor.
+        """
+        affinity = np.array([[1.0, 0.9, 0.8, 0.4],
+                             [0.6, 0.55, 0.3, 0.2],
+                             [0.4, 0.3, 0.2, 0.1]])
+        votes = population_vote_on_candidate_proposals(
+            np.full(3, 0.5), affinity, self.always())
+
+        p = Participant()
+        with patch('entities.probability') as mock:
+            mock.return_value = True
+            for row, expected in zip(affinity, votes):
+                ans = p.vote_on_candidate_proposals(dict(enumerate(row)))
+                self.assertEqual(set(ans), set(np.flatnonzero(expected)))
+
+        self.assertEqual(population_vote_on_candidate_proposals(
+            np.full(3, 0.5), np.empty((3, 0))).shape, (3, 0))
+
+
 if __name__ == '__main__':
     unittest.main()
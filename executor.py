@@ -0,0 +1,68 @@
+"""
+A small stand-in for the cadCAD engine, for simulations like this one whose
+state update functions change the network and the Commons in place.
+
+It runs the same partial_state_update_blocks and simulation parameters
+(T, N and M, where M is a single dict of parameters) with the same rules as
+cadCAD: every substep, the outputs of the block's policies are added
+together per key, and every state update function of the block gets the state
+as it was at the start of the substep. What it leaves out is everything the
+simulation doesn't need: copying the state, and keeping its history.
+"""
+import copy
+import operator
+from typing import Callable, Dict, List
+
+
+def run(initial_state: Dict, partial_state_update_blocks: List[Dict], sim_config: Dict,
+        aggregate: Callable = operator.add) -> List[Dict]:
+    """
+    Runs the simulation N times (every run from its own deep copy of
+    initial_state) and returns the final state of every run. State update
+    functions are handed the states of the current timestep so far where
+    cadCAD hands them the whole history.
+
+    aggregate combines the values that two policies of the same block return
+    for the same key, like cadCAD's policy_ops.
+    """
+    params = sim_config["M"]
+    final_states = []
+    for run in range(1, sim_config.get("N", 1) + 1):
+        state = dict(copy.deepcopy(initial_state), run=run, substep=0)
+        # A state restored from a checkpoint carries on from its timestep
+        start = state.setdefault("timestep", 0)
+        for timestep in range(start + 1, start + len(sim_config["T"]) + 1):
+            sL = [state]
+            for substep, block in enumerate(partial_state_update_blocks, start=1):
+                state = run_substep(params, substep, sL, state, block, aggregate)
+                state["timestep"] = timestep
+                sL.append(state)
+        final_states.append(state)
+    return final_states
+
+
+def run_substep(params: Dict, substep: int, sL: List[Dict], state: Dict, block: Dict,
+                aggregate: Callable = operator.add) -> Dict:
+    """
+    Applies one partial state update block to state, and returns the new
+    state.
+
+    A block may name the key of its policies' output that says whether
+    anything happened, as its "event". When that output is falsy, the block's
+    state update functions are skipped, so they must leave the state as it is
+    in that case: cadCAD, which knows nothing about events, runs them anyway.
+    """
+    s = dict(state)
+
+    _input = {}
+    for policy in block["policies"].values():
+        for key, value in policy(params, substep, sL, s).items():
+            _input[key] = aggregate(_input[key], value) if key in _input else value
+
+    event = block.get("event")
+    if event is not None and not _input.get(event):
+        return {**s, "substep": substep}
+
+    new_variables = dict(update(params, substep, sL, s, _input)
+                         for update in block["variables"].values())
+    return {**s, **new_variables, "substep": substep}
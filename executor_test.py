@@ -0,0 +1,71 @@
+import unittest
+
+import executor
+
+
+def p_two(params, step, sL, s):
+    return {"delta": 2, "seen": [s["x"]]}
+
+
+def p_three(params, step, sL, s):
+    return {"delta": 3, "seen": [s["x"]]}
+
+
+def su_x(params, step, sL, s, _input):
+    return "x", s["x"] + _input["delta"]
+
+
+def su_y(params, step, sL, s, _input):
+    # must see x as it was at the start of the substep
+    return "y", s["x"]
+
+
+def su_seen(params, step, sL, s, _input):
+    return "seen", s["seen"] + _input["seen"]
+
+
+blocks = [
+    {
+        "policies": {"two": p_two, "three": p_three},
+        "variables": {"x": su_x, "y": su_y, "seen": su_seen},
+    },
+    {
+        "policies": {},
+        "variables": {"y": su_y},
+    },
+]
+
+
+class TestExecutor(unittest.TestCase):
+    def test_run(self):
+        initial_state = {"x": 0, "y": None, "seen": []}
+        final_states = executor.run(
+            initial_state, blocks, {"T": range(3), "N": 2, "M": {}})
+
+        self.assertEqual([s.pop("run") for s in final_states], [1, 2])
+        self.assertEqual(final_states[0], final_states[1])
+        self.assertEqual(final_states[0], {
+            "x": 15, "y": 15, "seen": [0, 0, 5, 5, 10, 10],
+            "timestep": 3, "substep": 2})
+        self.assertEqual(initial_state["seen"], [])
+
+    def test_run_substep(self):
+        state = executor.run_substep(
+            {}, 1, [], {"x": 1, "y": None, "seen": []}, blocks[0], aggregate=max)
+        self.assertEqual(state, {"x": 4, "y": 1, "seen": [1], "substep": 1})
+
+    def test_run_substep_skips_without_event(self):
+        block = dict(blocks[0], event="delta")
+        state = {"x": 1, "y": None, "seen": []}
+        self.assertEqual(executor.run_substep({}, 1, [], state, block),
+                         {"x": 6, "y": 1, "seen": [1, 1], "substep": 1})
+
+        def p_nothing(params, step, sL, s):
+            return {"delta": 0, "seen": [s["x"]]}
+        block["policies"] = {"nothing": p_nothing}
+        self.assertEqual(executor.run_substep({}, 1, [], state, block),
+                         {"x": 1, "y": None, "seen": [], "substep": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
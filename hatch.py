@@ -1,7 +1,8 @@
-from typing import List, Tuple
+from typing import List, Tuple, Union
 from abcurve import AugmentedBondingCurve
-from datetime import datetime
 from collections import namedtuple
+import numpy as np
+from utils import InPlace
 
 
 def vesting_curve(day: int, cliff_days: int, halflife_days: float) -> float:
@@ -31,11 +32,17 @@ def hatch_raise_split_pools(total_hatch_raise, hatch_tribute) -> Tuple[float, fl
     return funding_pool, collateral_pool
 
 
-def create_token_batches(hatcher_contributions: List[int], desired_token_price: float, vesting_80p_unlocked: int) -> Tuple[List[float], float]:
+# Hatches with at least this many hatchers get a TokenBatchLedger instead of a
+# list of TokenBatches from create_token_batches()
+ledger_threshold = 1000
+
+
+def create_token_batches(hatcher_contributions: List[int], desired_token_price: float, vesting_80p_unlocked: int, ledger: bool = None) -> Tuple[Union[List["TokenBatch"], "TokenBatchLedger"], float]:
     """
     hatcher_contributions: a list of hatcher contributions in DAI/ETH/whatever
     desired_token_price: used to determine the initial token supply
     vesting_80p_unlocked: vesting parameter - the number of days after which 80% of tokens will be unlocked, including the cliff period
+    ledger: whether to return a TokenBatchLedger instead of a list of TokenBatches. By default, only hatches with ledger_threshold or more hatchers do.
     """
     total_hatch_raise = sum(hatcher_contributions)
     initial_token_supply = total_hatch_raise / desired_token_price
@@ -46,6 +53,13 @@ def create_token_batches(hatcher_contributions: List[int], desired_token_price:
 
     cliff_days, halflife_days = convert_80p_to_cliff_and_halflife(
         vesting_80p_unlocked)
+    if ledger is None:
+        ledger = len(hatcher_contributions) >= ledger_threshold
+    if ledger:
+        token_batches = TokenBatchLedger(
+            tokens_per_hatcher, VestingOptions(cliff_days, halflife_days))
+        return token_batches, initial_token_supply
+
     token_batches = [TokenBatch(
         x, VestingOptions(cliff_days, halflife_days)) for x in tokens_per_hatcher]
     return token_batches, initial_token_supply
@@ -55,11 +69,17 @@ VestingOptions = namedtuple("VestingOptions", "cliff_days halflife_days")
 
 
 class TokenBatch:
-    def __init__(self, value: float, vesting_options=None):
+    """
+    Dates are counted in whole simulation days, where day 0 is the hatch.
+    """
+    __slots__ = ("value", "creation_day", "current_day", "hatch_tokens",
+                 "cliff_days", "halflife_days", "spent")
+
+    def __init__(self, value: float, vesting_options=None, creation_day: int = 0):
         self.value = value
-        self.creation_date = datetime.today()
+        self.creation_day = creation_day
         # to be set externally before each spend check
-        self.current_date = datetime.today()
+        self.current_day = creation_day
 
         self.hatch_tokens = False if not vesting_options else True
         self.cliff_days = 0 if not vesting_options else vesting_options.cliff_days
@@ -88,9 +108,8 @@ class TokenBatch:
         returns what fraction of the TokenBatch is unlocked to date
         """
         if self.hatch_tokens:
-            days_delta = self.current_date - self.creation_date
             u = vesting_curve(
-                days_delta.days, self.cliff_days, self.halflife_days)
+                self.current_day - self.creation_day, self.cliff_days, self.halflife_days)
             return u if u > 0 else 0
         else:
             return 1.0
@@ -101,8 +120,8 @@ class TokenBatch:
         returns the argument if successful for your convenience
         """
         if x > self.spendable():
-            raise Exception("Not so many tokens are available for you to spend yet ({})".format(
-                self.current_date))
+            raise Exception("Not so many tokens are available for you to spend yet (day {})".format(
+                self.current_day))
 
         self.value -= x
         self.spent += x
@@ -116,8 +135,100 @@ class TokenBatch:
         return (self.unlocked_fraction() * self.value) - self.spent
 
 
-class Commons:
-    def __init__(self, total_hatch_raise, token_supply, hatch_tribute=0.2, exit_tribute=0):
+class TokenBatchLedger:
+    """
+    Many TokenBatches at once, kept as NumPy columns, so that the unlocked and
+    spendable amounts of all of them can be computed in one go. All batches in
+    a ledger share one clock, current_day, which advance() moves forward.
+
+    ledger[i] (and iterating over the ledger) gives TokenBatchLedgerRows,
+    which behave like TokenBatches but read and write the ledger.
+    """
+
+    def __init__(self, values: List[float], vesting_options=None, creation_day: int = 0):
+        n = len(values)
+        self.value = np.array(values, dtype=float)
+        self.spent = np.zeros(n)
+        self.creation_day = np.full(n, creation_day, dtype=int)
+        self.hatch_tokens = np.full(n, bool(vesting_options))
+        self.cliff_days = np.full(
+            n, vesting_options.cliff_days if vesting_options else 0, dtype=float)
+        self.halflife_days = np.full(
+            n, vesting_options.halflife_days if vesting_options else 0, dtype=float)
+        self.current_day = creation_day
+
+    def __repr__(self):
+        return "<{} {} TokenBatches, day {}>".format(self.__class__.__name__, len(self), self.current_day)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, row: int) -> "TokenBatchLedgerRow":
+        if not -len(self) <= row < len(self):
+            raise IndexError("{} has no row {}".format(
+                self.__class__.__name__, row))
+        return TokenBatchLedgerRow(self, row % len(self))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield TokenBatchLedgerRow(self, row)
+
+    def advance(self, days: int = 1) -> int:
+        self.current_day += days
+        return self.current_day
+
+    def unlocked_fraction(self, day: int = None) -> np.ndarray:
+        """
+        Returns what fraction of every TokenBatch is unlocked on the given day
+        (by default, current_day).
+        """
+        day = self.current_day if day is None else day
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = vesting_curve(day - self.creation_day,
+                              self.cliff_days, self.halflife_days)
+        return np.where(self.hatch_tokens, np.maximum(u, 0), 1.0)
+
+    def spendable(self, day: int = None) -> np.ndarray:
+        return self.unlocked_fraction(day) * self.value - self.spent
+
+
+class TokenBatchLedgerRow(TokenBatch):
+    """
+    A TokenBatch whose data lives in one row of a TokenBatchLedger.
+    current_day is the ledger's shared clock, so it can't be set per row.
+    """
+    __slots__ = ("ledger", "row")
+
+    def __init__(self, ledger: TokenBatchLedger, row: int):
+        self.ledger = ledger
+        self.row = row
+
+    def __reduce__(self):
+        return self.__class__, (self.ledger, self.row)
+
+    def _column(name):
+        def get(self):
+            return getattr(self.ledger, name)[self.row].item()
+
+        def set(self, value):
+            getattr(self.ledger, name)[self.row] = value
+        return property(get, set)
+
+    value = _column("value")
+    spent = _column("spent")
+    creation_day = _column("creation_day")
+    hatch_tokens = _column("hatch_tokens")
+    cliff_days = _column("cliff_days")
+    halflife_days = _column("halflife_days")
+    del _column
+
+    @property
+    def current_day(self) -> int:
+        return self.ledger.current_day
+
+
+class Commons(InPlace):
+    def __init__(self, total_hatch_raise, token_supply, hatch_tribute=0.2, exit_tribute=0, kappa=2):
         # a fledgling commons starts out in the hatching phase. After the hatch phase ends, money from new investors will only go into the collateral pool.
         # Essentials
         self.hatch_tribute = hatch_tribute
@@ -129,11 +240,17 @@ class Commons:
         # hatch_tokens keeps track of the number of tokens that were created when hatching, so we can calculate the unlocking of those
         self._hatch_tokens = token_supply
         self.bonding_curve = AugmentedBondingCurve(
-            self._collateral_pool, token_supply)
+            self._collateral_pool, token_supply, kappa=kappa)
 
         # Options
         self.exit_tribute = exit_tribute
 
+        # Bumped whenever the pools change, so that quotes worked out for one
+        # version of the pools (and the curve's constants) can be reused until
+        # the next change
+        self._pool_version = 0
+        self._price_quote = None  # ((pool version, kappa, invariant), token price)
+
     def deposit(self, dai):
         """
         Deposit DAI after the hatch phase. This means all the incoming deposit goes to the collateral pool.
@@ -142,6 +259,7 @@ class Commons:
             dai, self._collateral_pool, self._token_supply)
         self._token_supply += tokens
         self._collateral_pool += dai
+        self._pool_version += 1
         return tokens, realized_price
 
     def burn(self, tokens):
@@ -152,6 +270,7 @@ class Commons:
             tokens, self._collateral_pool, self._token_supply)
         self._token_supply -= tokens
         self._collateral_pool -= dai
+        self._pool_version += 1
         money_returned = dai
 
         if self.exit_tribute:
@@ -160,18 +279,74 @@ class Commons:
 
         return money_returned, realized_price
 
+    def deposit_batch(self, dai):
+        """
+        Deposit an ordered array of DAI amounts at once, as if deposit() was
+        called on each of them in turn. Returns arrays of the tokens minted and
+        their realized prices.
+        """
+        tokens, realized_prices, self._collateral_pool, self._token_supply = self.bonding_curve.deposit_batch(
+            dai, self._collateral_pool, self._token_supply)
+        self._pool_version += 1
+        return tokens, realized_prices
+
+    def burn_batch(self, tokens):
+        """
+        Burn an ordered array of token amounts at once, as if burn() was called
+        on each of them in turn. Returns arrays of the money returned to each
+        seller (after the exit tribute) and the realized prices.
+        """
+        dai, realized_prices, self._collateral_pool, self._token_supply = self.bonding_curve.burn_batch(
+            tokens, self._collateral_pool, self._token_supply)
+        self._pool_version += 1
+        money_returned = dai
+
+        if self.exit_tribute:
+            self._funding_pool += self.exit_tribute * dai.sum()
+            money_returned = (1-self.exit_tribute) * dai
+
+        return money_returned, realized_prices
+
     def dai_to_tokens(self, dai):
         """
         Given the size of the common's collateral pool, return how many tokens would x DAI buy you.
         """
-        price = self.bonding_curve.get_token_price(self._collateral_pool)
-        return dai / price
+        return dai / self.token_price()
 
     def token_price(self):
         """
         Query the bonding curve for the current token price, given the size of the commons's collateral pool.
+        The price is only worked out again once the pools or the curve's kappa or invariant have changed.
+        """
+        key = (self._pool_version, self.bonding_curve.kappa,
+               self.bonding_curve.invariant)
+        if self._price_quote is None or self._price_quote[0] != key:
+            self._price_quote = (key, self.bonding_curve.get_token_price(
+                self._collateral_pool))
+        return self._price_quote[1]
+
+    def quote_curve(self, dai):
+        """
+        For an array of order sizes in DAI, each considered on its own against
+        the current pools, returns arrays of the tokens that deposit() would
+        mint for it and their realized prices, without depositing anything.
+        For slippage analysis. An order of 0 DAI mints nothing, at the spot
+        price.
+        """
+        dai = np.asarray(dai, dtype=float)
+        tokens = self.bonding_curve.get_token_supply(
+            self._collateral_pool + dai) - self._token_supply
+        with np.errstate(divide="ignore", invalid="ignore"):
+            realized_prices = np.where(dai > 0, dai/tokens, self.token_price())
+        tokens = np.where(dai > 0, tokens, 0)
+        return tokens, realized_prices
+
+    def add_funding(self, amount):
+        """
+        Increases the Common's funding_pool by amount.
         """
-        return self.bonding_curve.get_token_price(self._collateral_pool)
+        self._funding_pool += amount
+        self._pool_version += 1
 
     def spend(self, amount):
         """
@@ -182,4 +357,5 @@ class Commons:
             raise Exception("{} funds requested but funding pool only has {}".format(
                 amount, self._funding_pool))
         self._funding_pool -= amount
+        self._pool_version += 1
         return
@@ -1,6 +1,9 @@
 from hatch import *
+import copy
 import unittest
-import datetime
+import warnings
+from unittest.mock import patch
+import numpy as np
 
 
 class HatchTest(unittest.TestCase):
@@ -41,9 +44,9 @@ class TokenBatchTest(unittest.TestCase):
         tb = TokenBatch(10000)
 
         self. assertEqual(tbh.unlocked_fraction(), 0)
-        tbh.current_date = datetime.datetime.today() + datetime.timedelta(days=3)
+        tbh.current_day = 3
         self.assertEqual(tbh.unlocked_fraction(), 0)
-        tbh.current_date = datetime.datetime.today() + datetime.timedelta(days=6)
+        tbh.current_day = 6
         self.assertEqual(tbh.unlocked_fraction(), 0.5)
 
         self.assertEqual(tb.unlocked_fraction(), 1.0)
@@ -66,12 +69,54 @@ class TokenBatchTest(unittest.TestCase):
             tb.spend(10000)
 
 
+class TokenBatchLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.ledger = TokenBatchLedger(
+            [100, 200, 300], vesting_options=VestingOptions(3, 3))
+        self.batches = [TokenBatch(x, vesting_options=VestingOptions(3, 3))
+                        for x in [100, 200, 300]]
+
+    def test_matches_token_batches(self):
+        for day in [0, 3, 6, 20]:
+            for batch in self.batches:
+                batch.current_day = day
+            np.testing.assert_allclose(self.ledger.unlocked_fraction(day), [
+                b.unlocked_fraction() for b in self.batches])
+            np.testing.assert_allclose(self.ledger.spendable(day), [
+                b.spendable() for b in self.batches])
+
+        unvested = TokenBatchLedger([5, 6])
+        np.testing.assert_array_equal(unvested.spendable(), [5, 6])
+
+    def test_rows_act_like_token_batches(self):
+        row = self.ledger[1]
+        self.assertIsInstance(row, TokenBatch)
+        with self.assertRaises(Exception):
+            row.spend(10)
+
+        self.assertEqual(self.ledger.advance(6), 6)
+        self.assertEqual(row.unlocked_fraction(), 0.5)
+        row.spend(10)
+        self.assertEqual(self.ledger.value[1], 190)
+        self.assertEqual(self.ledger.spent[1], 10)
+        self.assertEqual(row + self.ledger[0], 290)
+        self.assertEqual(len(list(self.ledger)), 3)
+
+    def test_create_token_batches_returns_ledger(self):
+        batches, _ = create_token_batches([1, 2], 0.1, 90)
+        self.assertIsInstance(batches, list)
+        ledger, supply = create_token_batches(
+            [1] * ledger_threshold, 0.1, 90)
+        self.assertIsInstance(ledger, TokenBatchLedger)
+        self.assertAlmostEqual(ledger.value.sum(), supply)
+
+
 class CommonsTest(unittest.TestCase):
     def setUp(self):
         # 100,000 DAI invested for 1,000,000 tokens.
         self.desired_token_price = 0.1
         self.hatcher_contributions = [25000, 25000, 50000]
-        self.token_batches, self.token_supply_initial = contributions_to_token_batches(
+        self.token_batches, self.token_supply_initial = create_token_batches(
             self.hatcher_contributions, self.desired_token_price, 90)
 
         # Because of hatch_tribute, the collateral_pool is 0.7e6. This causes the token's post-hatch price to be 0.14.
@@ -96,3 +141,83 @@ class CommonsTest(unittest.TestCase):
         self.assertEqual(self.commons._token_supply, old_token_supply-50000)
         self.assertEqual(self.commons._collateral_pool,
                          old_collateral_pool-money_returned)
+
+    def test_deposit_batch_matches_deposit(self):
+        other = Commons(sum(self.hatcher_contributions),
+                        self.token_supply_initial, hatch_tribute=0.3)
+        deposits = [1000, 250, 5000]
+        expected = [other.deposit(d) for d in deposits]
+
+        tokens, realized_prices = self.commons.deposit_batch(deposits)
+        for i, (t, p) in enumerate(expected):
+            self.assertAlmostEqual(tokens[i], t)
+            self.assertAlmostEqual(realized_prices[i], p)
+        self.assertAlmostEqual(self.commons._token_supply, other._token_supply)
+        self.assertAlmostEqual(self.commons._collateral_pool,
+                               other._collateral_pool)
+
+    def test_burn_batch_with_exit_tribute(self):
+        self.commons.exit_tribute = 0.35
+        other = Commons(sum(self.hatcher_contributions),
+                        self.token_supply_initial, hatch_tribute=0.3, exit_tribute=0.35)
+        burns = [50000, 1000, 20000]
+        expected = [other.burn(b) for b in burns]
+
+        money_returned, realized_prices = self.commons.burn_batch(burns)
+        for i, (m, p) in enumerate(expected):
+            self.assertAlmostEqual(money_returned[i], m)
+            self.assertAlmostEqual(realized_prices[i], p)
+        self.assertAlmostEqual(self.commons._funding_pool, other._funding_pool)
+        self.assertAlmostEqual(self.commons._collateral_pool,
+                               other._collateral_pool)
+
+    def test_token_price_is_cached_until_the_pools_change(self):
+        price = self.commons.token_price()
+        with patch.object(self.commons.bonding_curve, "get_token_price") as p:
+            self.assertEqual(self.commons.token_price(), price)
+            self.assertEqual(self.commons.dai_to_tokens(1400), 1400 / price)
+            p.assert_not_called()
+
+        for change in [lambda: self.commons.deposit(1000), lambda: self.commons.burn(1000),
+                       lambda: self.commons.deposit_batch([1000]), lambda: self.commons.spend(1),
+                       lambda: self.commons.add_funding(1)]:
+            version = self.commons._pool_version
+            change()
+            self.assertEqual(self.commons._pool_version, version + 1)
+            self.assertEqual(self.commons.token_price(),
+                             self.commons.bonding_curve.get_token_price(self.commons._collateral_pool))
+
+    def test_token_price_follows_the_curve(self):
+        price = self.commons.token_price()
+        self.commons.bonding_curve.kappa = 3
+        self.assertNotEqual(self.commons.token_price(), price)
+        self.assertEqual(self.commons.token_price(),
+                         self.commons.bonding_curve.get_token_price(self.commons._collateral_pool))
+        self.commons.bonding_curve.invariant *= 2
+        self.assertEqual(self.commons.token_price(),
+                         self.commons.bonding_curve.get_token_price(self.commons._collateral_pool))
+
+    def test_quote_curve(self):
+        sizes = [10, 1000, 50000]
+        tokens, realized_prices = self.commons.quote_curve(sizes)
+        for i, size in enumerate(sizes):
+            other = copy.deepcopy(self.commons)
+            t, p = other.deposit(size)
+            self.assertAlmostEqual(tokens[i], t)
+            self.assertAlmostEqual(realized_prices[i], p)
+        # bigger orders slip further from the spot price
+        self.assertTrue(np.all(np.diff(realized_prices) > 0))
+        self.assertGreater(realized_prices[0], self.commons.token_price())
+        self.assertEqual(self.commons._collateral_pool, 70000)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            tokens, realized_prices = self.commons.quote_curve([0, 10])
+        self.assertEqual(tokens[0], 0)
+        self.assertEqual(realized_prices[0], self.commons.token_price())
+
+    def test_kappa(self):
+        commons = Commons(sum(self.hatcher_contributions),
+                          self.token_supply_initial, hatch_tribute=0.3, kappa=3)
+        self.assertEqual(commons.bonding_curve.kappa, 3)
+        self.assertAlmostEqual(commons.token_price(), 0.21)
@@ -0,0 +1,70 @@
+import pickle
+import unittest
+
+from instrumentation import Profiler, Timed
+
+
+def p_one(params, step, sL, s):
+    return {"delta": 1}
+
+
+def su_add(params, step, sL, s, _input):
+    return "x", s["x"] + _input["delta"]
+
+
+blocks = [
+    {"policies": {"one": p_one}, "variables": {"x": su_add}},
+    {"policies": {}, "variables": {"x": su_add}},
+]
+
+
+class TestProfiler(unittest.TestCase):
+    def run_blocks(self, blocks, timesteps):
+        s = {"x": 0}
+        for _ in range(timesteps):
+            _input = {"delta": 0}
+            for block in blocks:
+                for policy in block["policies"].values():
+                    _input = policy({}, 1, [], s)
+                for update in block["variables"].values():
+                    key, value = update({}, 1, [], s, _input)
+                    s[key] = value
+        return s
+
+    def test_wrapped_blocks_behave_the_same(self):
+        profiler = Profiler()
+        wrapped = profiler.wrap(blocks)
+        self.assertIsInstance(wrapped[0]["policies"]["one"], Timed)
+        self.assertIs(blocks[0]["policies"]["one"], p_one)
+        self.assertEqual(self.run_blocks(wrapped, 10),
+                         self.run_blocks(blocks, 10))
+
+        pickle.dumps(wrapped)
+
+    def test_summary_and_report(self):
+        profiler = Profiler()
+        self.run_blocks(profiler.wrap(blocks), 10)
+
+        rows = profiler.summary()
+        self.assertEqual([(row["block"], row["kind"], row["function"], row["calls"]) for row in rows], [
+            (1, "policies", "p_one", 10),
+            (1, "variables", "su_add", 10),
+            (2, "variables", "su_add", 10),
+        ])
+        for row in rows:
+            self.assertGreaterEqual(row["p99"], row["mean"])
+            self.assertAlmostEqual(row["total"], row["mean"] * row["calls"])
+
+        report = profiler.report()
+        self.assertIn("block 1", report)
+        self.assertIn("block 2", report)
+        self.assertIn("variables x: su_add", report)
+
+    def test_disabled_changes_nothing(self):
+        profiler = Profiler(enabled=False)
+        self.assertIs(profiler.wrap(blocks), blocks)
+        self.assertEqual(profiler.summary(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
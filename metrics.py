@@ -0,0 +1,117 @@
+from functools import partial
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from entities import ProposalStatus
+from network_utils import get_index, get_participants, get_proposals
+
+
+def _commons_attribute(name, s):
+    # The Commons itself rather than its state variable copies, which are
+    # only brought up to date once per timestep
+    return getattr(s["commons"], name)
+
+
+def _mean_sentiment(s):
+    network = s["network"]
+    index = get_index(network)
+    if index is not None:
+        sentiment = index.sentiment
+    else:
+        sentiment = [p.sentiment for _, p in get_participants(network)]
+    return np.mean(sentiment) if len(sentiment) else np.nan
+
+
+def _token_price(s):
+    return s["commons"].token_price()
+
+
+def _count_participants(s):
+    return len(get_participants(s["network"]))
+
+
+def _count_proposals(status, s):
+    return len(get_proposals(s["network"], status=status))
+
+
+# Picklable functions (so no lambdas) that compute a number from the state
+default_metrics = {
+    "funding_pool": partial(_commons_attribute, "_funding_pool"),
+    "collateral_pool": partial(_commons_attribute, "_collateral_pool"),
+    "token_supply": partial(_commons_attribute, "_token_supply"),
+    # the mean of every Participant's sentiment
+    "sentiment": _mean_sentiment,
+    "token_price": _token_price,
+    "participants": _count_participants,
+    **{"proposals_" + status.name.lower(): partial(_count_proposals, status)
+       for status in ProposalStatus},
+}
+
+
+class MetricsRecorder:
+    """
+    Records a few numbers computed from the state (see default_metrics) once
+    per timestep, into NumPy columns that are allocated up front, so that a
+    run's results take up metrics x timesteps floats no matter how big the
+    network grows.
+
+    attach() adds a block at the end of partial_state_update_blocks whose only
+    state update function is su_record, for the "metrics" state variable,
+    which should hold the recorder itself in the initial state. That way it
+    records the state as every other block of the timestep left it, even if
+    their state update functions return new values rather than changing the
+    state in place. The recorder is a sink and not really part of the state,
+    so copying the state doesn't copy it.
+    """
+
+    def __init__(self, timesteps: int, metrics: Dict[str, Callable[[dict], float]] = None):
+        self.metrics = metrics or default_metrics
+        self.timestep = np.zeros(timesteps, dtype=int)
+        self.columns = {name: np.full(timesteps, np.nan)
+                        for name in self.metrics}
+        self.n_rows = 0
+
+    def __repr__(self):
+        return "<{} {} of {} timesteps recorded>".format(self.__class__.__name__, self.n_rows, len(self.timestep))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def record(self, timestep: int, s: dict):
+        if self.n_rows == len(self.timestep):
+            self._grow()
+        row = self.n_rows
+        self.timestep[row] = timestep
+        for name, metric in self.metrics.items():
+            self.columns[name][row] = metric(s)
+        self.n_rows += 1
+
+    def _grow(self):
+        capacity = max(1, 2*len(self.timestep))
+        self.timestep = np.resize(self.timestep, capacity)
+        for name, column in self.columns.items():
+            grown = np.full(capacity, np.nan)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+
+    def su_record(self, params, step, sL, s, _input):
+        self.record(s.get("timestep", self.n_rows), s)
+        return "metrics", self
+
+    def attach(self, partial_state_update_blocks: List[dict]) -> List[dict]:
+        return partial_state_update_blocks + [{
+            "policies": {},
+            "variables": {"metrics": self.su_record},
+        }]
+
+    def to_dataframe(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        data = {"timestep": self.timestep[:self.n_rows]}
+        for name, column in self.columns.items():
+            data[name] = column[:self.n_rows]
+        return pd.DataFrame(data)
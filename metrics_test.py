@@ -0,0 +1,77 @@
+import copy
+import unittest
+
+from entities import ProposalStatus
+from hatch import Commons, TokenBatch, VestingOptions
+from metrics import MetricsRecorder
+from network_utils import bootstrap_network
+
+
+class TestMetricsRecorder(unittest.TestCase):
+    def setUp(self):
+        self.commons = Commons(10000, 1000)
+        self.network = bootstrap_network([TokenBatch(1000, VestingOptions(10, 30))
+                                          for _ in range(4)], 3, 3000, 4e6)
+        self.state = {
+            "network": self.network,
+            "commons": self.commons,
+            "funding_pool": self.commons._funding_pool,
+            "collateral_pool": self.commons._collateral_pool,
+            "token_supply": self.commons._token_supply,
+            "sentiment": 0.5,
+            "timestep": 1,
+        }
+
+    def test_record(self):
+        recorder = MetricsRecorder(2)
+        recorder.record(1, self.state)
+        self.network.nodes[4]["item"].status = ProposalStatus.ACTIVE
+        self.commons.spend(1000)
+        for i in range(4):
+            self.network.nodes[i]["item"].sentiment = 0.25 * i
+        recorder.record(2, self.state)
+
+        df = recorder.to_dataframe()
+        self.assertEqual(list(df.timestep), [1, 2])
+        # read from the Commons, not from the state variables
+        self.assertEqual(list(df.funding_pool), [2000, 1000])
+        self.assertEqual(df.sentiment[1], 0.375)
+        self.assertEqual(list(df.participants), [4, 4])
+        self.assertEqual(list(df.proposals_candidate), [3, 2])
+        self.assertEqual(list(df.proposals_active), [0, 1])
+        self.assertEqual(df.token_price[0], self.commons.token_price())
+
+    def test_grows_past_the_expected_timesteps(self):
+        recorder = MetricsRecorder(1, metrics={"sentiment": lambda s: s["sentiment"]})
+        for t in range(5):
+            recorder.record(t, self.state)
+        df = recorder.to_dataframe()
+        self.assertEqual(list(df.timestep), list(range(5)))
+        self.assertEqual(list(df.columns), ["timestep", "sentiment"])
+
+    def test_attach(self):
+        """
+        attach() must add the recorder in a block of its own at the end,
+        without changing the original blocks.
+        """
+        blocks = [{"policies": {}, "variables": {"a": None}},
+                  {"policies": {}, "variables": {"b": None}}]
+        recorder = MetricsRecorder(3)
+        attached = recorder.attach(blocks)
+
+        self.assertEqual(len(attached), 3)
+        self.assertEqual(attached[2]["variables"], {"metrics": recorder.su_record})
+        self.assertEqual(attached[:2], blocks)
+        self.assertEqual(len(blocks), 2)
+
+        key, value = recorder.su_record(None, 2, [], self.state, {})
+        self.assertEqual((key, value), ("metrics", recorder))
+        self.assertEqual(recorder.n_rows, 1)
+
+    def test_copying_the_state_doesnt_copy_the_recorder(self):
+        recorder = MetricsRecorder(3)
+        self.assertIs(copy.deepcopy({"metrics": recorder})["metrics"], recorder)
+
+
+if __name__ == '__main__':
+    unittest.main()
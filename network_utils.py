@@ -1,25 +1,579 @@
+from collections import defaultdict
+from collections.abc import Set
+from functools import cached_property
 from typing import Dict, List, Tuple
 
 import networkx as nx
 import numpy as np
-from scipy.stats import expon, gamma
+from networkx.classes.reportviews import (InEdgeDataView, InEdgeView,
+                                          OutEdgeDataView, OutEdgeView)
 
 from convictionvoting import trigger_threshold
 from entities import Participant, Proposal, ProposalStatus
-from hatch import TokenBatch
+from hatch import TokenBatch, TokenBatchLedgerRow
+from supportmatrix import SupportMatrix
+from utils import InPlace, RandomStream, bernoulli_positions, get_rng
 
 
-def get_edges_by_type(network, edge_type_selection):
-    def filter_by_type(n1, n2):
-        if network.edges[(n1, n2)]["type"] == edge_type_selection:
+def _support_edges(network: nx.DiGraph, nbunch=None, incoming=False):
+    """
+    Yields (participant, proposal, SupportEdge) for every support edge in the
+    network's SupportMatrix, or only for those out of (or, if incoming, into)
+    the nodes in nbunch.
+    """
+    support = network.graph.get("support")
+    if support is None:
+        return
+    rows = support.row_nodes.tolist()
+    cols = support.col_nodes.tolist()
+    if nbunch is not None:
+        if incoming:
+            cols = [j for j in cols if j in nbunch]
+        else:
+            rows = [i for i in rows if i in nbunch]
+    for i in rows:
+        for j in cols:
+            yield i, j, support[i, j]
+
+
+def _count_support_edges(network: nx.DiGraph, nbunch=None, incoming=False) -> int:
+    support = network.graph.get("support")
+    if support is None:
+        return 0
+    if nbunch is None:
+        return len(support)
+    if incoming:
+        return support.n_rows * sum(j in support.col_of for j in nbunch)
+    return support.n_cols * sum(i in support.row_of for i in nbunch)
+
+
+def _has_support_edge(network: nx.DiGraph, u, v) -> bool:
+    support = network.graph.get("support")
+    return support is not None and (u, v) in support
+
+
+class SupportOutEdgeDataView(OutEdgeDataView):
+    __slots__ = ()
+    incoming = False
+
+    def __len__(self):
+        return super().__len__() + _count_support_edges(self._viewer._graph, self._nbunch, self.incoming)
+
+    def __iter__(self):
+        yield from super().__iter__()
+        for u, v, edge in _support_edges(self._viewer._graph, self._nbunch, self.incoming):
+            yield self._report(u, v, edge)
+
+    def __contains__(self, e):
+        if super().__contains__(e):
             return True
-        return False
+        u, v = e[:2]
+        if self._nbunch is not None and (v if self.incoming else u) not in self._nbunch:
+            return False
+        network = self._viewer._graph
+        return _has_support_edge(network, u, v) and e == self._report(u, v, network.graph["support"][u, v])
+
+
+class SupportInEdgeDataView(SupportOutEdgeDataView, InEdgeDataView):
+    # super() in SupportOutEdgeDataView resolves to InEdgeDataView here
+    __slots__ = ()
+    incoming = True
+
+
+class SupportOutEdgeView(OutEdgeView):
+    """
+    networkx's view of the edges of a DiGraph, which also lists the support
+    edges kept in the network's SupportMatrix, so that reads like
+    network.edges[i, j]["affinity"] keep working (see SupportEdge).
+    """
+    __slots__ = ()
+    dataview = SupportOutEdgeDataView
+
+    def __len__(self):
+        return super().__len__() + _count_support_edges(self._graph)
+
+    def __iter__(self):
+        yield from super().__iter__()
+        for u, v, _ in _support_edges(self._graph):
+            yield u, v
+
+    def __contains__(self, e):
+        return super().__contains__(e) or _has_support_edge(self._graph, *e)
+
+    def __getitem__(self, e):
+        u, v = e
+        if _has_support_edge(self._graph, u, v):
+            return self._graph.graph["support"][u, v]
+        return super().__getitem__(e)
+
+
+class SupportInEdgeView(SupportOutEdgeView, InEdgeView):
+    # super() in SupportOutEdgeView resolves to InEdgeView here
+    __slots__ = ()
+    dataview = SupportInEdgeDataView
+
+
+class NodeItemsView:
+    """
+    A live, read only view of a dict of node index -> item in the NetworkIndex,
+    which behaves like the NodeDataView that filtering the graph with
+    nx.subgraph_view() and calling nodes(data="item") returns: it iterates
+    over (node, item) pairs, view[node] is the item, and node in view as well
+    as (node, item) in view are True for the nodes in it.
+    """
+    __slots__ = ("_items",)
+
+    def __init__(self, items: dict):
+        self._items = items
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, dict(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.items())
+
+    def __getitem__(self, n):
+        return self._items[n]
+
+    def __contains__(self, n):
+        try:
+            if n in self._items:
+                return True
+        except TypeError:
+            pass
+        try:
+            n, item = n
+        except (TypeError, ValueError):
+            return False
+        return n in self._items and self._items[n] == item
+
+
+class EdgesOfTypeView(Set):
+    """
+    A live, read only view of the edges of one type that the NetworkIndex
+    knows about, which behaves like the EdgeView that filtering the graph with
+    nx.subgraph_view() and calling edges() returns: it iterates over (u, v)
+    pairs, view[u, v] is the edge's attribute dict, and data() works like
+    EdgeView.data().
+    """
+    __slots__ = ("_network", "_edges")
+
+    def __init__(self, network: nx.DiGraph, edges: dict):
+        self._network = network
+        self._edges = edges
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, list(self._edges))
+
+    def __len__(self):
+        return len(self._edges)
 
-    view = nx.subgraph_view(network, filter_edge=filter_by_type)
-    return view.edges()
+    def __iter__(self):
+        return iter(self._edges)
+
+    def __contains__(self, e):
+        try:
+            return e in self._edges
+        except TypeError:
+            return False
+
+    def __getitem__(self, e):
+        if e not in self._edges:
+            raise KeyError(e)
+        return self._network.edges[e]
+
+    def data(self, data=True, default=None):
+        for u, v in self._edges:
+            attr = self._network.edges[u, v]
+            if data is True:
+                yield u, v, attr
+            elif data is False:
+                yield u, v
+            else:
+                yield u, v, attr.get(data, default)
+
+
+class CommonsNetwork(InPlace, nx.DiGraph):
+    """
+    The DiGraph that create_network() returns. It is a plain nx.DiGraph,
+    except that it can be passed between substeps without being copied, see
+    utils.InPlace, and that its support edges live in a SupportMatrix (see
+    get_support_matrix()).
+
+    network.edges, in_edges, out_edges, has_edge() and add_edge() take the
+    support edges into account like any other edge, so networkx style code
+    like network.edges[i, j]["affinity"] = 1 keeps working.
+    """
+
+    @cached_property
+    def edges(self):
+        return SupportOutEdgeView(self)
+
+    @cached_property
+    def out_edges(self):
+        return SupportOutEdgeView(self)
+
+    @cached_property
+    def in_edges(self):
+        return SupportInEdgeView(self)
+
+    def has_edge(self, u, v):
+        return super().has_edge(u, v) or _has_support_edge(self, u, v)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        """
+        Like nx.DiGraph.add_edge(), except that a "support" edge is stored in
+        the SupportMatrix, which gets a row for the Participant and a column
+        for the Proposal if it doesn't have them yet. Their other support
+        edges start out with all attributes 0.
+        """
+        if attr.get("type") != "support":
+            return super().add_edge(u_of_edge, v_of_edge, **attr)
+
+        for node in (u_of_edge, v_of_edge):
+            if node not in self:
+                self.add_node(node)
+        support = get_support_matrix(self)
+        if u_of_edge not in support.row_of:
+            support.add_participant(u_of_edge, np.zeros(support.n_cols))
+        if v_of_edge not in support.col_of:
+            support.add_proposal(v_of_edge, np.zeros(support.n_rows))
+        edge = support[u_of_edge, v_of_edge]
+        for key, value in attr.items():
+            if key != "type":
+                edge[key] = value
+
+
+class NetworkIndex:
+    """
+    Keeps track of which nodes are Participants/Proposals (and in which
+    ProposalStatus), and which edges are of which type, so that finding them
+    doesn't require filtering the whole graph. Support edges are not networkx
+    edges and live in the SupportMatrix instead.
+
+    create_network() stores one in network.graph["index"], and the helpers in
+    this module that add nodes and edges keep it up to date. Proposals report
+    changes to their status and funds_requested to it by themselves. If nodes are added to the
+    network behind its back, the index notices because the node count
+    changes, and is rebuilt.
+    """
+
+    def __init__(self):
+        self.n_nodes = 0
+        self.participants = {}
+        self.participant_ids = []
+        self.participant_positions = {}
+        self.proposals = {}
+        self.proposals_by_status = {status: {} for status in ProposalStatus}
+        self.edges_by_type = defaultdict(dict)
+        self.candidate_funds_requested = 0
+        self._proposal_idx = {}
+        # (influencer, influenced, influence) of every influence edge, in
+        # arrays that double in size when they run out of room
+        self.n_influences = 0
+        self._influence_sources = np.zeros(16, dtype=int)
+        self._influence_targets = np.zeros(16, dtype=int)
+        self._influence_values = np.zeros(16)
+        self._influence_matrix = None
+        # Where every Participant's holdings are kept: [ledger, positions,
+        # rows] for the TokenBatchLedgerRows of every TokenBatchLedger, and
+        # the positions of the plain TokenBatches. Participants whose holdings
+        # are replaced make them stale, and they are found again when needed.
+        self._ledger_holdings = []
+        self._batch_positions = []
+        self._batches = []
+        self._holdings_stale = False
+        # every Participant's sentiment, which the Participants read and write
+        # through their sentiment property
+        self._sentiment = np.zeros(16)
+
+    def add_node(self, idx, item):
+        self.n_nodes += 1
+        if isinstance(item, Participant):
+            self.participants[idx] = item
+            self.participant_positions[idx] = len(self.participant_ids)
+            self.participant_ids.append(idx)
+            self._add_holdings(self.participant_positions[idx], item)
+            self._add_sentiment(self.participant_positions[idx], item)
+        elif isinstance(item, Proposal):
+            self.proposals[idx] = item
+            self.proposals_by_status[item.status][idx] = item
+            self._proposal_idx[item] = idx
+            item._observer = self.proposal_changed
+            if item.status == ProposalStatus.CANDIDATE:
+                self.candidate_funds_requested += item.funds_requested
+
+    def add_edge(self, u, v, attr: dict):
+        edge_type = attr["type"]
+        # dicts double as insertion ordered sets, whose keys() are a live view
+        edges = self.edges_by_type[edge_type]
+        if edge_type != "influence":
+            edges[(u, v)] = None
+            return
+
+        # influence edges remember where their influence is kept
+        position = edges.get((u, v))
+        if position is None:
+            position = edges[(u, v)] = self.n_influences
+            if position == len(self._influence_values):
+                capacity = 2*position
+                self._influence_sources = np.resize(
+                    self._influence_sources, capacity)
+                self._influence_targets = np.resize(
+                    self._influence_targets, capacity)
+                self._influence_values = np.resize(
+                    self._influence_values, capacity)
+            self._influence_sources[position] = u
+            self._influence_targets[position] = v
+            self.n_influences += 1
+        self._influence_values[position] = attr.get("influence", 0)
+        self._influence_matrix = None
+
+    def _add_holdings(self, position: int, participant: Participant):
+        for batch in (participant.holdings_vesting, participant.holdings_nonvesting):
+            if batch is None:
+                continue
+            if isinstance(batch, TokenBatchLedgerRow):
+                group = next((group for group in self._ledger_holdings
+                              if group[0] is batch.ledger), None)
+                if group is None:
+                    group = [batch.ledger, [], []]
+                    self._ledger_holdings.append(group)
+                group[1].append(position)
+                group[2].append(batch.row)
+            else:
+                self._batch_positions.append(position)
+                self._batches.append(batch)
+
+    def holdings_changed(self):
+        self._holdings_stale = True
+
+    def _add_sentiment(self, position: int, participant: Participant):
+        if position == len(self._sentiment):
+            self._sentiment = np.resize(self._sentiment, 2*position)
+        self._sentiment[position] = participant.sentiment
+        participant._sentiments = (self, position)
+
+    @property
+    def sentiment(self) -> np.ndarray:
+        """
+        The sentiment of every Participant, in the order of participant_ids.
+        Writing to it changes the Participants' sentiment.
+        """
+        return self._sentiment[:len(self.participant_ids)]
+
+    def holdings(self) -> np.ndarray:
+        """
+        See get_holdings(), in the order of participant_ids. Ledger rows are
+        read straight from their TokenBatchLedger's value column.
+        """
+        if self._holdings_stale:
+            self._ledger_holdings = []
+            self._batch_positions = []
+            self._batches = []
+            for position, idx in enumerate(self.participant_ids):
+                self._add_holdings(position, self.participants[idx])
+            self._holdings_stale = False
+        holdings = np.zeros(len(self.participant_ids))
+        for ledger, positions, rows in self._ledger_holdings:
+            np.add.at(holdings, positions, ledger.value[rows])
+        values = np.fromiter((batch.value for batch in self._batches),
+                             dtype=float, count=len(self._batches))
+        np.add.at(holdings, self._batch_positions, values)
+        return holdings
+
+    def influence_matrix(self) -> "scipy.sparse.csr_matrix":
+        """
+        See get_influence_matrix(). Built from the influence edges recorded so
+        far, and cached until the next Participant or influence edge arrives.
+        """
+        n = len(self.participant_ids)
+        if self._influence_matrix is not None and self._influence_matrix.shape[0] == n:
+            return self._influence_matrix
+        from scipy.sparse import csr_matrix
+
+        ids = np.array(self.participant_ids, dtype=int)
+        position_of = np.zeros(ids.max() + 1 if n else 0, dtype=int)
+        position_of[ids] = np.arange(n)
+        k = self.n_influences
+        self._influence_matrix = csr_matrix(
+            (self._influence_values[:k],
+             (position_of[self._influence_sources[:k]],
+              position_of[self._influence_targets[:k]])),
+            shape=(n, n))
+        return self._influence_matrix
+
+    def proposal_changed(self, proposal: Proposal, old_status: ProposalStatus, old_funds_requested: float):
+        idx = self._proposal_idx[proposal]
+        if old_status != proposal.status:
+            del self.proposals_by_status[old_status][idx]
+            self.proposals_by_status[proposal.status][idx] = proposal
+
+        if old_status == ProposalStatus.CANDIDATE:
+            self.candidate_funds_requested -= old_funds_requested
+            if not self.proposals_by_status[ProposalStatus.CANDIDATE]:
+                # don't let rounding errors pile up
+                self.candidate_funds_requested = 0
+        if proposal.status == ProposalStatus.CANDIDATE:
+            self.candidate_funds_requested += proposal.funds_requested
+
+
+def index_network(network: nx.DiGraph) -> NetworkIndex:
+    """
+    Builds a NetworkIndex from scratch for an existing network and attaches it
+    to the network, so that the get_* helpers can use it from now on.
+    """
+    index = NetworkIndex()
+    for idx, item in network.nodes(data="item"):
+        index.add_node(idx, item)
+    # network.adj rather than network.edges, which lists the support edges in
+    # the SupportMatrix as well
+    for u, neighbours in network.adj.items():
+        for v, attr in neighbours.items():
+            index.add_edge(u, v, attr)
+    network.graph["index"] = index
+    return index
+
+
+def get_index(network: nx.DiGraph) -> NetworkIndex:
+    """
+    Returns the network's NetworkIndex, or None if the network was built by
+    hand and doesn't have one.
+    """
+    index = network.graph.get("index")
+    if index is not None and index.n_nodes != len(network):
+        index = index_network(network)
+    return index
+
+
+def _add_node(network: nx.DiGraph, idx: int, item):
+    index = get_index(network)
+    network.add_node(idx, item=item)
+    if index is not None:
+        index.add_node(idx, item)
+
+
+def _add_edge(network: nx.DiGraph, u: int, v: int, **attr):
+    network.add_edge(u, v, **attr)
+    index = get_index(network)
+    if index is not None:
+        index.add_edge(u, v, attr)
+
+
+def _add_edges_from(network: nx.DiGraph, edges: List[Tuple[int, int, dict]]):
+    network.add_edges_from(edges)
+    index = get_index(network)
+    if index is not None:
+        for u, v, attr in edges:
+            index.add_edge(u, v, attr)
+
+
+def get_participant_ids(network: nx.DiGraph) -> List[int]:
+    """
+    Returns the node indexes of all Participants, in the order they were added.
+    """
+    index = get_index(network)
+    if index is not None:
+        return index.participant_ids
+    return [i for i, _ in get_participants(network)]
+
+
+def get_participant_positions(network: nx.DiGraph) -> Dict[int, int]:
+    """
+    Maps the node index of every Participant to its position in
+    get_participant_ids().
+    """
+    index = get_index(network)
+    if index is not None:
+        return index.participant_positions
+    return {i: position for position, i in enumerate(get_participant_ids(network))}
+
+
+def get_edges_by_type(network, edge_type_selection):
+    """
+    Returns a live view of the edges of type edge_type_selection, which
+    behaves like the networkx EdgeView of those edges: it iterates over
+    (u, v), has a len(), view[u, v] is the edge's attribute dict and data()
+    yields (u, v, data). Support edges come from the SupportMatrix (see
+    SupportEdgesView), the others from the NetworkIndex (see EdgesOfTypeView).
+    """
+    if edge_type_selection == "support" and "support" in network.graph:
+        return network.graph["support"].edges()
+
+    index = get_index(network)
+    if index is not None:
+        return EdgesOfTypeView(network, index.edges_by_type.get(edge_type_selection, {}))
+
+    # network.adj rather than network.edges, see index_network()
+    return EdgesOfTypeView(network, {(u, v): None for u, neighbours in network.adj.items()
+                                     for v, attr in neighbours.items() if attr["type"] == edge_type_selection})
+
+
+def get_influence_matrix(network: nx.DiGraph) -> "scipy.sparse.csr_matrix":
+    """
+    Returns the influence edges as a sparse matrix with a row and a column for
+    every Participant, in the order of get_participant_ids(). Entry [i, j] is
+    the influence of Participant i over Participant j.
+
+    The index keeps track of influence edges as they are added through the
+    helpers in this module, so changing an "influence" attribute directly on
+    the networkx edge doesn't show up here.
+    """
+    index = get_index(network)
+    if index is None:
+        index = index_network(network)
+    return index.influence_matrix()
+
+
+def propagate_sentiment(network: nx.DiGraph, decay: float) -> nx.DiGraph:
+    """
+    Moves every Participant's sentiment a fraction decay of the way towards
+    the mean sentiment of the Participants that influence it, weighted by
+    their influence. Participants nobody influences keep their sentiment.
+
+    The weighted sums and the total influence over every Participant come out
+    of a single sparse matrix product. With a NetworkIndex, the sentiment is
+    read from and written back to its sentiment array in one go.
+    """
+    index = get_index(network)
+    if index is not None:
+        participants = None
+        sentiment = index.sentiment
+    else:
+        participants = [participant for _, participant in get_participants(network)]
+        sentiment = np.array([p.sentiment for p in participants])
+    if not len(sentiment):
+        return network
+    influence = get_influence_matrix(network)
+
+    weighted, total = (influence.T @ np.column_stack(
+        [sentiment, np.ones(len(sentiment))])).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        target = np.where(total > 0, weighted / total, sentiment)
+    sentiment += decay * (target - sentiment)
+
+    if participants is not None:
+        for participant, new_sentiment in zip(participants, sentiment.tolist()):
+            participant.sentiment = new_sentiment
+    return network
 
 
 def get_proposals(network, status: ProposalStatus = None):
+    """
+    Returns a live view of the Proposals (in the given status) that iterates
+    over (node index, Proposal), like network.nodes(data="item") does, and
+    whose view[node index] is the Proposal. With a NetworkIndex it is a
+    NodeItemsView, otherwise a networkx NodeDataView.
+    """
+    index = get_index(network)
+    if index is not None:
+        if status:
+            return NodeItemsView(index.proposals_by_status[status])
+        return NodeItemsView(index.proposals)
+
     def filter_proposal(n):
         if isinstance(network.nodes[n]["item"], Proposal):
             if status:
@@ -32,6 +586,13 @@ def get_proposals(network, status: ProposalStatus = None):
 
 
 def get_participants(network) -> Dict[int, Participant]:
+    """
+    Like get_proposals(), for the Participants.
+    """
+    index = get_index(network)
+    if index is not None:
+        return NodeItemsView(index.participants)
+
     def filter_participant(n):
         if isinstance(network.nodes[n]["item"], Participant):
             return True
@@ -40,9 +601,17 @@ def get_participants(network) -> Dict[int, Participant]:
     return view.nodes(data="item")
 
 
+def add_participant(network: nx.DiGraph, p: Participant) -> Tuple[nx.DiGraph, int]:
+    i = len(network.nodes)
+    _add_node(network, i, p)
+    network = setup_influence_edges_single(network, i)
+    network = setup_support_edges(network, i)
+    return network, i
+
+
 def add_proposal(network: nx.DiGraph, p: Proposal) -> Tuple[nx.DiGraph, int]:
     j = len(network.nodes)
-    network.add_node(j, item=p)
+    _add_node(network, j, p)
     network = setup_support_edges(network, j)
     return network, j
 
@@ -52,34 +621,38 @@ def create_network(participants: List[TokenBatch]) -> nx.DiGraph:
     Creates a new DiGraph with Participants corresponding to the input
     TokenBatches.
     """
-    network = nx.DiGraph()
+    network = CommonsNetwork()
+    network.graph["index"] = NetworkIndex()
     for i, p in enumerate(participants):
         p_instance = Participant(
             holdings_vesting=p, holdings_nonvesting=TokenBatch(0))
-        network.add_node(i, item=p_instance)
+        _add_node(network, i, p_instance)
     return network
 
 
-def influence(scale=1, sigmas=3):
+def draw_influences(n_pairs: int, scale=1, sigmas=3, rng: RandomStream = None) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Calculates the likelihood of one node having influence over another node. If
-    so, it returns an influence value, else None.
-
-    expon.rvs with the standard kwargs gives you a lot more values smaller than
-    1, but quite a few outliers that could go all the way up to even 8.
-
-    Unless your influence is 3 standard deviations above the norm (where scale
-    determines the size of the standard deviation), you don't have any influence
-    at all.
-
-    This is broken out so that code that populates the graph initially and code
-    that adds new Participants later on can share this code.
+    Decides which of n_pairs pairs of nodes have influence over each other.
+
+    An exponential draw (with the given scale) for every pair would give a lot
+    of values smaller than 1, but quite a few outliers that could go all the
+    way up to even 8. Unless a pair's draw is sigmas standard deviations above
+    the norm (where scale determines the size of the standard deviation), it
+    doesn't have any influence at all. So instead of drawing a value for every
+    pair, only the about e^-(1+sigmas*scale) of them that will get an
+    influence value are picked out, and only their values are drawn.
+
+    Returns the positions (from 0 to n_pairs-1) of the pairs that got an
+    influence value, and those values.
     """
-
-    influence_rv = expon.rvs(loc=0.0, scale=scale)
-    if influence_rv > scale+sigmas*scale**2:
-        return influence_rv
-    return None
+    rng = rng or get_rng()
+    threshold = scale+sigmas*scale**2
+    positions = bernoulli_positions(n_pairs, np.exp(-threshold/scale), rng)
+    # The exponential distribution is memoryless: given that a draw was above
+    # the threshold, it is the threshold plus another exponential draw.
+    influences = threshold + \
+        rng.generator.exponential(scale, size=len(positions))
+    return positions, influences
 
 
 def setup_influence_edges_bulk(network: nx.DiGraph) -> nx.DiGraph:
@@ -89,46 +662,73 @@ def setup_influence_edges_bulk(network: nx.DiGraph) -> nx.DiGraph:
     corresponding edge in the graph. If an "influence" type edge already exists,
     it will skip it.
 
-    Takes an optional participant argument, which is the index number of the
-    Participant in network.nodes. If this argument is present, it will setup the
-    influence edges only for this Participant.
-    """
-    # Turn it into a dict to make a copy out of the View, because the View
-    # changes whenever we add edges to the graph, which results in RuntimeError:
-    # dictionary changed size during iteration
-    participants = dict(get_participants(network))
-
-    for i in participants:
-        for other_participant in participants:
-            if not(other_participant == i) and not network.has_edge(i, other_participant):
-                influence_rv = influence()
-                if influence_rv:
-                    network.add_edge(i, other_participant,
-                                     influence=influence_rv, type="influence")
+    Only the pairs of Participants that end up with an influence edge are ever
+    looked at, see draw_influences().
+    """
+    participants = get_participant_ids(network)
+    n = len(participants)
+    if n < 2:
+        return network
+
+    # Every ordered pair (i, j) with i != j is numbered i*(n-1) + j', where j'
+    # is j with i taken out of the list of Participants.
+    positions, influences = draw_influences(n*(n-1))
+    sources = positions // (n-1)
+    targets = positions % (n-1)
+    targets += targets >= sources
+
+    edges = []
+    for i, j, influence_rv in zip(sources.tolist(), targets.tolist(), influences.tolist()):
+        u, v = participants[i], participants[j]
+        if not network.has_edge(u, v):
+            edges.append(
+                (u, v, {"influence": influence_rv, "type": "influence"}))
+    _add_edges_from(network, edges)
     return network
 
 
 def setup_influence_edges_single(network: nx.DiGraph, participant: int):
-    p = dict(get_participants(network))
-    del p[participant]
-    other_participants = p
+    """
+    Like setup_influence_edges_bulk(), but only for the edges between
+    participant and the other Participants, in both directions.
+    """
+    participants = get_participant_ids(network)
+    others = len(participants) - 1
+    this = get_participant_positions(network)[participant]
 
     # If we already have Participants at index 0,1,2,3,4 and we added a
-    # Participant at index 5, this creates the edges 0,5; 1,5; 2;5 etc.
-    for other in other_participants:
-        if not network.has_edge(other, participant):
-            influence_rv = influence()
-            if influence_rv:
-                network.add_edge(other, participant,
-                                 influence=influence_rv, type="influence")
-        if not network.has_edge(participant, other):
-            influence_rv = influence()
-            if influence_rv:
-                network.add_edge(participant, other,
-                                 influence=influence_rv, type="influence")
+    # Participant at index 5, this creates the edges 0,5; 1,5; 2;5 etc. The
+    # first others pairs point towards the Participant, the rest away from it.
+    positions, influences = draw_influences(2*others)
+    edges = []
+    for position, influence_rv in zip(positions.tolist(), influences.tolist()):
+        i = position % others
+        other = participants[i if i < this else i+1]
+        u, v = (other, participant) if position < others else (
+            participant, other)
+        if not network.has_edge(u, v):
+            edges.append(
+                (u, v, {"influence": influence_rv, "type": "influence"}))
+    _add_edges_from(network, edges)
     return network
 
 
+def draw_conflicts(n_pairs: int, rate=.25, rng: RandomStream = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decides which of n_pairs pairs of Proposals conflict, and how strongly.
+    Returns the positions of the conflicting pairs and their conflict values.
+
+    (rate=0.25) means 25% of other Proposals are going to conflict with a
+    particular Proposal. And when they do conflict, the conflict number is high
+    (at least 1 - 0.25 = 0.75): it is 1 minus the uniform draw that was below
+    the rate, which is itself uniform on [0, rate).
+    """
+    rng = rng or get_rng()
+    positions = bernoulli_positions(n_pairs, rate, rng)
+    conflicts = 1 - rate * rng.generator.random(len(positions))
+    return positions, conflicts
+
+
 def setup_conflict_edges(network: nx.DiGraph, proposal=None, rate=.25) -> nx.DiGraph:
     """
     Supporting one Proposal may mean going against another Proposal, in which
@@ -138,32 +738,97 @@ def setup_conflict_edges(network: nx.DiGraph, proposal=None, rate=.25) -> nx.DiG
     Takes an optional proposal argument, which is the index number of the
     Proposal in network.nodes. If this argument is present, it will setup the
     conflict edges only for this Proposal.
+
+    Only the pairs of Proposals that end up in conflict are ever looked at, see
+    draw_conflicts(), and their edges are added all at once.
     """
-    def loop_over_other_proposals(network, proposals, proposal):
-        for other_proposal in proposals:
-            if not(other_proposal == proposal):
-                # (rate=0.25) means 25% of other Proposals are going to conflict
-                # with this particular Proposal. And when they do conflict, the
-                # conflict number is high (at least 1 - 0.25 = 0.75).
-                conflict_rv = np.random.rand()
-                if conflict_rv < rate:
-                    network.add_edge(proposal, other_proposal)
-                    network.edges[(proposal, other_proposal)
-                                  ]['conflict'] = 1-conflict_rv
-                    network.edges[(proposal, other_proposal)
-                                  ]['type'] = 'conflict'
+    proposals = list(dict(get_proposals(network)))
+    n = len(proposals)
+    if n < 2:
         return network
-    # Turn it into a dict to make a copy out of the View, because the View
-    # changes whenever we add edges to the graph, which results in RuntimeError:
-    # dictionary changed size during iteration
-    proposals = dict(get_proposals(network))
 
     # Do not use "if not proposal" - index number 0 will evaluate to False.
     if proposal is None:
-        for i in proposals:
-            network = loop_over_other_proposals(network, proposals, i)
-        return network
-    return loop_over_other_proposals(network, proposals, proposal)
+        # Every ordered pair (i, j) with i != j is numbered i*(n-1) + j', like
+        # in setup_influence_edges_bulk()
+        positions, conflicts = draw_conflicts(n*(n-1), rate)
+        sources = positions // (n-1)
+        targets = positions % (n-1)
+        targets += targets >= sources
+    else:
+        this = proposals.index(proposal)
+        positions, conflicts = draw_conflicts(n-1, rate)
+        sources = np.full(len(positions), this)
+        targets = positions + (positions >= this)
+
+    _add_edges_from(network, [
+        (proposals[i], proposals[j], {"conflict": conflict, "type": "conflict"})
+        for i, j, conflict in zip(sources.tolist(), targets.tolist(), conflicts.tolist())])
+    return network
+
+
+def draw_affinities(n: int, rng: RandomStream = None) -> np.ndarray:
+    """
+    Draws n affinities of Participants towards Proposals.
+    """
+    # Token Holder -> Proposal Relationship
+    # Looks like Zargham skewed this distribution heavily towards
+    # numbers smaller than 0.25 This is the affinity towards proposals.
+    # Most Participants won't care about most proposals, but then there
+    # will be a few Proposals that they really care about.
+    rv = (rng or get_rng()).generator.random(n)
+    return 1-4*(1-rv)*rv
+
+
+def get_support_matrix(network: nx.DiGraph) -> SupportMatrix:
+    """
+    Returns the SupportMatrix that holds the network's support edges, creating
+    an empty one if there is none yet. Support edges can be read and written
+    like networkx edges through it, e.g. support[i, j]["affinity"].
+    """
+    support = network.graph.get("support")
+    if support is None:
+        support = network.graph["support"] = SupportMatrix()
+    return support
+
+
+def get_holdings(network: nx.DiGraph) -> np.ndarray:
+    """
+    Returns every Participant's vesting + nonvesting tokens, in the order of
+    the rows of the SupportMatrix.
+    """
+    support = get_support_matrix(network)
+    index = get_index(network)
+    if index is not None and index.participant_ids:
+        ids = np.array(index.participant_ids, dtype=int)
+        position_of = np.zeros(ids.max() + 1, dtype=int)
+        position_of[ids] = np.arange(len(ids))
+        return index.holdings()[position_of[support.row_nodes]]
+
+    holdings = np.zeros(support.n_rows)
+    for row, i in enumerate(support.row_nodes.tolist()):
+        participant = network.nodes[i]["item"]
+        if participant.holdings_vesting:
+            holdings[row] += participant.holdings_vesting.value
+        if participant.holdings_nonvesting:
+            holdings[row] += participant.holdings_nonvesting.value
+    return holdings
+
+
+def rebalance_stakes(network: nx.DiGraph, supported: np.ndarray = None) -> nx.DiGraph:
+    """
+    Restakes every Participant's holdings across the Proposals they support,
+    for all Participants at once (see SupportMatrix.rebalance()). By default,
+    Participants support the Candidate Proposals they would vote for (see
+    SupportMatrix.supported()).
+    """
+    support = get_support_matrix(network)
+    if supported is None:
+        candidates = get_proposals(network, status=ProposalStatus.CANDIDATE)
+        supported = support.supported(
+            np.isin(support.col_nodes, [j for j, _ in candidates]))
+    support.rebalance(get_holdings(network), supported)
+    return network
 
 
 def setup_support_edges(network: nx.DiGraph, idx=None) -> nx.DiGraph:
@@ -175,32 +840,35 @@ def setup_support_edges(network: nx.DiGraph, idx=None) -> nx.DiGraph:
     Takes an optional node index. If the node is a Participant, it will setup
     support edges to other Proposal nodes and vice versa if the node is a
     Proposal.
+
+    The support edges are not networkx edges, but rows and columns of the
+    network's SupportMatrix (see get_support_matrix()). Participants or
+    Proposals that are needed for the new edges but are not in the
+    SupportMatrix yet are added to it as well.
     """
-    def create_support_edge(n, i, j):
-        # Token Holder -> Proposal Relationship
-        # Looks like Zargham skewed this distribution heavily towards
-        # numbers smaller than 0.25 This is the affinity towards proposals.
-        # Most Participants won't care about most proposals, but then there
-        # will be a few Proposals that they really care about.
-        rv = np.random.rand()
-        a_rv = 1-4*(1-rv)*rv
-        n.add_edge(i, j, affinity=a_rv, tokens=0, conviction=0, type="support")
-        return n
-    participants = dict(get_participants(network))
-    proposals = dict(get_proposals(network))
+    support = get_support_matrix(network)
 
-    if idx is None:
+    def add_participants(participants):
+        for par in participants:
+            if par not in support.row_of:
+                support.add_participant(par, draw_affinities(support.n_cols))
+
+    def add_proposals(proposals):
         for prop in proposals:
-            for par in participants:
-                network = create_support_edge(network, par, prop)
+            if prop not in support.col_of:
+                support.add_proposal(prop, draw_affinities(support.n_rows))
+
+    if idx is None:
+        add_participants(dict(get_participants(network)))
+        add_proposals(dict(get_proposals(network)))
 
     else:
         if isinstance(network.nodes[idx]['item'], Proposal):
-            for par in participants:
-                network = create_support_edge(network, par, idx)
+            add_participants(dict(get_participants(network)))
+            add_proposals([idx])
         elif isinstance(network.nodes[idx]['item'], Participant):
-            for prop in proposals:
-                network = create_support_edge(network, idx, prop)
+            add_proposals(dict(get_proposals(network)))
+            add_participants([idx])
     return network
 
 
@@ -213,8 +881,8 @@ def bootstrap_network(n_participants: List[TokenBatch], n_proposals: int, fundin
 
     for _ in range(n_proposals):
         idx = len(n)
-        r_rv = gamma.rvs(3, loc=0.001, scale=10000)
-        n.add_node(idx, item=Proposal(funds_requested=r_rv, trigger=trigger_threshold(
+        r_rv = get_rng().gamma(3, loc=0.001, scale=10000)
+        _add_node(n, idx, Proposal(funds_requested=r_rv, trigger=trigger_threshold(
             r_rv, funding_pool, token_supply)))
 
     n = setup_support_edges(n)
@@ -224,6 +892,10 @@ def bootstrap_network(n_participants: List[TokenBatch], n_proposals: int, fundin
 
 
 def calc_total_funds_requested(network):
+    index = get_index(network)
+    if index is not None:
+        return index.candidate_funds_requested
+
     candidates = get_proposals(network, status=ProposalStatus.CANDIDATE)
     fund_requests = [j[1].funds_requested for j in candidates]
     total_funds_requested = np.sum(fund_requests)
@@ -235,6 +907,5 @@ def calc_median_affinity(network):
     if len(supporters) == 0:
         raise Exception("The network has 0 support edges!")
 
-    affinities = [network.edges[e]['affinity'] for e in supporters]
-    median_affinity = np.median(affinities)
+    median_affinity = get_support_matrix(network).affinity_median.median()
     return median_affinity
@@ -2,19 +2,34 @@ import unittest
 from unittest.mock import patch
 
 import networkx as nx
-
-from entities import Participant, Proposal, ProposalStatus
-from hatch import TokenBatch, VestingOptions
-from network_utils import (add_proposal, bootstrap_network, calc_median_affinity,
-                           calc_total_funds_requested, get_edges_by_type,
-                           get_participants, get_proposals,
+import numpy as np
+
+import utils
+
+from entities import Participant, Proposal, ProposalStatus, vote_cutoff
+from hatch import TokenBatch, VestingOptions, create_token_batches
+from network_utils import (CommonsNetwork, _add_edges_from, add_participant, add_proposal, bootstrap_network,
+                           calc_median_affinity, calc_total_funds_requested,
+                           create_network, draw_conflicts, draw_influences,
+                           get_edges_by_type, get_holdings, get_influence_matrix,
+                           get_participant_ids, get_participant_positions, get_index, get_participants,
+                           get_proposals, get_support_matrix, index_network,
+                           propagate_sentiment, rebalance_stakes,
                            setup_conflict_edges, setup_influence_edges_bulk,
                            setup_influence_edges_single, setup_support_edges)
 
 
+def every_pair_influenced(value):
+    """
+    Replacement for draw_influences() that gives every pair of nodes an
+    influence edge with the same value.
+    """
+    return lambda n_pairs: (np.arange(n_pairs), np.full(n_pairs, value))
+
+
 class TestNetworkUtils(unittest.TestCase):
     def setUp(self):
-        self.network = nx.DiGraph()
+        self.network = CommonsNetwork()
 
         for i in range(0, 10, 2):
             self.network.add_node(i, item=Participant())
@@ -36,6 +51,13 @@ class TestNetworkUtils(unittest.TestCase):
         self.assertEqual(len(res), 1)
 
     def test_get_edges_by_type(self):
+        res = get_edges_by_type(self.network, "influence")
+        self.assertEqual(len(res), 0)
+
+        self.network.add_edge(0, 2, type="influence")
+        res = get_edges_by_type(self.network, "influence")
+        self.assertEqual(len(res), 1)
+
         res = get_edges_by_type(self.network, "support")
         self.assertEqual(len(res), 0)
 
@@ -49,8 +71,8 @@ class TestNetworkUtils(unittest.TestCase):
         nodes. Also ensures that edges refer to the node index, not the Participant
         object stored within the node.
         """
-        with patch('network_utils.influence') as mock:
-            mock.return_value = 0.5
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = every_pair_influenced(0.5)
             self.network = setup_influence_edges_bulk(self.network)
             edges = get_edges_by_type(self.network, "influence")
             self.assertEqual(len(edges), 20)
@@ -64,8 +86,8 @@ class TestNetworkUtils(unittest.TestCase):
         Test that setup_influence_edges_bulk will not overwrite existing
         influence edges.
         """
-        with patch('network_utils.influence') as mock:
-            mock.return_value = 0.5
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = every_pair_influenced(0.5)
             self.network = setup_influence_edges_bulk(self.network)
             edges = get_edges_by_type(self.network, "influence")
             self.assertEqual(len(edges), 20)
@@ -73,7 +95,7 @@ class TestNetworkUtils(unittest.TestCase):
                 self.assertEqual(self.network.get_edge_data(
                     e[0], e[1])["influence"], 0.5)
 
-            mock.return_value = 0.8
+            mock.side_effect = every_pair_influenced(0.8)
             self.network = setup_influence_edges_bulk(self.network)
             edges = get_edges_by_type(self.network, "influence")
             self.assertEqual(len(edges), 20)
@@ -81,6 +103,28 @@ class TestNetworkUtils(unittest.TestCase):
                 self.assertEqual(self.network.get_edge_data(
                     e[0], e[1])["influence"], 0.5)
 
+    def test_draw_influences(self):
+        """
+        Only about e^-4 of pairs should get an influence edge, and the
+        influences should all be above the 3 sigma threshold.
+        """
+        positions, influences = draw_influences(1000000)
+        self.assertEqual(len(positions), len(influences))
+        self.assertAlmostEqual(len(positions), 1000000*np.exp(-4), delta=700)
+        self.assertTrue(np.all(influences > 4))
+        self.assertAlmostEqual(np.mean(influences), 5, delta=0.1)
+
+    def test_draw_conflicts(self):
+        """
+        About rate of the pairs should conflict, with conflicts between
+        1 - rate and 1.
+        """
+        positions, conflicts = draw_conflicts(100000, rate=0.25)
+        self.assertEqual(len(positions), len(conflicts))
+        self.assertAlmostEqual(len(positions), 25000, delta=500)
+        self.assertTrue(np.all((conflicts > 0.75) & (conflicts <= 1)))
+        self.assertAlmostEqual(np.mean(conflicts), 0.875, delta=0.01)
+
     def test_setup_influence_edges_single(self):
         """
         Test that the code works, and that if I set up influence edges for a
@@ -88,8 +132,8 @@ class TestNetworkUtils(unittest.TestCase):
         4 from the new Participant to the existing Participants + 4 from
         the existing Participants to the new Participant
         """
-        with patch('network_utils.influence') as mock:
-            mock.return_value = 0.5
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = every_pair_influenced(0.5)
             self.network = setup_influence_edges_single(self.network, 0)
             edges = list(get_edges_by_type(self.network, "influence"))
             self.assertEqual(len(edges), 8)
@@ -112,8 +156,8 @@ class TestNetworkUtils(unittest.TestCase):
         Test that setup_influence_edges_single will not overwrite existing
         influence edges.
         """
-        with patch('network_utils.influence') as mock:
-            mock.return_value = 0.5
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = every_pair_influenced(0.5)
             self.network = setup_influence_edges_single(self.network, 0)
             edges = list(get_edges_by_type(self.network, "influence"))
             self.assertEqual(len(edges), 8)
@@ -126,7 +170,7 @@ class TestNetworkUtils(unittest.TestCase):
 
             # Now, ensure that the original influence value of 0.5 was not
             # overwritten with 0.8
-            mock.return_value = 0.8
+            mock.side_effect = every_pair_influenced(0.8)
             self.network = setup_influence_edges_single(self.network, 0)
             edges = list(get_edges_by_type(self.network, "influence"))
             self.assertEqual(len(edges), 8)
@@ -210,6 +254,25 @@ class TestNetworkUtils(unittest.TestCase):
         self.assertEqual(len(get_participants(network)), 4)
         self.assertEqual(len(get_proposals(network)), 1)
 
+    def test_bootstrap_network_is_repeatable(self):
+        """
+        With the same seeded RandomStream, bootstrapping gives the same network.
+        """
+        def bootstrap(seed):
+            previous = utils.set_rng(utils.RandomStream(seed))
+            try:
+                token_batches = [TokenBatch(1000) for _ in range(30)]
+                return bootstrap_network(token_batches, 5, 3000, 4e6)
+            finally:
+                utils.set_rng(previous)
+
+        a, b = bootstrap(1), bootstrap(1)
+        self.assertEqual(list(a.edges(data=True)), list(b.edges(data=True)))
+        np.testing.assert_array_equal(get_support_matrix(a).affinity,
+                                      get_support_matrix(b).affinity)
+        self.assertEqual([p.sentiment for _, p in get_participants(a)],
+                         [p.sentiment for _, p in get_participants(b)])
+
     def test_calc_total_funds_requested(self):
         sum = calc_total_funds_requested(self.network)
         self.assertEqual(sum, 50)
@@ -232,3 +295,263 @@ class TestNetworkUtils(unittest.TestCase):
             self.assertEqual(v, 10)
             self.assertEqual(t, "support")
             self.assertIn(u, [0, 2, 4, 6, 8])
+
+
+class TestNetworkIndex(unittest.TestCase):
+    def setUp(self):
+        token_batches = [TokenBatch(1000, VestingOptions(10, 30))
+                         for _ in range(4)]
+        self.network = bootstrap_network(token_batches, 3, 3000, 4e6)
+
+    def test_index_agrees_with_graph(self):
+        """
+        The lookups served by the index must be the same as filtering the
+        whole graph.
+        """
+        self.assertIsNotNone(get_index(self.network))
+        unindexed = self.network.copy()
+        del unindexed.graph["index"]
+
+        self.assertEqual(dict(get_participants(self.network)),
+                         dict(get_participants(unindexed)))
+        self.assertEqual(dict(get_proposals(self.network)),
+                         dict(get_proposals(unindexed)))
+        self.assertEqual(get_participant_positions(self.network),
+                         get_participant_positions(unindexed))
+        for edge_type in ["support", "influence", "conflict"]:
+            self.assertEqual(set(get_edges_by_type(self.network, edge_type)),
+                             set(get_edges_by_type(unindexed, edge_type)))
+
+    def test_views_behave_like_networkx_views(self):
+        """
+        get_participants(), get_proposals() and get_edges_by_type() used to
+        return networkx views of a filtered graph, and their results must
+        still behave like those.
+        """
+        _add_edges_from(self.network, [(4, 5, {"type": "conflict", "conflict": 0.8}),
+                                       (5, 6, {"type": "conflict", "conflict": 0.9})])
+        network = self.network
+        # a plain DiGraph, whose views know nothing of the SupportMatrix
+        plain = nx.DiGraph(network)
+
+        def of_type(item_type):
+            return nx.subgraph_view(plain, filter_node=lambda n: isinstance(
+                plain.nodes[n]["item"], item_type)).nodes(data="item")
+        for view, expected in [(get_participants(network), of_type(Participant)),
+                               (get_proposals(network), of_type(Proposal))]:
+            self.assertEqual(len(view), len(expected))
+            self.assertEqual(list(view), list(expected))
+            for n, item in expected:
+                self.assertIs(view[n], item)
+                self.assertIn(n, view)
+                self.assertIn((n, item), view)
+            self.assertNotIn(-1, view)
+            self.assertNotIn((0, None), view)
+
+        conflicts = get_edges_by_type(network, "conflict")
+        expected = nx.subgraph_view(plain, filter_edge=lambda u, v: plain.edges[u, v]["type"] == "conflict").edges()
+        self.assertEqual(len(conflicts), len(expected))
+        self.assertEqual(set(conflicts), set(expected))
+        self.assertEqual(conflicts[4, 5], expected[4, 5])
+        self.assertEqual(sorted(conflicts.data("conflict")),
+                         sorted(expected.data("conflict")))
+        with self.assertRaises(KeyError):
+            conflicts[0, 4]
+
+        support = get_edges_by_type(network, "support")
+        self.assertEqual(support[0, 4]["affinity"],
+                         network.edges[0, 4]["affinity"])
+        self.assertEqual(len(list(support.data())), len(support))
+
+    def test_index_follows_proposal_status(self):
+        self.assertEqual(
+            len(get_proposals(self.network, status=ProposalStatus.CANDIDATE)), 3)
+        self.network.nodes[4]["item"].status = ProposalStatus.ACTIVE
+
+        self.assertEqual(
+            len(get_proposals(self.network, status=ProposalStatus.CANDIDATE)), 2)
+        self.assertEqual(
+            dict(get_proposals(self.network, status=ProposalStatus.ACTIVE)).keys(), {4})
+
+    def test_index_follows_helpers(self):
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = every_pair_influenced(0.5)
+            self.network, i = add_participant(self.network, Participant())
+        self.network, j = add_proposal(self.network, Proposal(10, 5))
+
+        self.assertIn(i, dict(get_participants(self.network)))
+        self.assertIn(j, dict(get_proposals(self.network)))
+        self.assertIn((i, j), get_edges_by_type(self.network, "support"))
+        self.assertIn((0, i), get_edges_by_type(self.network, "influence"))
+
+    def test_aggregates_follow_changes(self):
+        """
+        The candidate funds total and the median affinity are kept up to date
+        instead of recomputed, so they should always match recomputing them.
+        """
+        def funds_of_candidates():
+            return sum(p.funds_requested for _, p in get_proposals(
+                self.network, status=ProposalStatus.CANDIDATE))
+
+        self.assertAlmostEqual(calc_total_funds_requested(
+            self.network), funds_of_candidates())
+        self.network.nodes[4]["item"].status = ProposalStatus.ACTIVE
+        self.network, j = add_proposal(self.network, Proposal(123, 5))
+        self.assertAlmostEqual(calc_total_funds_requested(
+            self.network), funds_of_candidates())
+        self.network.nodes[j]["item"].funds_requested = 456
+        self.network.nodes[5]["item"].funds_requested = 7
+        self.assertAlmostEqual(calc_total_funds_requested(
+            self.network), funds_of_candidates())
+
+        support = get_support_matrix(self.network)
+        support[0, j]["affinity"] = 1
+        support[1, j]["affinity"] = 0.25
+        self.assertEqual(calc_median_affinity(self.network),
+                         np.median(support.affinity))
+
+    def test_rebalance_stakes(self):
+        """
+        Restaking everyone at once should give every Participant the same
+        stakes as Participant.stake_across_all_supported_proposals().
+        """
+        support = get_support_matrix(self.network)
+        supported = np.array([[True, True, False],
+                              [False, False, False],
+                              [True, False, True],
+                              [True, True, True]])
+        rebalance_stakes(self.network, supported)
+
+        for row, i in enumerate(support.row_nodes):
+            participant = self.network.nodes[i]["item"]
+            proposals = [(support.affinity[row, col], self.network.nodes[j]["item"])
+                         for col, j in enumerate(support.col_nodes) if supported[row, col]]
+            expected = participant.stake_across_all_supported_proposals(
+                proposals)
+            for col, j in enumerate(support.col_nodes):
+                self.assertAlmostEqual(support.tokens[row, col], expected.get(
+                    self.network.nodes[j]["item"].uuid, 0))
+
+        # by default, the Candidate Proposals a Participant would vote for
+        self.network.nodes[4]["item"].status = ProposalStatus.ACTIVE
+        candidates = support.col_nodes != 4
+        affinity = np.where(candidates, support.affinity, 0)
+        expected = affinity > vote_cutoff(affinity.max(axis=1))[:, None]
+        rebalance_stakes(self.network)
+        default = support.tokens.copy()
+        rebalance_stakes(self.network, expected)
+        np.testing.assert_allclose(default, support.tokens)
+        self.assertFalse(default[:, ~candidates].any())
+
+    def test_get_holdings(self):
+        batches, _ = create_token_batches([100, 200, 300], 0.1, 60, ledger=True)
+        network = bootstrap_network(batches, 2, 3000, 4e6)
+        network, _ = add_participant(network, Participant(
+            holdings_nonvesting=TokenBatch(50)))
+        batches[1].ledger.value[1] = 1500
+
+        participants = [network.nodes[i]["item"]
+                        for i in get_support_matrix(network).row_nodes]
+        expected = [sum(batch.value for batch in (p.holdings_vesting, p.holdings_nonvesting) if batch)
+                    for p in participants]
+        np.testing.assert_allclose(expected[1:], [1500, 3000, 50])
+        np.testing.assert_allclose(get_holdings(network), expected)
+        # the same, going through every Participant without the index
+        del network.graph["index"]
+        np.testing.assert_allclose(get_holdings(network), expected)
+
+    def test_get_holdings_after_replacing_them(self):
+        batches, _ = create_token_batches([100, 200, 300], 0.1, 60, ledger=True)
+        network = bootstrap_network(batches, 2, 3000, 4e6)
+        before = get_holdings(network)
+        participant = network.nodes[0]["item"]
+        participant.holdings_vesting = TokenBatch(7)
+        participant.holdings_nonvesting = None
+
+        expected = before.copy()
+        expected[get_support_matrix(network).row_of[0]] = 7
+        np.testing.assert_allclose(get_holdings(network), expected)
+
+    def test_influence_matrix(self):
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = every_pair_influenced(0.5)
+            self.network, i = add_participant(self.network, Participant())
+        participants = get_participant_ids(self.network)
+        self.network.add_edge(0, 1, influence=0.25, type="influence")
+        del self.network.graph["index"]
+
+        expected = np.zeros((5, 5))
+        for u, v, influence in self.network.edges(data="influence"):
+            if self.network.edges[u, v]["type"] == "influence":
+                expected[participants.index(u), participants.index(v)] = influence
+        np.testing.assert_array_equal(
+            get_influence_matrix(self.network).toarray(), expected)
+        self.assertEqual(expected[4].sum(), 2)
+
+    def test_propagate_sentiment(self):
+        """
+        Every Participant should move towards the influence weighted mean
+        sentiment of their influencers, and the others should stay put.
+        """
+        network = create_network([TokenBatch(1) for _ in range(4)])
+        _add_edges_from(network, [
+            (0, 2, {"influence": 1, "type": "influence"}),
+            (1, 2, {"influence": 3, "type": "influence"}),
+            (2, 3, {"influence": 2, "type": "influence"}),
+        ])
+        for i, sentiment in enumerate([0.2, 0.6, 1.0, 0.0]):
+            network.nodes[i]["item"].sentiment = sentiment
+
+        propagate_sentiment(network, 0.5)
+        sentiments = [p.sentiment for _, p in get_participants(network)]
+        np.testing.assert_allclose(
+            sentiments, [0.2, 0.6, 1.0 + 0.5*(0.5 - 1.0), 0.5])
+        np.testing.assert_array_equal(get_index(network).sentiment, sentiments)
+
+        # the same, going through every Participant without the index
+        del network.graph["index"]
+        propagate_sentiment(network, 0.5)
+        sentiments = [p.sentiment for _, p in get_participants(network)]
+        np.testing.assert_allclose(sentiments, [0.2, 0.6, 0.625, 0.625])
+
+    def test_index_rebuilt_after_direct_changes(self):
+        """
+        Nodes added without going through the helpers should still show up.
+        """
+        self.network.add_node(len(self.network), item=Participant())
+        self.assertEqual(len(get_participants(self.network)), 5)
+
+    def test_index_network(self):
+        network = nx.DiGraph()
+        network.add_node(0, item=Participant())
+        network.add_node(1, item=Proposal(10, 5))
+        network.add_edge(0, 1, type="support")
+        network.add_node(2, item=Participant())
+        network.add_edge(0, 2, type="influence")
+
+        index = index_network(network)
+        self.assertIs(get_index(network), index)
+        self.assertEqual(list(get_edges_by_type(network, "support")), [(0, 1)])
+        self.assertEqual(
+            list(get_edges_by_type(network, "influence")), [(0, 2)])
+        self.assertEqual(len(get_participants(network)), 2)
+        self.assertEqual(len(get_proposals(network)), 1)
+
+    def test_support_edges_can_be_written_through(self):
+        """
+        The Participant who creates a Proposal gets its affinity set to 1
+        through the networkx style accessor, which must end up in the matrix.
+        """
+        self.network.edges[0, 4]["affinity"] = 1
+        support = get_support_matrix(self.network)
+        row, col = support.row_of[0], support.col_of[4]
+        self.assertEqual(support.affinity[row, col], 1)
+        self.assertEqual(self.network.edges[0, 4]["tokens"], 0)
+        self.assertEqual(self.network.edges[0, 4]["type"], "support")
+        self.assertTrue(self.network.has_edge(0, 4))
+        in_edges = self.network.in_edges(4, data="type")
+        self.assertIn((0, 4, "support"), in_edges)
+        self.assertEqual(len(in_edges), 4 + len(self.network.pred[4]))
+        self.assertEqual([t for _, _, t in in_edges].count("support"), 4)
+        self.assertEqual(len(self.network.out_edges(0)),
+                         3 + len(self.network.adj[0]))
@@ -1,14 +1,15 @@
-import random
 import numpy as np
-from scipy.stats import expon, gamma
 
+import config
 import convictionvoting
+from convictionvoting import accumulate_conviction, passing_proposals
 from entities import Participant, Proposal, ProposalStatus
 from hatch import TokenBatch
-from network_utils import (add_proposal, calc_median_affinity, calc_total_funds_requested,
-                           get_participants, get_proposals, setup_influence_edges_single,
-                           setup_support_edges)
-from utils import probability
+from network_utils import (add_participant, add_proposal, calc_median_affinity,
+                           calc_total_funds_requested, get_participant_ids,
+                           get_proposals, get_support_matrix,
+                           propagate_sentiment, rebalance_stakes)
+from utils import get_rng, probability
 
 
 class GenerateNewParticipant:
@@ -24,32 +25,81 @@ class GenerateNewParticipant:
 
         arrival_rate = (1+sentiment)/10
         if probability(arrival_rate):
-            ans["new_participant"] = True
-            # Here we randomly generate each participant's post-Hatch
-            # investment, in DAI/USD.
-            #
-            # expon.rvs() arguments:
-            #
-            # loc is the minimum number, so if loc=100, there will be no
-            # investments < 100
-            #
-            # scale is the standard deviation, so if scale=2, investments will
-            # be around 0-12 DAI or even 15, if scale=100, the investments will be
-            # around 0-600 DAI.
-            ans["new_participant_investment"] = expon.rvs(loc=0.0, scale=100)
-            ans["new_participant_tokens"] = commons.dai_to_tokens(
-                ans["new_participant_investment"])
+            ans.update(GenerateNewParticipant._arrival(commons))
         return ans
 
+    @staticmethod
+    def p_next_arrival(params, step, sL, s):
+        """
+        Same as p_randomly(), except that instead of flipping a coin every
+        timestep, it draws how many timesteps it will take for the coin to come
+        up (see RandomStream.geometric()) and waits for that timestep, so the
+        quiet timesteps in between cost no random draws. Participants arrive on
+        timesteps distributed the same way. When the arrival rate changes, the
+        wait is drawn again, which is exact because coin flips don't remember
+        how long they've been waiting.
+
+        The timestep of the next arrival and the rate it was drawn at are kept
+        in the "participant_next_arrival" and "participant_arrival_rate" state
+        variables (see su_next_arrival() and su_arrival_rate()).
+        "arrival_event" says whether anything changed at all: on the other
+        timesteps, the block can be skipped (see executor.run_substep()).
+        """
+        ans = {
+            "new_participant": False,
+            "new_participant_investment": None,
+            "new_participant_tokens": None
+        }
+
+        timestep = s["timestep"] + 1
+        arrival_rate = (1+s["sentiment"])/10
+        next_arrival = s["participant_next_arrival"]
+        event = next_arrival is None or arrival_rate != s["participant_arrival_rate"]
+        if event:
+            next_arrival = timestep + get_rng().geometric(arrival_rate) - 1
+        if next_arrival == timestep:
+            ans.update(GenerateNewParticipant._arrival(s["commons"]))
+            next_arrival = timestep + get_rng().geometric(arrival_rate)
+            event = True
+        ans["arrival_event"] = event
+        ans["next_arrival"] = next_arrival
+        ans["arrival_rate"] = arrival_rate
+        return ans
+
+    @staticmethod
+    def _arrival(commons):
+        ans = {"new_participant": True}
+        # Here we randomly generate each participant's post-Hatch
+        # investment, in DAI/USD.
+        #
+        # exponential() arguments:
+        #
+        # loc is the minimum number, so if loc=100, there will be no
+        # investments < 100
+        #
+        # scale is the standard deviation, so if scale=2, investments will
+        # be around 0-12 DAI or even 15, if scale=100, the investments will be
+        # around 0-600 DAI.
+        ans["new_participant_investment"] = get_rng().exponential(
+            loc=0.0, scale=100)
+        ans["new_participant_tokens"] = commons.dai_to_tokens(
+            ans["new_participant_investment"])
+        return ans
+
+    @staticmethod
+    def su_next_arrival(params, step, sL, s, _input):
+        return "participant_next_arrival", _input["next_arrival"]
+
+    @staticmethod
+    def su_arrival_rate(params, step, sL, s, _input):
+        return "participant_arrival_rate", _input["arrival_rate"]
+
     @staticmethod
     def su_add_to_network(params, step, sL, s, _input):
         network = s["network"]
         if _input["new_participant"]:
-            i = len(network.nodes)
-            network.add_node(i, item=Participant(
+            network, _ = add_participant(network, Participant(
                 holdings_vesting=None, holdings_nonvesting=TokenBatch(_input["new_participant_tokens"])))
-            network = setup_influence_edges_single(network, i)
-            network = setup_support_edges(network, i)
         return "network", network
 
     @staticmethod
@@ -63,6 +113,19 @@ class GenerateNewParticipant:
         return "commons", commons
 
 
+class InfluencedSentiment:
+    @staticmethod
+    def su_propagate_sentiment(params, step, sL, s, _input):
+        """
+        Participants' sentiment drifts towards that of the Participants who
+        influence them, at a rate of params["sentiment_decay"] per timestep
+        (config.sentiment_decay if it's not given).
+        """
+        decay = params.get("sentiment_decay", config.sentiment_decay)
+        network = propagate_sentiment(s["network"], decay)
+        return "network", network
+
+
 class GenerateNewProposal:
     @staticmethod
     def p_randomly(params, step, sL, s):
@@ -73,8 +136,8 @@ class GenerateNewProposal:
         funding_pool = s["funding_pool"]
         network = s["network"]
 
-        participants = get_participants(network)
-        i, participant = random.sample(participants, 1)[0]
+        i = get_rng().choice(get_participant_ids(network))
+        participant = network.nodes[i]["item"]
 
         wants_to_create_proposal = participant.create_proposal(calc_total_funds_requested(
             network), calc_median_affinity(network), funding_pool)
@@ -90,7 +153,7 @@ class GenerateNewProposal:
         if _input["new_proposal"]:
             # Create the Proposal and add it to the network.
             rescale = funding_pool * scale_factor
-            r_rv = gamma.rvs(3, loc=0.001, scale=rescale)
+            r_rv = get_rng().gamma(3, loc=0.001, scale=rescale)
             proposal = Proposal(funds_requested=r_rv,
                                 trigger=convictionvoting.trigger_threshold(r_rv, funding_pool, token_supply))
             network, j = add_proposal(network, proposal)
@@ -114,8 +177,9 @@ class GenerateNewFunding:
         speculator_position_size_min = 200  # DAI
         speculator_position_size_stdev = 200
         speculators = 5
-        exits = [expon.rvs(loc=speculator_position_size_min,
-                           scale=speculator_position_size_stdev) for i in range(speculators)]
+        rng = get_rng()
+        exits = [rng.exponential(loc=speculator_position_size_min,
+                                 scale=speculator_position_size_stdev) for i in range(speculators)]
         commons = s["commons"]
         funding = sum(exits) * commons.exit_tribute
         return {"funding": funding}
@@ -124,7 +188,7 @@ class GenerateNewFunding:
     def su_add_funding(params, step, sL, s, _input):
         commons = s["commons"]
         if _input["funding"]:
-            commons._funding_pool += _input["funding"]
+            commons.add_funding(_input["funding"])
         return "commons", commons
 
 
@@ -158,3 +222,80 @@ class ActiveProposals:
             network.nodes[idx]["item"].status = ProposalStatus.FAILED
 
         return "network", network
+
+
+class CandidateProposals:
+    @staticmethod
+    def su_rebalance_stakes(params, step, sL, s, _input):
+        """
+        Every Participant stakes their tokens on the Candidate Proposals they
+        support, which is what conviction accumulates from (see
+        network_utils.rebalance_stakes()).
+        """
+        network = rebalance_stakes(s["network"])
+        return "network", network
+
+    @staticmethod
+    def p_compute_conviction(params, step, sL, s):
+        """
+        Accumulates conviction on every support edge at once, sums it up per
+        Proposal and decides which Candidate Proposals have gathered enough
+        conviction to pass. Only Proposals at least min_proposal_age_days old
+        can pass. They are funded in order, and a Proposal that asks for more
+        than what is left in the funding pool doesn't pass, but cheaper ones
+        after it still can.
+        """
+        network = s["network"]
+        # the Commons rather than the funding_pool state variable, which is
+        # only brought up to date once per timestep
+        commons = s["commons"]
+        funding_pool = commons._funding_pool
+        token_supply = commons._token_supply
+
+        support = get_support_matrix(network)
+        conviction = accumulate_conviction(
+            support.conviction, support.tokens, params["alpha"])
+        total_conviction = conviction.sum(axis=0)
+
+        candidates = [(j, p) for j, p in get_proposals(
+            network, status=ProposalStatus.CANDIDATE) if j in support.col_of]
+        cols = [support.col_of[j] for j, _ in candidates]
+        funds_requested = np.array([p.funds_requested for _, p in candidates])
+        passing = passing_proposals(
+            total_conviction[cols], funds_requested, funding_pool, token_supply)
+
+        proposals_passed = []
+        funds_left = funding_pool
+        for (j, p), passes, funds in zip(candidates, passing, funds_requested):
+            if passes and p.age >= params["min_proposal_age_days"] and funds <= funds_left:
+                proposals_passed.append(j)
+                funds_left -= funds
+        return {"conviction": conviction, "proposals_passed": proposals_passed}
+
+    @staticmethod
+    def su_update_conviction(params, step, sL, s, _input):
+        """
+        Stores the new conviction in the support edges and the Proposals, ages
+        the Candidate Proposals by a day, and makes the Proposals that passed
+        Active.
+        """
+        network = s["network"]
+        support = get_support_matrix(network)
+        support.conviction[:] = _input["conviction"]
+        total_conviction = support.conviction.sum(axis=0)
+
+        for j, proposal in list(get_proposals(network, status=ProposalStatus.CANDIDATE)):
+            proposal.update_age()
+            if j in support.col_of:
+                proposal.conviction = total_conviction[support.col_of[j]]
+        for j in _input["proposals_passed"]:
+            network.nodes[j]["item"].status = ProposalStatus.ACTIVE
+        return "network", network
+
+    @staticmethod
+    def su_fund_passed_proposals(params, step, sL, s, _input):
+        network = s["network"]
+        commons = s["commons"]
+        for j in _input["proposals_passed"]:
+            commons.spend(network.nodes[j]["item"].funds_requested)
+        return "commons", commons
@@ -3,11 +3,17 @@ import unittest
 from collections import namedtuple
 from unittest.mock import patch
 
+import numpy as np
+
+import config
 from entities import Proposal, ProposalStatus
 from hatch import Commons, TokenBatch, VestingOptions
-from network_utils import bootstrap_network, add_proposal, get_edges_by_type
-from policies import (GenerateNewFunding, GenerateNewParticipant,
-                      GenerateNewProposal, ActiveProposals)
+from network_utils import (add_proposal, bootstrap_network, get_edges_by_type,
+                           get_participants, get_support_matrix)
+from policies import (ActiveProposals, CandidateProposals, GenerateNewFunding,
+                      GenerateNewParticipant, GenerateNewProposal,
+                      InfluencedSentiment)
+from utils import RandomStream, set_rng
 
 
 class TestGenerateNewParticipant(unittest.TestCase):
@@ -32,14 +38,53 @@ class TestGenerateNewParticipant(unittest.TestCase):
             self.assertIsNotNone(ans["new_participant_investment"])
             self.assertIsNotNone(ans["new_participant_tokens"])
 
+    def test_p_next_arrival(self):
+        """
+        Over many timesteps, Participants arrive about as often as with a coin
+        flipped every timestep, and the wait is drawn again when the rate
+        changes.
+        """
+        previous = set_rng(RandomStream(0))
+        try:
+            state = {
+                "commons": self.commons,
+                "sentiment": self.sentiment,
+                "timestep": 0,
+                "participant_next_arrival": None,
+                "participant_arrival_rate": None,
+            }
+            arrivals = events = 0
+            for timestep in range(20000):
+                state["timestep"] = timestep
+                ans = GenerateNewParticipant.p_next_arrival(None, 0, 0, state)
+                arrivals += ans["new_participant"]
+                events += ans["arrival_event"]
+                if not ans["arrival_event"]:
+                    self.assertEqual(ans["next_arrival"], state["participant_next_arrival"])
+                state["participant_next_arrival"] = ans["next_arrival"]
+                state["participant_arrival_rate"] = ans["arrival_rate"]
+            self.assertAlmostEqual(arrivals / 20000, 0.15, delta=0.01)
+            # every arrival draws the next one, so only the first draw is extra
+            self.assertEqual(events, arrivals + 1)
+
+            state["participant_next_arrival"] = 1000
+            state["sentiment"] = 9
+            ans = GenerateNewParticipant.p_next_arrival(None, 0, 0, state)
+            self.assertEqual(ans["arrival_rate"], 1)
+            self.assertTrue(ans["new_participant"])
+            self.assertIsNotNone(ans["new_participant_tokens"])
+        finally:
+            set_rng(previous)
+
     def test_su_add_to_network(self):
         """
         Test that the state update function did add the Participant to the
         network, and that the network maintained its integrity (i.e. all edges
         were properly setup)
         """
-        with patch("network_utils.influence") as p:
-            p.return_value = 0.8
+        with patch("network_utils.draw_influences") as p:
+            p.side_effect = lambda n_pairs: (
+                np.arange(n_pairs), np.full(n_pairs, 0.8))
 
             n_old_len = len(self.network.nodes)
 
@@ -65,6 +110,34 @@ class TestGenerateNewParticipant(unittest.TestCase):
                 self.assertEqual(network.edges[u, v]["type"], "influence")
 
 
+class TestInfluencedSentiment(unittest.TestCase):
+    def test_su_propagate_sentiment(self):
+        with patch('network_utils.draw_influences') as mock:
+            mock.side_effect = lambda n_pairs: (
+                np.arange(n_pairs), np.ones(n_pairs))
+            network = bootstrap_network([TokenBatch(1000) for _ in range(4)],
+                                        1, 3000, 4e6)
+        sentiments = [p.sentiment for _, p in get_participants(network)]
+
+        _, network = InfluencedSentiment.su_propagate_sentiment(
+            {}, 0, [], {"network": network}, {})
+
+        # everyone influences everyone else equally
+        for i, (_, p) in enumerate(get_participants(network)):
+            others = np.mean(sentiments[:i] + sentiments[i+1:])
+            self.assertAlmostEqual(
+                p.sentiment, sentiments[i] + config.sentiment_decay*(others - sentiments[i]))
+
+        # unless the params say otherwise
+        sentiments = [p.sentiment for _, p in get_participants(network)]
+        _, network = InfluencedSentiment.su_propagate_sentiment(
+            {"sentiment_decay": 0.5}, 0, [], {"network": network}, {})
+        for i, (_, p) in enumerate(get_participants(network)):
+            others = np.mean(sentiments[:i] + sentiments[i+1:])
+            self.assertAlmostEqual(
+                p.sentiment, sentiments[i] + 0.5*(others - sentiments[i]))
+
+
 class TestGenerateNewProposal(unittest.TestCase):
     def setUp(self):
         self.network = bootstrap_network([TokenBatch(1000, VestingOptions(10, 30))
@@ -167,3 +240,102 @@ class TestActiveProposals(unittest.TestCase):
                          ["item"].status, ProposalStatus.FAILED)
         self.assertEqual(network1.nodes[5]
                          ["item"].status, ProposalStatus.FAILED)
+
+
+class TestCandidateProposals(unittest.TestCase):
+    def setUp(self):
+        self.commons = Commons(10000, 1000)
+        self.network = bootstrap_network([TokenBatch(1000, VestingOptions(10, 30))
+                                          for _ in range(4)], 2, 3000, 4e6)
+        self.network.nodes[4]["item"].funds_requested = 100
+        self.network.nodes[5]["item"].funds_requested = 100
+        self.support = get_support_matrix(self.network)
+        self.state = {"network": self.network, "commons": self.commons,
+                      "funding_pool": 2000, "token_supply": 1000}
+        self.params = {"alpha": 0.5, "min_proposal_age_days": 0}
+
+    def test_p_compute_conviction(self):
+        """
+        Conviction should be accumulated as alpha * old conviction + tokens,
+        and only the Proposal with enough conviction should pass.
+        """
+        self.support.conviction[:] = 10
+        self.support[0, 4]["tokens"] = 1000
+
+        ans = CandidateProposals.p_compute_conviction(
+            self.params, 0, 0, self.state)
+        self.assertEqual(ans["conviction"][0, 0], 1005)
+        self.assertEqual(ans["conviction"][1, 1], 5)
+        self.assertEqual(ans["proposals_passed"], [4])
+        # the policy itself must not change the network
+        self.assertEqual(self.support[0, 4]["conviction"], 10)
+
+    def test_p_compute_conviction_stops_when_funds_run_out(self):
+        """
+        Every Proposal asks for 19% of the funding pool, so only 5 of them can
+        be funded even though all of them have enough conviction.
+        """
+        for _ in range(4):
+            self.network, _ = add_proposal(self.network, Proposal(190, 0))
+        for j in range(4, 6):
+            self.network.nodes[j]["item"].funds_requested = 190
+        self.support.tokens[:] = 1e6
+        self.commons._funding_pool = 1000
+
+        ans = CandidateProposals.p_compute_conviction(
+            self.params, 0, 0, self.state)
+        self.assertEqual(ans["proposals_passed"], [4, 5, 6, 7, 8])
+
+    def test_p_compute_conviction_skips_what_it_cant_pay_for(self):
+        """
+        After five Proposals of 190, the 50 left can't pay for the next one,
+        but they can for the cheaper one after it.
+        """
+        for funds in [190, 190, 190, 100, 40]:
+            self.network, _ = add_proposal(self.network, Proposal(funds, 0))
+        for j in range(4, 6):
+            self.network.nodes[j]["item"].funds_requested = 190
+        self.support.tokens[:] = 1e6
+        self.commons._funding_pool = 1000
+
+        ans = CandidateProposals.p_compute_conviction(
+            self.params, 0, 0, self.state)
+        self.assertEqual(ans["proposals_passed"], [4, 5, 6, 7, 8, 10])
+
+    def test_p_compute_conviction_waits_for_min_proposal_age(self):
+        self.support[0, 4]["tokens"] = 1000
+        self.params["min_proposal_age_days"] = 2
+        self.network.nodes[4]["item"].age = 1
+        ans = CandidateProposals.p_compute_conviction(
+            self.params, 0, 0, self.state)
+        self.assertEqual(ans["proposals_passed"], [])
+
+        self.network.nodes[4]["item"].age = 2
+        ans = CandidateProposals.p_compute_conviction(
+            self.params, 0, 0, self.state)
+        self.assertEqual(ans["proposals_passed"], [4])
+
+    def test_su_rebalance_stakes(self):
+        _, network = CandidateProposals.su_rebalance_stakes(
+            None, 0, 0, self.state, {})
+        tokens = get_support_matrix(network).tokens
+        self.assertTrue(tokens.any())
+        np.testing.assert_allclose(tokens.sum(axis=1)[tokens.any(axis=1)], 1000)
+
+    def test_su_update_conviction(self):
+        conviction = np.arange(8, dtype=float).reshape(4, 2)
+        _, network = CandidateProposals.su_update_conviction(
+            None, 0, 0, self.state, {"conviction": conviction, "proposals_passed": [5]})
+
+        np.testing.assert_array_equal(
+            get_support_matrix(network).conviction, conviction)
+        self.assertEqual(network.nodes[4]["item"].conviction, 12)
+        self.assertEqual(network.nodes[5]["item"].conviction, 16)
+        self.assertEqual(network.nodes[5]["item"].status,
+                         ProposalStatus.ACTIVE)
+        self.assertEqual(network.nodes[4]["item"].age, 1)
+
+    def test_su_fund_passed_proposals(self):
+        _, commons = CandidateProposals.su_fund_passed_proposals(
+            None, 0, 0, self.state, {"proposals_passed": [4, 5]})
+        self.assertEqual(commons._funding_pool, 1800)
@@ -1,52 +1,165 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-# In[1]:
+"""
+Runs the Commons simulation once from the command line:
 
+    python simulation.py --timesteps 150 --seed 42 --csv results.csv
+
+or many times from Python, with run_sweep().
+
+Importing this module has no side effects and is kept cheap, because every
+worker process of a sweep imports it: pandas and cadCAD are only imported
+once a simulation actually runs.
+"""
+import argparse
+import itertools
+import pickle
+from typing import Dict, List
 
-import networkx as nx
 import numpy as np
-import pandas as pd
-import datetime
-from hatch import create_token_batches, TokenBatch, Commons
+
+from checkpoint import Checkpointer, load_checkpoint
 from convictionvoting import trigger_threshold
-from policies import *
-from network_utils import *
-from IPython.core.debugger import set_trace
-from entities import Participant, Proposal
-from cadCAD.configuration import Configuration
-from cadCAD.engine import ExecutionMode, ExecutionContext, Executor
+from entities import advance_proposal_ids, next_proposal_id
+from executor import run as run_natively
+from hatch import Commons, create_token_batches
+from instrumentation import Profiler
+from metrics import MetricsRecorder
+from network_utils import bootstrap_network
+from policies import (CandidateProposals, GenerateNewFunding,
+                      GenerateNewParticipant, GenerateNewProposal,
+                      InfluencedSentiment)
+from utils import RandomStream, get_rng, set_in_place, set_rng
+
+
+def update_collateral_pool(params, step, sL, s, _input):
+    commons = s["commons"]
+    s["collateral_pool"] = commons._collateral_pool
+    return "collateral_pool", commons._collateral_pool
+
+
+def update_token_supply(params, step, sL, s, _input):
+    commons = s["commons"]
+    s["token_supply"] = commons._token_supply
+    return "token_supply", commons._token_supply
+
 
+def update_funding_pool(params, step, sL, s, _input):
+    commons = s["commons"]
+    s["funding_pool"] = commons._funding_pool
+    return "funding_pool", commons._funding_pool
+
+
+partial_state_update_blocks = [
+    {
+        "policies": {
+            "generate_new_participants": GenerateNewParticipant.p_randomly,
+        },
+        'variables': {
+            'network': GenerateNewParticipant.su_add_to_network,
+            'commons': GenerateNewParticipant.su_add_investment_to_commons,
+        }
+    },
+    {
+        "policies": {},
+        "variables": {
+            "funding_pool": update_funding_pool,
+            "collateral_pool": update_collateral_pool,
+            "token_supply": update_token_supply,
+        }
+    },
+    {
+        "policies": {},
+        "variables": {
+            "network": InfluencedSentiment.su_propagate_sentiment,
+        }
+    },
+    {
+        "policies": {
+            "generate_new_proposals": GenerateNewProposal.p_randomly,
+        },
+        "variables": {
+            "network": GenerateNewProposal.su_add_to_network,
+        }
+    },
+    {
+        "policies": {
+            "generate_new_funding": GenerateNewFunding.p_exit_tribute_of_average_speculator_position_size,
+        },
+        "variables": {
+            "network": GenerateNewFunding.su_add_funding,
+        }
+    },
+    {
+        "policies": {},
+        "variables": {
+            "network": CandidateProposals.su_rebalance_stakes,
+        }
+    },
+    {
+        "policies": {
+            "calculate_conviction": CandidateProposals.p_compute_conviction,
+        },
+        "variables": {
+            "network": CandidateProposals.su_update_conviction,
+            "commons": CandidateProposals.su_fund_passed_proposals,
+        }
+    },
+]
 
-def run_simulation():
-    def update_collateral_pool(params, step, sL, s, _input):
-        commons = s["commons"]
-        s["collateral_pool"] = commons._collateral_pool
-        return "collateral_pool", commons._collateral_pool
+# The same, except that new Participants arrive on a schedule drawn ahead of
+# time rather than by a coin flipped every timestep (see
+# GenerateNewParticipant.p_next_arrival()). The native engine skips the state
+# update functions of the first block on timesteps without an arrival_event.
+event_driven_blocks = [
+    {
+        "policies": {
+            "generate_new_participants": GenerateNewParticipant.p_next_arrival,
+        },
+        "variables": {
+            "network": GenerateNewParticipant.su_add_to_network,
+            "commons": GenerateNewParticipant.su_add_investment_to_commons,
+            "participant_next_arrival": GenerateNewParticipant.su_next_arrival,
+            "participant_arrival_rate": GenerateNewParticipant.su_arrival_rate,
+        },
+        "event": "arrival_event",
+    },
+] + partial_state_update_blocks[1:]
 
-    def update_token_supply(params, step, sL, s, _input):
-        commons = s["commons"]
-        s["token_supply"] = commons._token_supply
-        return "token_supply", commons._token_supply
+# TODO: make it explicit that 1 timestep is 1 day
+default_params = {
+    "sentiment_decay": 0.01,  # termed mu in the state update function
+    "trigger_threshold": trigger_threshold,
+    "min_proposal_age_days": 7,  # minimum periods passed before a proposal can pass,
+    "sentiment_sensitivity": 0.75,
+    "alpha": 0.5,  # conviction voting parameter
+    'min_supp': 50,  # number of tokens that must be stake for a proposal to be a candidate
+    "exit_tribute": 0.35,
+    "kappa": 2,  # the exponent of the bonding curve
+}
 
-    def update_funding_pool(params, step, sL, s, _input):
-        commons = s["commons"]
-        s["funding_pool"] = commons._funding_pool
-        return "funding_pool", commons._funding_pool
+# The parameters that bootstrap_state() reads. Runs of a sweep that agree on
+# these can start from the same bootstrapped state.
+bootstrap_params = ["exit_tribute", "kappa"]
 
-    # In[3]:
 
+def bootstrap_state(params: Dict, n_hatchers=60, n_proposals=3) -> Dict:
+    """
+    Creates the hatch, the Commons and the network that a simulation run starts
+    out from. Draws from the current RandomStream (see utils.set_rng()).
+    """
     # contributions = [5e5, 5e5, 2.5e5]
-    contributions = [np.random.rand() * 10e5 for i in range(60)]
+    contributions = [get_rng().random() * 10e5 for i in range(n_hatchers)]
     token_batches, initial_token_supply = create_token_batches(
         contributions, 0.1, 60)
 
-    commons = Commons(sum(contributions),
-                      initial_token_supply, exit_tribute=0.35)
+    commons = Commons(sum(contributions), initial_token_supply,
+                      exit_tribute=params["exit_tribute"], kappa=params["kappa"])
     network = bootstrap_network(
-        token_batches, 3, commons._funding_pool, commons._token_supply)
+        token_batches, n_proposals, commons._funding_pool, commons._token_supply)
 
-    initial_conditions = {
+    return {
         "network": network,
         "commons": commons,
         "funding_pool": commons._funding_pool,
@@ -55,96 +168,254 @@ def run_simulation():
         "sentiment": 0.5,
     }
 
-    partial_state_update_blocks = [
-        {
-            "policies": {
-                "generate_new_participants": GenerateNewParticipant.p_randomly,
-            },
-            'variables': {
-                'network': GenerateNewParticipant.su_add_to_network,
-                'commons': GenerateNewParticipant.su_add_investment_to_commons,
-            }
-        },
-        {
-            "policies": {},
-            "variables": {
-                "funding_pool": update_funding_pool,
-                "collateral_pool": update_collateral_pool,
-                "token_supply": update_token_supply,
-            }
-        },
-        {
-            "policies": {
-                "generate_new_proposals": GenerateNewProposal.p_randomly,
-            },
-            "variables": {
-                "network": GenerateNewProposal.su_add_to_network,
-            }
-        },
-        {
-            "policies": {
-                "generate_new_funding": GenerateNewFunding.p_exit_tribute_of_average_speculator_position_size,
-            },
-            "variables": {
-                "network": GenerateNewFunding.su_add_funding,
-            }
-        },
-    ]
 
-    # In[4]:
+def _state_update_for_cadcad(update):
+    def state_update(params, step, sL, s, _input):
+        return update(params, step, sL, s, _input)
+    return state_update
+
+
+def _for_cadcad(partial_state_update_blocks: List[Dict]) -> List[Dict]:
+    """
+    cadCAD tells how to call a state update function by how many arguments
+    its code takes, which bound methods (like MetricsRecorder.su_record())
+    and callable objects (like instrumentation.Timed) don't report the way it
+    expects. Returns a copy of partial_state_update_blocks in which every
+    state update function is called through a plain function instead.
+    """
+    return [{"policies": block["policies"],
+             "variables": {name: _state_update_for_cadcad(update)
+                           for name, update in block["variables"].items()}}
+            for block in partial_state_update_blocks]
+
+
+def run_simulation(params: Dict = None, timesteps=150, in_place=True, profiler: Profiler = None, engine="cadcad",
+                   checkpointer: Checkpointer = None, resume_from: str = None,
+                   initial_state: Dict = None, event_driven=False) -> "pd.DataFrame":
+    """
+    Runs the simulation once, with default_params overridden by params, and
+    returns the metrics (see metrics.default_metrics) recorded at the end of
+    every timestep.
+
+    With in_place, the network and the Commons are handed from substep to
+    substep instead of being copied each time (see utils.InPlace).
+
+    Given a Profiler, every policy and state update function is timed; see
+    Profiler.report() afterwards.
+
+    engine is "cadcad", or "native" for the lighter executor.run(), which
+    follows the same rules and gives the same results from the same seed.
+
+    Given a Checkpointer, the state is saved at its timesteps. resume_from
+    is the path of such a checkpoint, to carry on from (up to timesteps) on
+    the native engine instead of bootstrapping a new state. It must be
+    resumed with the event_driven it was saved with.
+
+    initial_state is a state made by bootstrap_state() to start from instead
+    of making a new one. The run changes it, so hand every run its own.
+
+    With event_driven, the simulation runs on event_driven_blocks rather than
+    partial_state_update_blocks: the same model, with different random draws.
+    """
+    if engine not in ("cadcad", "native"):
+        raise ValueError("Unknown engine {}".format(engine))
+
+    params = {**default_params, **(params or {})}
+    if resume_from is None:
+        if initial_state is None:
+            initial_state = bootstrap_state(params)
+        initial_conditions = set_in_place(initial_state, in_place)
+        recorder = MetricsRecorder(timesteps)
+        initial_conditions["metrics"] = recorder
+    else:
+        if engine != "native":
+            raise ValueError(
+                "Only the native engine can resume from a checkpoint")
+        initial_conditions = load_checkpoint(resume_from)
+        recorder = initial_conditions["metrics"]
+        # A checkpoint of an event driven run carries its arrival schedule
+        if event_driven != ("participant_next_arrival" in initial_conditions):
+            raise ValueError("{} was saved by a run with event_driven={}".format(
+                resume_from, not event_driven))
 
-    # TODO: make it explicit that 1 timestep is 1 day
     simulation_parameters = {
-        'T': range(150),
+        'T': range(timesteps - initial_conditions.get("timestep", 0)),
         'N': 1,
-        'M': {
-            "sentiment_decay": 0.01,  # termed mu in the state update function
-            "trigger_threshold": trigger_threshold,
-            "min_proposal_age_days": 7,  # minimum periods passed before a proposal can pass,
-            "sentiment_sensitivity": 0.75,
-            "alpha": 0.5,  # conviction voting parameter
-            'min_supp': 50,  # number of tokens that must be stake for a proposal to be a candidate
-        }
+        'M': params,
     }
 
-    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-    # The configurations above are then packaged into a `Configuration` object
-    config = Configuration(initial_state=initial_conditions,  # dict containing variable names and initial values
-                           # dict containing state update functions
-                           partial_state_update_blocks=partial_state_update_blocks,
-                           sim_config=simulation_parameters  # dict containing simulation parameters
-                           )
+    if event_driven:
+        initial_conditions.setdefault("participant_next_arrival", None)
+        initial_conditions.setdefault("participant_arrival_rate", None)
+        blocks = event_driven_blocks
+    else:
+        blocks = partial_state_update_blocks
+    blocks = recorder.attach(blocks)
+    if checkpointer is not None:
+        initial_conditions["checkpoints"] = checkpointer
+        blocks = checkpointer.attach(blocks)
+    if profiler is not None:
+        blocks = profiler.wrap(blocks)
+
+    if engine == "native":
+        run_natively(initial_conditions, blocks, simulation_parameters)
+        return recorder.to_dataframe()
+
+    from cadCAD.configuration import Experiment
+    from cadCAD.engine import ExecutionContext, ExecutionMode, Executor
+
+    experiment = Experiment()
+    experiment.append_model(initial_state=initial_conditions,
+                            partial_state_update_blocks=_for_cadcad(blocks),
+                            sim_configs=simulation_parameters)
+    # Parallelism happens one level up, in run_sweep(), so that every run can
+    # get its own RandomStream.
+    exec_context = ExecutionContext(ExecutionMode().single_mode)
+    executor = Executor(exec_context=exec_context,
+                        configs=experiment.configs, supress_print=True)
+    # Everything we need is in the recorder, don't hold on to cadCAD's copies
+    # of the whole state.
+    executor.execute()
+    return recorder.to_dataframe()
+
+
+# The pickled bootstrapped states of a shared prefix sweep, by the values of
+# bootstrap_params, as handed to every worker process by _set_prefixes()
+_prefixes = {}
+
+
+def _set_prefixes(prefixes: Dict, next_proposal_id: int):
+    """
+    Initializes a worker process. next_proposal_id is the id of the first
+    Proposal made after the prefixes were bootstrapped: a worker that was
+    spawned rather than forked starts counting Proposals from 0 again, and
+    would give new Proposals the ids of those in the prefixes.
+    """
+    global _prefixes
+    _prefixes = prefixes
+    advance_proposal_ids(next_proposal_id)
+
+
+def _bootstrap_key(params: Dict) -> tuple:
+    params = {**default_params, **params}
+    return tuple(params[name] for name in bootstrap_params)
+
+
+def _bootstrap_prefixes(combinations: List[Dict], seed_sequence: np.random.SeedSequence) -> Dict[tuple, bytes]:
+    """
+    Bootstraps a state for every distinct combination of bootstrap_params,
+    each from its own RandomStream spawned from seed_sequence, and pickles it.
+    Unpickling a state is a cheaper way to clone it than copy.deepcopy().
+    """
+    keys = list(dict.fromkeys(_bootstrap_key(params)
+                              for params in combinations))
+    prefixes = {}
+    for key, s in zip(keys, seed_sequence.spawn(len(keys))):
+        previous = set_rng(RandomStream(s))
+        try:
+            state = bootstrap_state(
+                {**default_params, **dict(zip(bootstrap_params, key))})
+        finally:
+            set_rng(previous)
+        prefixes[key] = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    return prefixes
+
+
+def _run_sweep_job(job) -> "pd.DataFrame":
+    run, params, replica, seed_sequence, timesteps, engine, prefix, event_driven = job
+    set_rng(RandomStream(seed_sequence))
+    initial_state = None if prefix is None else pickle.loads(_prefixes[prefix])
+    df = run_simulation(params, timesteps, engine=engine,
+                        initial_state=initial_state, event_driven=event_driven)
+
+    df.insert(0, "run", run)
+    df.insert(1, "replica", replica)
+    for name, value in params.items():
+        df[name] = value
+    return df
+
+
+def run_sweep(param_grid: Dict[str, List], replicas=1, timesteps=150, seed=None, processes=None, engine="cadcad",
+              shared_prefix=False, event_driven=False) -> "pd.DataFrame":
+    """
+    Runs the simulation replicas times for every combination of the parameter
+    values in param_grid, e.g. {"alpha": [0.5, 0.9], "kappa": [2, 3]}, on a
+    pool of processes (by default one per core).
+
+    Every run gets its own RandomStream, spawned from seed, so runs are
+    independent of each other but the whole sweep can be repeated exactly.
+
+    With shared_prefix, the hatch and the network are bootstrapped once for
+    every combination of bootstrap_params in param_grid rather than once for
+    every run, and all the runs that share it start from their own copy of
+    it. Worker processes are handed the bootstrapped states when they start.
+
+    event_driven is handed on to run_simulation().
+
+    Returns a table with one row per run and timestep, holding the recorded
+    metrics and the swept parameters.
+    """
+    from concurrent.futures import ProcessPoolExecutor
 
-    exec_mode = ExecutionMode()
-    # Do not use multi_proc, breaks ipdb.set_trace()
-    exec_context = ExecutionContext(exec_mode.single_proc)
-    # Pass the configuration object inside an array
-    executor = Executor(exec_context, [config])
-    # The `execute()` method returns a tuple; its first elements contains the raw results
-    raw_result, tensor = executor.execute()
+    import pandas as pd
 
-    # In[5]:
+    names = list(param_grid)
+    combinations = [dict(zip(names, values))
+                    for values in itertools.product(*param_grid.values())]
+    root = np.random.SeedSequence(seed)
+    seed_sequences = root.spawn(len(combinations)*replicas)
+    prefixes = _bootstrap_prefixes(combinations, root) if shared_prefix else {}
 
-    df = pd.DataFrame(raw_result)
-    df_final = df[df.substep.eq(2)]
+    jobs = []
+    for params in combinations:
+        prefix = _bootstrap_key(params) if shared_prefix else None
+        for replica in range(replicas):
+            run = len(jobs)
+            jobs.append((run, params, replica, seed_sequences[run],
+                         timesteps, engine, prefix, event_driven))
 
-    # In[6]:
+    with ProcessPoolExecutor(processes, initializer=_set_prefixes,
+                             initargs=(prefixes, next_proposal_id())) as pool:
+        results = list(pool.map(_run_sweep_job, jobs))
+    return pd.concat(results, ignore_index=True)
 
-    df_final.plot("timestep", "collateral_pool", grid=True)
-    df_final.plot("timestep", "token_supply", grid=True)
-    df_final.plot("timestep", "funding_pool", grid=True)
 
-    # In[7]:
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Commons simulation.")
+    parser.add_argument("--timesteps", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the RandomStream, for repeatable runs")
+    parser.add_argument("--csv", default=None,
+                        help="write the results to this CSV file")
+    parser.add_argument("--plot", action="store_true",
+                        help="plot the pools and the token supply")
+    parser.add_argument("--engine", choices=["cadcad", "native"], default="cadcad",
+                        help="run on cadCAD or on the lighter native executor")
+    parser.add_argument("--event-driven", action="store_true",
+                        help="draw when new Participants arrive ahead of time")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every policy and state update function")
+    args = parser.parse_args(argv)
 
-    # import matplotlib.pyplot as plt
-    # supporters = get_edges_by_type(network, 'support')
-    # influencers = get_edges_by_type(network, 'influence')
-    # competitors = get_edges_by_type(network, 'conflict')
+    set_rng(RandomStream(args.seed))
+    profiler = Profiler() if args.profile else None
+    df_final = run_simulation(
+        timesteps=args.timesteps, profiler=profiler, engine=args.engine,
+        event_driven=args.event_driven)
+    if profiler:
+        print(profiler.report())
+    if args.csv:
+        df_final.to_csv(args.csv, index=False)
 
-    # nx.draw_kamada_kawai(network, nodelist = get_participants(network), edgelist=influencers)
-    # plt.title('Participants Social Network')
+    if args.plot:
+        import matplotlib.pyplot as plt
 
-    # In[ ]:
+        df_final.plot("timestep", "collateral_pool", grid=True)
+        df_final.plot("timestep", "token_supply", grid=True)
+        df_final.plot("timestep", "funding_pool", grid=True)
+        plt.show()
+    return df_final
 
 
-run_simulation()
+if __name__ == "__main__":
+    main()
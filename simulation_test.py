@@ -0,0 +1,147 @@
+import itertools
+import pickle
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+
+import entities
+import simulation
+from entities import Proposal
+from network_utils import get_proposals
+from utils import RandomStream, set_rng
+
+# Every worker process of a sweep pays this, so keep an eye on it. Most of it
+# is numpy and networkx.
+IMPORT_TIME_BUDGET = 1.0  # seconds
+
+HEAVY_MODULES = ["pandas", "cadCAD", "scipy", "IPython", "matplotlib"]
+
+
+class TestImport(unittest.TestCase):
+    def test_import_is_fast_and_has_no_side_effects(self):
+        code = "\n".join([
+            "import sys, time",
+            "t = time.perf_counter()",
+            "import simulation",
+            "print(time.perf_counter() - t)",
+            "print(','.join(m for m in {} if m in sys.modules))".format(
+                HEAVY_MODULES),
+        ])
+        out = subprocess.run([sys.executable, "-c", code],
+                             capture_output=True, text=True, check=True).stdout
+        import_time, heavy_modules = out.splitlines()
+
+        self.assertLess(float(import_time), IMPORT_TIME_BUDGET)
+        self.assertEqual(heavy_modules, "")
+
+
+class TestRunSimulation(unittest.TestCase):
+    def run_seeded(self, seed, **kwargs):
+        previous = set_rng(RandomStream(seed))
+        try:
+            return simulation.run_simulation(**kwargs)
+        finally:
+            set_rng(previous)
+
+    def test_native_engine(self):
+        df = self.run_seeded(3, timesteps=20, engine="native")
+        self.assertEqual(list(df["timestep"]), list(range(1, 21)))
+        self.assertFalse(df.isna().any().any())
+        self.assertTrue(df.equals(self.run_seeded(
+            3, timesteps=20, engine="native")))
+
+    def test_proposals_get_funded(self):
+        df = self.run_seeded(1, timesteps=20, engine="native")
+        self.assertGreater(df["proposals_active"].max(), 0)
+        self.assertLess(df["funding_pool"].min(), df["funding_pool"][0])
+
+    def test_event_driven(self):
+        df = self.run_seeded(3, timesteps=20, engine="native", event_driven=True)
+        self.assertEqual(list(df["timestep"]), list(range(1, 21)))
+        self.assertFalse(df.isna().any().any())
+        self.assertTrue(df.equals(self.run_seeded(
+            3, timesteps=20, engine="native", event_driven=True)))
+
+    def test_engines_agree(self):
+        for kwargs in [{}, {"event_driven": True}, {"in_place": False}]:
+            from_cadcad = self.run_seeded(4, timesteps=10, engine="cadcad", **kwargs)
+            from_native = self.run_seeded(4, timesteps=10, engine="native", **kwargs)
+            self.assertEqual(list(from_cadcad["timestep"]), list(range(1, 11)))
+            np.testing.assert_allclose(from_cadcad.to_numpy(), from_native.to_numpy())
+
+    def test_records_the_end_of_every_timestep(self):
+        set_rng(RandomStream(1))
+        state = simulation.bootstrap_state(simulation.default_params)
+        df = self.run_seeded(1, timesteps=20, engine="native", initial_state=state)
+        commons = state["commons"]
+        self.assertEqual(df["funding_pool"].iloc[-1], commons._funding_pool)
+        self.assertEqual(df["collateral_pool"].iloc[-1], commons._collateral_pool)
+        self.assertEqual(df["token_supply"].iloc[-1], commons._token_supply)
+        self.assertGreater(df["sentiment"].nunique(), 1)
+
+    def test_initial_state(self):
+        set_rng(RandomStream(5))
+        prefix = pickle.dumps(simulation.bootstrap_state(
+            simulation.default_params))
+        runs = [self.run_seeded(6, timesteps=10, engine="native",
+                                initial_state=pickle.loads(prefix)) for _ in range(2)]
+        self.assertTrue(runs[0].equals(runs[1]))
+
+
+class TestRunSweep(unittest.TestCase):
+    def test_bootstrap_prefixes(self):
+        combinations = [{"alpha": 0.5, "kappa": 2}, {"alpha": 0.9, "kappa": 2},
+                        {"alpha": 0.5, "kappa": 3}]
+        prefixes = simulation._bootstrap_prefixes(
+            combinations, np.random.SeedSequence(1))
+        self.assertEqual(list(prefixes), [(0.35, 2), (0.35, 3)])
+        self.assertEqual(pickle.loads(prefixes[0.35, 3])["commons"].bonding_curve.kappa, 3)
+
+    def test_spawned_workers_dont_reuse_proposal_ids(self):
+        prefixes = simulation._bootstrap_prefixes(
+            [{"kappa": 2}], np.random.SeedSequence(1))
+        next_id = entities.next_proposal_id()
+        previous = entities._proposal_ids
+        # a worker that was spawned imports entities anew
+        entities._proposal_ids = itertools.count()
+        try:
+            simulation._set_prefixes(prefixes, next_id)
+            state = pickle.loads(prefixes[0.35, 2])
+            ids = {p.uuid for _, p in get_proposals(state["network"])}
+            self.assertNotIn(Proposal(10, 5).uuid, ids)
+        finally:
+            entities._proposal_ids = previous
+
+    def test_shared_prefix(self):
+        def sweep():
+            return simulation.run_sweep({"alpha": [0.5, 0.9]}, replicas=2, timesteps=3,
+                                        seed=2, processes=2, engine="native", shared_prefix=True)
+        df = sweep()
+        self.assertEqual(sorted(df["run"].unique()), [0, 1, 2, 3])
+        self.assertTrue(df.equals(sweep()))
+
+    def test_event_driven(self):
+        df = simulation.run_sweep({"alpha": [0.5]}, replicas=2, timesteps=20, seed=2,
+                                  processes=2, engine="native", event_driven=True)
+        previous = set_rng(RandomStream(np.random.SeedSequence(2).spawn(2)[1]))
+        try:
+            expected = simulation.run_simulation(
+                {"alpha": 0.5}, 20, engine="native", event_driven=True)
+        finally:
+            set_rng(previous)
+        replica = df[df["replica"] == 1].drop(columns=["run", "replica", "alpha"])
+        self.assertTrue(replica.reset_index(drop=True).equals(expected))
+
+    def test_default_engine(self):
+        df = simulation.run_sweep({"alpha": [0.5, 0.9]}, timesteps=3, seed=2, processes=2)
+        self.assertEqual(sorted(df["run"].unique()), [0, 1])
+        self.assertEqual(list(df["timestep"]), [1, 2, 3]*2)
+        self.assertFalse(df.isna().any().any())
+        self.assertTrue(df.equals(simulation.run_sweep(
+            {"alpha": [0.5, 0.9]}, timesteps=3, seed=2, processes=2, engine="native")))
+
+
+if __name__ == '__main__':
+    unittest.main()
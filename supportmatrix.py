@@ -0,0 +1,324 @@
+from collections.abc import MutableMapping, Set
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+from entities import vote_cutoff
+
+
+class RunningMedian:
+    """
+    Keeps track of the median of a multiset of numbers that values are added
+    to and removed from, without sorting it again every time: the values are
+    kept sorted in a NumPy array, and the ones added or removed since the last
+    median() are only collected, to be merged into it with one searchsorted()
+    and one insert() or delete() when the median is asked for. Adding a row or
+    column of the SupportMatrix thus costs no more than copying it.
+    """
+
+    def __init__(self, values: Iterable[float] = ()):
+        self._sorted = np.sort(np.asarray(values, dtype=float).ravel())
+        self._added = []
+        self._removed = []
+        self._n = len(self._sorted)
+
+    @classmethod
+    def from_sorted(cls, values: np.ndarray):
+        """
+        A RunningMedian of values, which must already be sorted, e.g. the
+        sorted_values of another one.
+        """
+        median = cls()
+        median._sorted = values
+        median._n = len(values)
+        return median
+
+    def __len__(self):
+        return self._n
+
+    def add(self, value: float):
+        self.extend([value])
+
+    def extend(self, values: Iterable[float]):
+        values = np.array(values, dtype=float).ravel()
+        self._added.append(values)
+        self._n += len(values)
+
+    def remove(self, value: float):
+        """
+        Removes one occurrence of value, which must have been added before.
+        """
+        self._removed.append(np.array([value], dtype=float))
+        self._n -= 1
+
+    def replace(self, old: float, new: float):
+        if old != new:
+            self.remove(old)
+            self.add(new)
+
+    @property
+    def sorted_values(self) -> np.ndarray:
+        self._merge()
+        return self._sorted
+
+    def median(self) -> float:
+        """
+        The median like np.median() computes it, i.e. the mean of the two
+        middle values if there is an even number of them.
+        """
+        if not len(self):
+            raise ValueError("median of an empty {}".format(
+                self.__class__.__name__))
+        values = self.sorted_values
+        middle = len(values) // 2
+        if len(values) % 2:
+            return float(values[middle])
+        return float((values[middle - 1] + values[middle]) / 2)
+
+    def _merge(self):
+        if self._added:
+            added = np.sort(np.concatenate(self._added))
+            self._added = []
+            if len(self._sorted):
+                self._sorted = np.insert(
+                    self._sorted, np.searchsorted(self._sorted, added), added)
+            else:
+                self._sorted = added
+        if self._removed:
+            removed = np.sort(np.concatenate(self._removed))
+            self._removed = []
+            # Repeated values are removed from consecutive positions
+            repeat = np.arange(len(removed)) - np.searchsorted(removed, removed)
+            at = np.searchsorted(self._sorted, removed) + repeat
+            if (at >= len(self._sorted)).any() or (self._sorted[at] != removed).any():
+                raise ValueError("removed a value that was never added")
+            self._sorted = np.delete(self._sorted, at)
+
+
+class SupportEdge(MutableMapping):
+    """
+    Stands in for the attribute dict of a single Participant -> Proposal
+    'support' edge, so that code written for networkx edges like
+    support[i, j]["affinity"] = 1 reads and writes the SupportMatrix directly.
+    """
+    __slots__ = ("matrix", "row", "col")
+
+    def __init__(self, matrix, row: int, col: int):
+        self.matrix = matrix
+        self.row = row
+        self.col = col
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, dict(self))
+
+    def __getitem__(self, key):
+        if key == "type":
+            return "support"
+        if key not in SupportMatrix.columns:
+            raise KeyError(key)
+        return getattr(self.matrix, "_" + key)[self.row, self.col]
+
+    def __setitem__(self, key, value):
+        if key not in SupportMatrix.columns:
+            raise KeyError(
+                "{} cannot be set on a support edge".format(key))
+        column = getattr(self.matrix, "_" + key)
+        if key == "affinity":
+            self.matrix.affinity_median.replace(
+                column[self.row, self.col], float(value))
+        column[self.row, self.col] = value
+
+    def __delitem__(self, key):
+        raise KeyError("{} cannot be deleted from a support edge".format(key))
+
+    def __iter__(self):
+        yield from SupportMatrix.columns
+        yield "type"
+
+    def __len__(self):
+        return len(SupportMatrix.columns) + 1
+
+
+class SupportEdgesView(Set):
+    """
+    A live, read only view of every (participant, proposal) pair in a
+    SupportMatrix, which behaves like the edge views networkx returns.
+    """
+    __slots__ = ("matrix",)
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return self.matrix.n_rows * self.matrix.n_cols
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        cols = self.matrix.col_nodes.tolist()
+        for i in self.matrix.row_nodes.tolist():
+            for j in cols:
+                yield i, j
+
+    def __contains__(self, edge):
+        return edge in self.matrix
+
+    def __getitem__(self, edge) -> SupportEdge:
+        return self.matrix[edge]
+
+    def data(self, data=True, default=None):
+        for i, j in self:
+            if data is True:
+                yield i, j, self.matrix[i, j]
+            elif data is False:
+                yield i, j
+            else:
+                yield i, j, self.matrix[i, j].get(data, default)
+
+
+class SupportMatrix:
+    """
+    Every Participant has a 'support' edge to every Proposal. Instead of
+    keeping one networkx edge with its own attribute dict for each of them,
+    the edge attributes are kept in dense NumPy arrays with one row per
+    Participant and one column per Proposal.
+
+    row_of and col_of map node indexes in the network to rows and columns. The
+    arrays are allocated with spare capacity which doubles whenever it runs
+    out, so adding a Participant or Proposal is amortized O(rows) or O(cols).
+
+    affinity_median follows the median of all affinities as they are added or
+    set through support[i, j]["affinity"]; writing to the affinity array
+    directly bypasses it.
+    """
+    columns = ("affinity", "tokens", "conviction")
+
+    def __init__(self, row_capacity: int = 16, col_capacity: int = 16):
+        self.row_of = {}
+        self.col_of = {}
+        self.n_rows = 0
+        self.n_cols = 0
+        self.affinity_median = RunningMedian()
+        self._row_nodes = np.zeros(row_capacity, dtype=int)
+        self._col_nodes = np.zeros(col_capacity, dtype=int)
+        for name in self.columns:
+            setattr(self, "_" + name,
+                    np.zeros((row_capacity, col_capacity), dtype=float))
+
+    def __repr__(self):
+        return "<{} {} Participants x {} Proposals>".format(self.__class__.__name__, self.n_rows, self.n_cols)
+
+    def __len__(self):
+        return self.n_rows * self.n_cols
+
+    def __contains__(self, edge):
+        i, j = edge
+        return i in self.row_of and j in self.col_of
+
+    def __getitem__(self, edge) -> SupportEdge:
+        i, j = edge
+        return SupportEdge(self, self.row_of[i], self.col_of[j])
+
+    @property
+    def row_nodes(self) -> np.ndarray:
+        return self._row_nodes[:self.n_rows]
+
+    @property
+    def col_nodes(self) -> np.ndarray:
+        return self._col_nodes[:self.n_cols]
+
+    @property
+    def affinity(self) -> np.ndarray:
+        return self._affinity[:self.n_rows, :self.n_cols]
+
+    @property
+    def tokens(self) -> np.ndarray:
+        return self._tokens[:self.n_rows, :self.n_cols]
+
+    @property
+    def conviction(self) -> np.ndarray:
+        return self._conviction[:self.n_rows, :self.n_cols]
+
+    def edges(self) -> SupportEdgesView:
+        return SupportEdgesView(self)
+
+    def _resize(self, row_capacity: int, col_capacity: int):
+        for name in self.columns:
+            old = getattr(self, "_" + name)
+            new = np.zeros((row_capacity, col_capacity), dtype=float)
+            new[:self.n_rows, :self.n_cols] = old[:self.n_rows, :self.n_cols]
+            setattr(self, "_" + name, new)
+        if row_capacity != len(self._row_nodes):
+            self._row_nodes = np.resize(self._row_nodes, row_capacity)
+        if col_capacity != len(self._col_nodes):
+            self._col_nodes = np.resize(self._col_nodes, col_capacity)
+
+    def add_participant(self, node: int, affinity: np.ndarray) -> int:
+        """
+        Adds a row for the Participant at node index node, with its affinity
+        to every Proposal already in the matrix. Returns the row.
+        """
+        row_capacity = len(self._row_nodes)
+        if self.n_rows == row_capacity:
+            self._resize(max(1, 2*row_capacity), len(self._col_nodes))
+        row = self.n_rows
+        self._affinity[row, :self.n_cols] = affinity
+        self.affinity_median.extend(self._affinity[row, :self.n_cols])
+        self._tokens[row, :self.n_cols] = 0
+        self._conviction[row, :self.n_cols] = 0
+        self._row_nodes[row] = node
+        self.row_of[node] = row
+        self.n_rows += 1
+        return row
+
+    def add_proposal(self, node: int, affinity: np.ndarray) -> int:
+        """
+        Adds a column for the Proposal at node index node, with the affinity
+        of every Participant already in the matrix towards it. Returns the
+        column.
+        """
+        col_capacity = len(self._col_nodes)
+        if self.n_cols == col_capacity:
+            self._resize(len(self._row_nodes), max(1, 2*col_capacity))
+        col = self.n_cols
+        self._affinity[:self.n_rows, col] = affinity
+        self.affinity_median.extend(self._affinity[:self.n_rows, col])
+        self._tokens[:self.n_rows, col] = 0
+        self._conviction[:self.n_rows, col] = 0
+        self._col_nodes[col] = node
+        self.col_of[node] = col
+        self.n_cols += 1
+        return col
+
+    def supported(self, cols: np.ndarray = None) -> np.ndarray:
+        """
+        Returns a boolean matrix shaped like affinity, True where a
+        Participant supports a Proposal: like when voting, those whose
+        affinity is above vote_cutoff() of the Participant's highest affinity.
+        cols is a boolean mask of the Proposals that can be supported at all,
+        by default every one.
+        """
+        if cols is None:
+            cols = np.ones(self.n_cols, dtype=bool)
+        affinity = np.where(cols, self.affinity, 0)
+        if not self.n_cols:
+            return np.zeros(affinity.shape, dtype=bool)
+        cutoff = vote_cutoff(affinity.max(axis=1))
+        return cols & (affinity > cutoff[:, None])
+
+    def rebalance(self, holdings: np.ndarray, supported: np.ndarray = None):
+        """
+        Spreads every Participant's holdings (one number per row) over the
+        Proposals they support, in proportion to their affinity to each, like
+        Participant.stake_across_all_supported_proposals() does for one
+        Participant, and writes the result into the tokens column.
+
+        supported is a boolean matrix shaped like affinity, and defaults to
+        supported(). Participants that support nothing end up with no tokens
+        staked.
+        """
+        if supported is None:
+            supported = self.supported()
+        weights = np.where(supported, self.affinity, 0)
+        totals = weights.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shares = np.where(totals > 0, weights / totals, 0)
+        self.tokens[...] = shares * np.asarray(holdings)[:, None]
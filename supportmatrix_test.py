@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+
+from supportmatrix import RunningMedian, SupportMatrix
+
+
+class TestSupportMatrix(unittest.TestCase):
+    def setUp(self):
+        self.support = SupportMatrix(row_capacity=1, col_capacity=1)
+
+    def test_grows_past_capacity(self):
+        """
+        Adding more Participants and Proposals than there is room for should
+        double the capacity and keep everything that was already there.
+        """
+        for i in range(5):
+            self.support.add_participant(i, np.full(self.support.n_cols, 0.1))
+        for j in range(5, 8):
+            self.support.add_proposal(
+                j, np.arange(self.support.n_rows, dtype=float))
+
+        self.assertEqual(self.support.affinity.shape, (5, 3))
+        self.assertEqual(len(self.support), 15)
+        self.assertEqual(self.support._affinity.shape, (8, 4))
+        np.testing.assert_array_equal(self.support.row_nodes, range(5))
+        np.testing.assert_array_equal(self.support.col_nodes, [5, 6, 7])
+        np.testing.assert_array_equal(self.support.affinity[:, 2], range(5))
+
+    def test_new_rows_and_cols_start_without_tokens(self):
+        self.support.add_participant(0, [])
+        self.support.add_proposal(1, [0.5])
+        self.support[0, 1]["tokens"] = 100
+        self.support[0, 1]["conviction"] = 50
+
+        self.support.add_participant(2, [0.7])
+        self.assertEqual(self.support[2, 1]["tokens"], 0)
+        self.assertEqual(self.support[2, 1]["conviction"], 0)
+        self.assertEqual(self.support[0, 1]["tokens"], 100)
+
+    def test_edge_accessor(self):
+        self.support.add_participant(0, [])
+        self.support.add_proposal(1, [0.5])
+
+        edge = self.support[0, 1]
+        self.assertEqual(dict(edge), {
+                         "affinity": 0.5, "tokens": 0, "conviction": 0, "type": "support"})
+        with self.assertRaises(KeyError):
+            edge["type"] = "influence"
+        with self.assertRaises(KeyError):
+            self.support[1, 0]
+
+    def test_edges_view(self):
+        self.support.add_participant(0, [])
+        self.support.add_participant(1, [])
+        self.support.add_proposal(2, [0.5, 0.5])
+
+        edges = self.support.edges()
+        self.assertEqual(list(edges), [(0, 2), (1, 2)])
+        self.assertIn((1, 2), edges)
+        self.assertNotIn((2, 1), edges)
+
+        self.support.add_proposal(3, [0.5, 0.5])
+        self.assertEqual(len(edges), 4)
+
+
+class TestRunningMedian(unittest.TestCase):
+    def test_matches_np_median(self):
+        rng = np.random.default_rng(0)
+        values = list(rng.integers(0, 10, size=5).astype(float))
+        median = RunningMedian(values)
+        for _ in range(300):
+            if values and rng.random() < 0.4:
+                median.remove(values.pop(rng.integers(len(values))))
+            else:
+                value = float(rng.integers(0, 10))
+                values.append(value)
+                median.add(value)
+            if values:
+                self.assertEqual(median.median(), np.median(values))
+            self.assertEqual(len(median), len(values))
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            RunningMedian().median()
+
+    def test_remove_unknown(self):
+        median = RunningMedian([1.0, 2.0])
+        median.remove(3.0)
+        with self.assertRaises(ValueError):
+            median.median()
+
+    def test_sorted_values(self):
+        median = RunningMedian([3.0, 1.0])
+        median.extend(np.array([2.0, 0.0]))
+        median.replace(3.0, 5.0)
+        np.testing.assert_array_equal(median.sorted_values, [0, 1, 2, 5])
+        self.assertEqual(
+            RunningMedian.from_sorted(median.sorted_values).median(), 1.5)
+
+    def test_follows_support_matrix_affinity(self):
+        support = SupportMatrix()
+        support.add_participant(0, [])
+        support.add_participant(1, [])
+        support.add_proposal(2, [0.1, 0.9])
+        support.add_participant(3, [0.3])
+        support[0, 2]["affinity"] = 0.5
+        self.assertEqual(support.affinity_median.median(),
+                         np.median(support.affinity))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,226 @@
+import copy
+import math
+from typing import List, Sequence
+
 import numpy as np
 
 
-def probability(rate):
+class InPlace:
+    """
+    Mixin for state variables like the network and the Commons, which the
+    state update functions change in place and then pass on.
+
+    cadCAD deep copies the whole state before every substep, which costs as
+    much as the network is big. Once in_place is set (see set_in_place()),
+    copy.copy() and copy.deepcopy() return the object itself, so that copying
+    the state only copies the scalar state variables. The flip side is that
+    every copy of the state refers to the same object, so keep track of
+    results with a metrics.MetricsRecorder rather than cadCAD's state history.
+    """
+    in_place = False
+
+    def __copy__(self):
+        if self.in_place:
+            return self
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        return new
+
+    def __deepcopy__(self, memo):
+        if self.in_place:
+            return self
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        new.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return new
+
+
+def set_in_place(state: dict, in_place: bool = True) -> dict:
+    """
+    Switches in place mode (see InPlace) on or off for every state variable
+    that supports it.
+    """
+    for value in state.values():
+        if isinstance(value, InPlace):
+            value.in_place = in_place
+    return state
+
+
+class RandomStream:
+    """
+    The source of randomness for the simulation, built on a
+    numpy.random.Generator.
+
+    Scalar draws are the most common kind in the simulation, and calling numpy
+    or scipy for each one of them is slow. So uniforms, exponentials and gammas
+    are drawn in blocks of block_size and handed out one at a time. Code that
+    needs whole arrays of random numbers should use .generator directly.
+
+    A RandomStream is seeded from a numpy.random.SeedSequence, and spawn()
+    gives independent child streams, e.g. one for every run of a parameter
+    sweep, so that runs are both independent and repeatable.
+    """
+
+    def __init__(self, seed=None, block_size: int = 1024):
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.generator = np.random.default_rng(self.seed_sequence)
+        self.block_size = block_size
+        self._uniforms = []
+        self._uniforms_used = 0
+        self._exponentials = []
+        self._exponentials_used = 0
+        self._gammas = {}
+
+    def __repr__(self):
+        return "<{} entropy={} spawn_key={}>".format(self.__class__.__name__, self.seed_sequence.entropy, self.seed_sequence.spawn_key)
+
+    def get_state(self) -> dict:
+        """
+        Everything needed to carry on drawing exactly the same numbers later,
+        as plain Python types (see from_state()).
+        """
+        return {
+            "entropy": self.seed_sequence.entropy,
+            "spawn_key": list(self.seed_sequence.spawn_key),
+            "n_children_spawned": self.seed_sequence.n_children_spawned,
+            "bit_generator": self.generator.bit_generator.state,
+            "block_size": self.block_size,
+            "uniforms": list(self._uniforms),
+            "uniforms_used": self._uniforms_used,
+            "exponentials": list(self._exponentials),
+            "exponentials_used": self._exponentials_used,
+            "gammas": [[shape, list(block), used] for shape, (block, used) in self._gammas.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "RandomStream":
+        seed_sequence = np.random.SeedSequence(
+            state["entropy"], spawn_key=tuple(state["spawn_key"]),
+            n_children_spawned=state["n_children_spawned"])
+        rng = cls(seed_sequence, state["block_size"])
+        rng.generator.bit_generator.state = state["bit_generator"]
+        rng._uniforms = list(state["uniforms"])
+        rng._uniforms_used = state["uniforms_used"]
+        rng._exponentials = list(state["exponentials"])
+        rng._exponentials_used = state["exponentials_used"]
+        rng._gammas = {shape: [list(block), used]
+                       for shape, block, used in state["gammas"]}
+        return rng
+
+    def spawn(self, n: int) -> List["RandomStream"]:
+        return [RandomStream(s, self.block_size) for s in self.seed_sequence.spawn(n)]
+
+    def random(self) -> float:
+        """
+        A uniform draw from [0, 1).
+        """
+        if self._uniforms_used == len(self._uniforms):
+            self._uniforms = self.generator.random(self.block_size).tolist()
+            self._uniforms_used = 0
+        self._uniforms_used += 1
+        return self._uniforms[self._uniforms_used - 1]
+
+    def exponential(self, scale: float = 1.0, loc: float = 0.0) -> float:
+        """
+        Same distribution as scipy.stats.expon.rvs(loc=loc, scale=scale).
+        """
+        if self._exponentials_used == len(self._exponentials):
+            self._exponentials = self.generator.standard_exponential(
+                self.block_size).tolist()
+            self._exponentials_used = 0
+        self._exponentials_used += 1
+        return loc + scale * self._exponentials[self._exponentials_used - 1]
+
+    def gamma(self, shape: float, scale: float = 1.0, loc: float = 0.0) -> float:
+        """
+        Same distribution as scipy.stats.gamma.rvs(shape, loc=loc, scale=scale).
+        Every shape gets its own block of draws.
+        """
+        block = self._gammas.get(shape)
+        if block is None or block[1] == len(block[0]):
+            block = [self.generator.standard_gamma(
+                shape, self.block_size).tolist(), 0]
+            self._gammas[shape] = block
+        block[1] += 1
+        return loc + scale * block[0][block[1] - 1]
+
+    def geometric(self, rate: float) -> int:
+        """
+        Same distribution as numpy.random.Generator.geometric(rate): the number
+        of coins flipped, up to and including the first one that comes up True
+        with probability rate.
+        """
+        if rate <= 0 or rate > 1.0:
+            raise Exception("Rate must be in (0, 1]")
+        return 1 + int(math.log1p(-self.random()) / math.log1p(-rate)) if rate < 1.0 else 1
+
+    def probability(self, rate: float) -> bool:
+        if rate > 1.0:
+            raise Exception("Rate has a maximum value of 1.0")
+        return self.random() < rate
+
+    def choice(self, seq: Sequence):
+        return seq[int(self.random() * len(seq))]
+
+
+_rng = RandomStream()
+
+
+def get_rng() -> RandomStream:
+    """
+    Returns the RandomStream that the simulation draws from unless told
+    otherwise.
+    """
+    return _rng
+
+
+def set_rng(rng: RandomStream) -> RandomStream:
+    """
+    Replaces the RandomStream that the simulation draws from, e.g. with a
+    seeded one at the start of a run. Returns the previous one.
+    """
+    global _rng
+    previous, _rng = _rng, rng
+    return previous
+
+
+def probability(rate, rng: RandomStream = None):
     """
     The higher the rate, the more likely this function will return True (up till 1.0)
-    Mock this function out to make behaviour deterministic.
+    Mock this function out, or pass a seeded RandomStream, to make behaviour
+    deterministic.
+    """
+    return (rng or _rng).probability(rate)
+
+
+def bernoulli_positions(n: int, rate: float, rng: RandomStream = None) -> np.ndarray:
+    """
+    Flips n coins which each come up True with probability rate, and returns
+    the (sorted) positions of the ones that did.
+
+    Instead of flipping every coin, it draws the gaps between successes from a
+    geometric distribution, so the work done is proportional to the number of
+    successes rather than to n.
     """
     if rate > 1.0:
         raise Exception("Rate has a maximum value of 1.0")
-    return np.random.rand() < rate
+    if n <= 0 or rate <= 0:
+        return np.empty(0, dtype=int)
+    if rate == 1.0:
+        return np.arange(n)
+
+    generator = (rng or _rng).generator
+    positions = []
+    last = -1
+    expected = n * rate
+    while last < n:
+        # Draw a few more gaps than expected, so that one round is enough most of the time
+        gaps = generator.geometric(rate, size=int(
+            expected + 5 * np.sqrt(expected) + 10))
+        chunk = last + np.cumsum(gaps)
+        positions.append(chunk[chunk < n])
+        last = chunk[-1]
+    return np.concatenate(positions)
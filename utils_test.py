@@ -1,5 +1,8 @@
 import unittest
+import copy
 import networkx as nx
+import numpy as np
+
 import utils
 
 
@@ -10,3 +13,100 @@ class TestUtils(unittest.TestCase):
 
         results2 = [utils.probability(1.0) for _ in range(2)]
         self.assertEqual(results2.count(True), 2)
+
+    def test_bernoulli_positions(self):
+        positions = utils.bernoulli_positions(100000, 0.25)
+        self.assertTrue(np.all(np.diff(positions) > 0))
+        self.assertTrue(np.all((positions >= 0) & (positions < 100000)))
+        # 25000 expected, with a standard deviation of about 137
+        self.assertAlmostEqual(len(positions), 25000, delta=1000)
+
+        np.testing.assert_array_equal(
+            utils.bernoulli_positions(5, 1.0), range(5))
+        self.assertEqual(len(utils.bernoulli_positions(5, 0)), 0)
+        self.assertEqual(len(utils.bernoulli_positions(0, 0.5)), 0)
+
+    def test_probability_with_seeded_stream(self):
+        rng1, rng2 = utils.RandomStream(42), utils.RandomStream(42)
+        self.assertEqual([utils.probability(0.5, rng1) for _ in range(50)],
+                         [utils.probability(0.5, rng2) for _ in range(50)])
+
+
+class TestRandomStream(unittest.TestCase):
+    def test_seeded_streams_repeat(self):
+        a, b = utils.RandomStream(1, block_size=8), utils.RandomStream(
+            1, block_size=8)
+        self.assertEqual([a.random() for _ in range(20)],
+                         [b.random() for _ in range(20)])
+        self.assertEqual([a.exponential(100) for _ in range(20)],
+                         [b.exponential(100) for _ in range(20)])
+        self.assertEqual([a.gamma(3, 10) for _ in range(20)],
+                         [b.gamma(3, 10) for _ in range(20)])
+
+    def test_spawned_streams_are_independent_and_repeatable(self):
+        children = utils.RandomStream(7).spawn(2)
+        again = utils.RandomStream(7).spawn(2)
+        first = [c.random() for c in children]
+        self.assertNotEqual(first[0], first[1])
+        self.assertEqual(first, [c.random() for c in again])
+
+    def test_distributions(self):
+        rng = utils.RandomStream(3)
+        exponentials = [rng.exponential(scale=200, loc=200)
+                        for _ in range(20000)]
+        self.assertGreaterEqual(min(exponentials), 200)
+        self.assertAlmostEqual(np.mean(exponentials), 400, delta=10)
+
+        gammas = [rng.gamma(3, scale=10, loc=1) for _ in range(20000)]
+        self.assertAlmostEqual(np.mean(gammas), 31, delta=1)
+
+        geometrics = [rng.geometric(0.2) for _ in range(20000)]
+        self.assertEqual(min(geometrics), 1)
+        self.assertAlmostEqual(np.mean(geometrics), 5, delta=0.2)
+        self.assertEqual(rng.geometric(1.0), 1)
+
+        with self.assertRaises(Exception):
+            rng.probability(1.5)
+
+    def test_set_rng(self):
+        rng = utils.RandomStream(5)
+        previous = utils.set_rng(rng)
+        try:
+            self.assertIs(utils.get_rng(), rng)
+        finally:
+            utils.set_rng(previous)
+
+
+class TestInPlace(unittest.TestCase):
+    def setUp(self):
+        from hatch import Commons, TokenBatch
+        from network_utils import create_network
+
+        self.network = create_network([TokenBatch(100), TokenBatch(200)])
+        self.state = {
+            "network": self.network,
+            "commons": Commons(1000, 1000),
+            "sentiment": 0.5,
+            "history": [1, 2],
+        }
+
+    def test_copies_by_default(self):
+        copied = copy.deepcopy(self.state)
+        self.assertIsNot(copied["network"], self.network)
+        self.assertIsNot(copied["commons"], self.state["commons"])
+        self.assertEqual(len(copied["network"]), len(self.network))
+        self.assertIsInstance(copied["network"], type(self.network))
+
+        copied["commons"].deposit(100)
+        self.assertEqual(self.state["commons"]._collateral_pool, 800)
+
+    def test_in_place_state_copies_only_the_rest(self):
+        utils.set_in_place(self.state)
+        copied = copy.deepcopy(self.state)
+        self.assertIs(copied["network"], self.network)
+        self.assertIs(copied["commons"], self.state["commons"])
+        self.assertIsNot(copied["history"], self.state["history"])
+        self.assertIs(copy.copy(self.network), self.network)
+
+        utils.set_in_place(self.state, False)
+        self.assertIsNot(copy.deepcopy(self.state)["network"], self.network)